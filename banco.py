@@ -1,15 +1,58 @@
 # banrep_flujo_completo.py
 import argparse
+import base64
+import csv
+import gzip
+import hashlib
+import html
+import http.client
+import io
+import json
+import math
+import multiprocessing as mp
+import multiprocessing.connection as mp_connection
+import os
+import queue
 import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 import unicodedata
+import urllib.parse
+import xml.etree.ElementTree as ET
+import zipfile
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import Future, TimeoutError as FuturoTimeout
+from itertools import chain
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from selenium import webdriver
-from selenium.webdriver.edge.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+# Selenium se importa al crear el primer driver (_cargar_selenium): lo que no abre
+# navegador (caché, motor directo, salidas, --servir-capturas) arranca sin cargarlo.
+webdriver = Options = EdgeService = By = WebDriverWait = EC = None
+TimeoutException = StaleElementReferenceException = WebDriverException = None
+
+def _cargar_selenium():
+    global webdriver, Options, EdgeService, By, WebDriverWait, EC
+    global TimeoutException, StaleElementReferenceException, WebDriverException
+    if webdriver is not None:
+        return
+    with fase("importar_selenium"):
+        from selenium import webdriver as _webdriver
+        from selenium.webdriver.edge.options import Options
+        from selenium.webdriver.edge.service import Service as EdgeService
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import (TimeoutException, StaleElementReferenceException,
+                                                WebDriverException)
+    webdriver = _webdriver
 
 URL_DEFAULT = (
     "https://suameca.banrep.gov.co/estadisticas-economicas-back/"
@@ -42,44 +85,375 @@ CODE_BY_NAME = {
     "yen japones": "JPY",
 }
 
+# =========================
+# Trazas: tiempo por fase y round trips de WebDriver
+# =========================
+class Traza:
+    """
+    Spans anidados por fase: duración, round trips al driver (por comando), bytes de
+    JS enviados y reintentos por StaleElementReference. Un span abierto acumula
+    también lo de sus hijos; el span raíz es la ejecución completa.
+    """
+
+    def __init__(self, nombre="run"):
+        self.nombre = nombre
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self._pila = []
+        self._raiz = self._abrir(nombre, {})
+
+    def _abrir(self, nombre, attrs):
+        span = dict(attrs, id=len(self.spans), fase=nombre,
+                    padre=self._pila[-1]["id"] if self._pila else None,
+                    inicio_ms=round((time.perf_counter() - self._t0) * 1000, 2),
+                    ms=None, round_trips=0, comandos={}, js_bytes=0, reintentos=0)
+        self.spans.append(span)
+        self._pila.append(span)
+        return span
+
+    @contextmanager
+    def fase(self, nombre, **attrs):
+        span = self._abrir(nombre, attrs)
+        t0 = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = repr(e)
+            raise
+        finally:
+            span["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            self._pila.remove(span)
+
+    def registrar(self, nombre, ms, **attrs):
+        """Span ya medido en otro lado (p.ej. pasos del barrido dentro del navegador)."""
+        span = self._abrir(nombre, attrs)
+        span["ms"] = ms
+        self._pila.remove(span)
+
+    def contar(self, comando, js_bytes=0):
+        for span in self._pila:
+            span["round_trips"] += 1
+            span["comandos"][comando] = span["comandos"].get(comando, 0) + 1
+            span["js_bytes"] += js_bytes
+
+    def reintento(self):
+        for span in self._pila:
+            span["reintentos"] += 1
+
+    def anexar(self, spans, **attrs):
+        """Agrega spans de otra traza (p.ej. de un worker del pool) bajo el span abierto."""
+        base, padre = len(self.spans), self._pila[-1]["id"]
+        for s in spans:
+            s = dict(s, **attrs)
+            s["id"] += base
+            s["padre"] = padre if s["padre"] is None else s["padre"] + base
+            self.spans.append(s)
+
+    def a_dict(self):
+        self._raiz["ms"] = round((time.perf_counter() - self._t0) * 1000, 2)
+        return {"nombre": self.nombre, "inicio": datetime.fromtimestamp(self.inicio).isoformat(timespec="seconds"),
+                "spans": self.spans, "resumen": resumen_trazas(self.spans)}
+
+    def guardar(self, ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.a_dict(), f, ensure_ascii=False, indent=1)
+
+def _percentil(valores, p):
+    # Rango más cercano sobre valores ya ordenados
+    if not valores: return None
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+def resumen_trazas(spans):
+    """Por fase: n, p50/p90/p99/máx de ms y de round trips, bytes de JS y reintentos totales."""
+    por_fase = {}
+    for s in spans:
+        if s.get("ms") is not None:
+            por_fase.setdefault(s["fase"], []).append(s)
+    out = {}
+    for nombre, grupo in por_fase.items():
+        ms = sorted(s["ms"] for s in grupo)
+        rt = sorted(s["round_trips"] for s in grupo)
+        out[nombre] = {"n": len(grupo),
+                       "ms": dict({f"p{p}": _percentil(ms, p) for p in (50, 90, 99)}, max=ms[-1]),
+                       "round_trips": {"p50": _percentil(rt, 50), "p90": _percentil(rt, 90), "max": rt[-1]},
+                       "js_bytes": sum(s["js_bytes"] for s in grupo),
+                       "reintentos": sum(s["reintentos"] for s in grupo)}
+    return out
+
+def imprimir_resumen(resumen, archivo=sys.stderr):
+    print(f"{'fase':<22}{'n':>5}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}{'rt p50':>8}{'reint.':>7}", file=archivo)
+    for nombre, r in sorted(resumen.items(), key=lambda kv: -kv[1]["ms"]["max"]):
+        print(f"{nombre:<22}{r['n']:>5}{r['ms']['p50']:>10.0f}{r['ms']['p90']:>10.0f}{r['ms']['max']:>10.0f}"
+              f"{r['round_trips']['p50']:>8}{r['reintentos']:>7}", file=archivo)
+
+_TRAZA = None  # traza activa del proceso (None = sin instrumentar)
+
+def iniciar_traza(nombre="run"):
+    global _TRAZA
+    _TRAZA = Traza(nombre)
+    return _TRAZA
+
+def fase(nombre, **attrs):
+    return _TRAZA.fase(nombre, **attrs) if _TRAZA else nullcontext()
+
+def _contar_reintento():
+    if _TRAZA: _TRAZA.reintento()
+
+def instrumentar_driver(driver):
+    """
+    Cuenta cada comando WebDriver (incluidos los de WebElement y CDP, que pasan
+    todos por driver.execute) en la traza activa al momento de la llamada.
+    """
+    original = driver.execute
+
+    def execute(comando, params=None):
+        if _TRAZA:
+            script = (params or {}).get("script")
+            _TRAZA.contar(comando, len(script.encode("utf-8")) if isinstance(script, str) else 0)
+        return original(comando, params)
+
+    driver.execute = execute
+    return driver
+
 # ================
 # Utilidades base
 # ================
-def build_driver():
+# Recursos que el grid no necesita; se bloquean por CDP en el perfil rápido
+URLS_BLOQUEADAS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.ogg", "*.wav",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*hotjar.com*", "*facebook.net*", "*clarity.ms*",
+]
+
+# Última ruta de msedgedriver que resolvió Selenium Manager (se reusa sin volver a buscar)
+RUTA_CACHE_MSEDGEDRIVER = os.environ.get("BANCO_MSEDGEDRIVER_CACHE") or os.path.join(
+    os.path.expanduser("~"), ".cache", "banco", "msedgedriver.json")
+
+def _leer_ruta_msedgedriver():
+    try:
+        with open(RUTA_CACHE_MSEDGEDRIVER, encoding="utf-8") as f:
+            ruta = json.load(f).get("ruta")
+    except (OSError, ValueError, AttributeError):
+        return None
+    return ruta if ruta and os.path.isfile(ruta) else None
+
+def _guardar_ruta_msedgedriver(driver):
+    ruta = getattr(getattr(driver, "service", None), "path", None)
+    if not ruta or not os.path.isfile(ruta) or ruta == _leer_ruta_msedgedriver():
+        return
+    try:
+        os.makedirs(os.path.dirname(RUTA_CACHE_MSEDGEDRIVER), exist_ok=True)
+        with open(RUTA_CACHE_MSEDGEDRIVER + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"ruta": ruta, "edge": driver.capabilities.get("browserVersion")}, f)
+        os.replace(RUTA_CACHE_MSEDGEDRIVER + ".tmp", RUTA_CACHE_MSEDGEDRIVER)
+    except OSError:
+        pass
+
+def _abrir_edge(opts):
+    """
+    webdriver.Edge con msedgedriver fijado ($BANCO_MSEDGEDRIVER, --msedgedriver) o
+    el que quedó guardado; sin ninguno, o si el guardado ya no sirve (Edge se
+    actualizó), lo resuelve Selenium Manager y se guarda para la próxima.
+    """
+    fijada = os.environ.get("BANCO_MSEDGEDRIVER")
+    ruta = fijada or _leer_ruta_msedgedriver()
+    if ruta:
+        try:
+            return webdriver.Edge(options=opts, service=EdgeService(executable_path=ruta))
+        except WebDriverException as e:
+            if fijada:
+                raise
+            print(f"[Driver] {ruta} no sirvió ({str(e).strip().splitlines()[0][:120]}); se resuelve de nuevo",
+                  file=sys.stderr)
+    driver = webdriver.Edge(options=opts)
+    _guardar_ruta_msedgedriver(driver)
+    return driver
+
+def _edge_escuchando(direccion, timeout=0.5):
+    """¿Hay un Edge con remote debugging en host:puerto?"""
+    host, _, puerto = direccion.rpartition(":")
+    try:
+        conn = http.client.HTTPConnection(host or "127.0.0.1", int(puerto), timeout=timeout)
+        conn.request("GET", "/json/version")
+        ok = conn.getresponse().status == 200
+        conn.close()
+        return ok
+    except (OSError, ValueError, http.client.HTTPException):
+        return False
+
+def _misma_pagina(a, b):
+    ua, ub = urllib.parse.urlsplit(a or ""), urllib.parse.urlsplit(b or "")
+    return (ua.netloc, ua.path) == (ub.netloc, ub.path) and \
+        urllib.parse.parse_qs(ua.query) == urllib.parse.parse_qs(ub.query)
+
+# Sesiones conectadas a un Edge abierto cuya pestaña ya estaba en el dashboard (ver adoptar_pestana)
+_ADOPTABLES = set()
+
+def _conectar_edge(direccion, url=None):
+    # Solo debuggerAddress: el resto de las opciones son de arranque y Edge ya arrancó
+    opts = Options()
+    opts.debugger_address = direccion
+    with fase("conectar_edge"):
+        driver = _abrir_edge(opts)
+    for h in driver.window_handles:
+        driver.switch_to.window(h)
+        if url and _misma_pagina(driver.current_url, url):
+            _ADOPTABLES.add(driver.session_id)
+            print(f"[Driver] Conectado a {direccion}; se reusa la pestaña del dashboard", file=sys.stderr)
+            return driver
+    # Sin pestaña del dashboard: una nueva, para no navegar la que el usuario tenga abierta
+    driver.switch_to.new_window("tab")
+    print(f"[Driver] Conectado a {direccion}; pestaña nueva", file=sys.stderr)
+    return driver
+
+def build_driver(headless=False, rapido=False, capturar_red=False, varias_pestanas=False, dir_perfil=None,
+                 dir_descargas=None, conectar=None, url=None):
+    """
+    headless: sin ventana, tamaño fijo suficiente para el grid y sin detach.
+    rapido: headless + bloqueo de imágenes, fuentes, media y analítica (CDP).
+    capturar_red: habilita el log de performance (para descubrir_consulta_directa).
+    varias_pestanas: sin frenar timers ni render de pestañas en segundo plano
+    (ejecutar_pestanas deja trabajando a todas a la vez).
+    dir_perfil: perfil de Edge persistente (user-data-dir) en vez de uno temporal:
+    la caché HTTP de los bundles de Oracle DV y el consentimiento de cookies
+    sobreviven entre corridas. Dos navegadores no pueden usar el mismo a la vez.
+    dir_descargas: adonde van las descargas, sin preguntar (exportación nativa del
+    grid); si no se da, exportar_grid usa uno temporal.
+    conectar: 'host:puerto' de un Edge con --remote-debugging-port. Si responde, se
+    conecta a él (reusando la pestaña que ya tenga `url`) y las demás opciones de
+    arranque no aplican; si no, arranca Edge con ese puerto para conectarse la próxima vez.
+    """
+    _cargar_selenium()
+    if conectar and _edge_escuchando(conectar):
+        driver = _conectar_edge(conectar, url)
+        _ESPERA_COOKIES[driver.session_id] = 0.0  # el Edge del usuario ya aceptó (o acepta él)
+        if _TRAZA:
+            instrumentar_driver(driver)
+        if dir_descargas:
+            preparar_descargas(driver, dir_descargas)
+        return driver
+    headless = headless or rapido
     opts = Options()
-    opts.add_argument("--start-maximized")
+    if headless:
+        opts.add_argument("--headless=new")
+        opts.add_argument("--window-size=1920,1080")
+    else:
+        opts.add_argument("--start-maximized")
     opts.add_argument("--disable-gpu")
     opts.add_argument("--disable-features=msEdgeBackgroundTabSuspension,msEdgeLazyLoad,WebUsb")
     opts.add_experimental_option("excludeSwitches", ["enable-logging", "enable-automation"])
-    opts.add_experimental_option("detach", True)  # NO cerrar Edge al finalizar
+    if not headless:
+        opts.add_experimental_option("detach", True)  # NO cerrar Edge al finalizar
+    prefs = {}
+    if rapido:
+        opts.add_argument("--disable-extensions")
+        opts.add_argument("--mute-audio")
+        prefs["profile.managed_default_content_settings.images"] = 2
+    if dir_descargas:
+        prefs.update({"download.default_directory": os.path.abspath(dir_descargas),
+                      "download.prompt_for_download": False, "download.directory_upgrade": True})
+    if prefs:
+        opts.add_experimental_option("prefs", prefs)
+    if capturar_red:
+        opts.set_capability("ms:loggingPrefs", {"performance": "ALL"})
+    if varias_pestanas:
+        opts.add_argument("--disable-background-timer-throttling")
+        opts.add_argument("--disable-renderer-backgrounding")
+        opts.add_argument("--disable-backgrounding-occluded-windows")
+    if dir_perfil:
+        opts.add_argument(f"--user-data-dir={os.path.abspath(dir_perfil)}")
+        opts.add_argument("--no-first-run")
+        opts.add_argument("--no-default-browser-check")
+        opts.add_argument("--hide-crash-restore-bubble")
+    if conectar:
+        opts.add_argument(f"--remote-debugging-port={conectar.rpartition(':')[2]}")
     opts.add_argument("--log-level=3")
-    return webdriver.Edge(options=opts)
+    with fase("build_driver"):
+        driver = _abrir_edge(opts)
+    # Solo un perfil persistente trae el consentimiento de antes: el temporal espera el banner
+    _ESPERA_COOKIES[driver.session_id] = 0.0 if dir_perfil else ESPERA_COOKIES
+    if _TRAZA:
+        instrumentar_driver(driver)
+    if rapido:
+        _RAPIDOS.add(driver.session_id)
+        bloquear_recursos(driver)
+    if dir_descargas:
+        preparar_descargas(driver, dir_descargas)
+    return driver
+
+# Sesiones creadas con rapido: cada pestaña nueva necesita su propio bloqueo
+_RAPIDOS = set()
+
+def bloquear_recursos(driver):
+    """
+    Bloquea URLS_BLOQUEADAS en la pestaña actual si la sesión es rapido. El bloqueo
+    de CDP es por target: las pestañas que se abren después no lo heredan.
+    """
+    if driver.session_id in _RAPIDOS:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": URLS_BLOQUEADAS})
+
+# Dashboard listo para usar filtros: oracle-dv completo o algún tile de filtro
+JS_DASHBOARD_LISTO = """
+    const dvReady=[...document.querySelectorAll('oracle-dv')]
+      .some(el=>el.classList && el.classList.contains('oj-complete'));
+    const anyFilter=document.querySelector('[id^="dashboardfilterviz_box_"] .bi_dashboardfilterviz_tile_wrapper');
+    return dvReady || !!anyFilter;
+"""
 
 def wait_until_ready(driver, timeout=120):
     WebDriverWait(driver, timeout).until(
         lambda d: d.execute_script("return document.readyState") == "complete"
     )
     WebDriverWait(driver, timeout).until(
-        lambda d: d.execute_script("""
-            const dvReady=[...document.querySelectorAll('oracle-dv')]
-              .some(el=>el.classList && el.classList.contains('oj-complete'));
-            const anyFilter=document.querySelector('[id^="dashboardfilterviz_box_"] .bi_dashboardfilterviz_tile_wrapper');
-            return dvReady || !!anyFilter;
-        """)
+        lambda d: d.execute_script(JS_DASHBOARD_LISTO)
     )
 
-def aceptar_cookies(driver):
-    try:
-        btn = WebDriverWait(driver, 6).until(
-            EC.element_to_be_clickable((By.XPATH,
-                "//*[self::button or self::a or self::span]"
-                "[contains(translate(., 'ACEPTCONSENTDEACUERDOOK', 'aceptconsentdeacuerdook'),'acept')]"
-            ))
-        )
-        try: btn.click()
-        except Exception: driver.execute_script("arguments[0].click();", btn)
-    except Exception:
-        pass
+# Botón visible de "Aceptar" (banner de cookies); primero botones, luego enlaces y spans
+JS_BOTON_ACEPTAR = r"""
+for (const tag of ['button', 'a', 'span']) {
+  for (const el of document.getElementsByTagName(tag)) {
+    if (!/acept/i.test(el.textContent || '')) continue;
+    const r = el.getBoundingClientRect();
+    if (r.width > 0 && r.height > 0 && getComputedStyle(el).visibility !== 'hidden') return el;
+  }
+}
+return null;
+"""
+
+ESPERA_COOKIES = 6.0  # s para un banner de cookies que tarda en aparecer
+
+# Segundos a esperar el banner por sesión de WebDriver (build_driver / aceptar_cookies)
+_ESPERA_COOKIES = {}
+
+def aceptar_cookies(driver, espera=None):
+    """
+    Acepta el banner de cookies, esperando hasta `espera` s a que aparezca. Sin
+    `espera`: la de build_driver, ESPERA_COOKIES con un perfil temporal y ninguna
+    con el consentimiento ya guardado (perfil persistente, Edge conectado). Tras la
+    primera vez el navegador ya lo tiene: las siguientes cargas solo miran una vez.
+    """
+    sid = getattr(driver, "session_id", None)
+    if espera is None:
+        espera = _ESPERA_COOKIES.get(sid, ESPERA_COOKIES)
+    fin = time.time() + espera
+    while True:
+        try:
+            btn = driver.execute_script(JS_BOTON_ACEPTAR)
+        except Exception:
+            btn = None
+        if btn is not None:
+            try: btn.click()
+            except Exception: driver.execute_script("arguments[0].click();", btn)
+            _ESPERA_COOKIES[sid] = 0.0
+            return True
+        if time.time() >= fin:
+            _ESPERA_COOKIES[sid] = 0.0
+            return False
+        time.sleep(0.25)
 
 def open_filter_tile(driver, tile_id, timeout=40):
     tile = WebDriverWait(driver, timeout).until(
@@ -144,6 +518,7 @@ def click_shuttle_option_and_add(driver, option_text, timeout=40, tries=3):
             if _is_in_selections(): return
         except StaleElementReferenceException as e:
             last_err = e
+            _contar_reintento()
             continue
         except TimeoutException as e:
             raise e
@@ -174,6 +549,7 @@ def click_shuttle_option_only(driver, option_text, timeout=40, tries=3):
             return
         except StaleElementReferenceException as e:
             last_err = e
+            _contar_reintento()
             continue
         except TimeoutException as e:
             raise e
@@ -301,32 +677,123 @@ function __setFecha(comparatorText, dateStr){
 }
 """ % JS_FN_SELECT_FROM_FILTER
 
-def call_js_function(driver, fn_code, fn_name, *fn_args):
-    wrapper = f"""
-      var cb = arguments[arguments.length-1];
-      var a = Array.prototype.slice.call(arguments,0,arguments.length-1);
-      {fn_code}
-      var __res;
-      try {{
-        __res = {fn_name}.apply(null, a);
-      }} catch(e) {{
-        cb({{ok:false, step:'js-throw', error:String(e)}}); return;
-      }}
-      if (__res && typeof __res.then === 'function') {{
-        __res.then(function(r){{ cb(r); }})
-             .catch(function(e){{ cb({{ok:false, step:'js-error', error:String(e)}}); }});
-      }} else {{
-        cb(__res);
-      }}
-    """
-    return driver.execute_async_script(wrapper, *fn_args)
+# Los tres filtros en un solo execute_async_script: abre cada tile, selecciona y
+# confirma observando solo el popup (MutationObserver), sin barrer todo el DOM.
+# Argumentos: {fecha, comparador, tasa, cambio}, {filtro: id_del_tile} con los
+# filtros a aplicar, y timeout en ms. Devuelve {ok, ms, filtros: {filtro: estado}}.
+JS_APLICAR_FILTROS = JS_FN_SET_FECHA + r"""
+var cb = arguments[arguments.length-1];
+var q = arguments[0], tiles = arguments[1], timeoutMs = arguments[2];
+
+function visible(el){ return !!el && getComputedStyle(el).display!=='none' && el.offsetParent!==null; }
+// Resuelve con cond() apenas sea verdadero, mirando solo las mutaciones de `raiz`
+function esperar(cond, raiz, ms){
+  return new Promise(resolve=>{
+    let v = cond();
+    if (v) { resolve(v); return; }
+    let obs = null, timer = null;
+    const fin = r=>{ if (obs) obs.disconnect(); clearTimeout(timer); resolve(r); };
+    obs = new MutationObserver(()=>{ const r = cond(); if (r) fin(r); });
+    obs.observe(raiz, {childList:true, subtree:true, attributes:true, characterData:true});
+    timer = setTimeout(()=>fin(cond() || null), ms);
+  });
+}
+function clickear(el){
+  try { el.scrollIntoView({block:'center'}); } catch(e){}
+  for (const t of ['mouseover','mousemove','mousedown','mouseup','click'])
+    el.dispatchEvent(new MouseEvent(t,{bubbles:true,cancelable:true,view:window}));
+}
+function contenedor(el){ return el.closest('.oj-popup, .oj-dialog, [role="dialog"]') || document.body; }
+async function abrirTile(id, hallar){
+  const w = await esperar(()=>{
+    const el = document.querySelector('#'+id+' .bi_dashboardfilterviz_tile_wrapper');
+    return visible(el) && el;
+  }, document.body, timeoutMs);
+  if (!w) return null;
+  clickear(w);
+  return await esperar(hallar, document.body, timeoutMs);
+}
+function opcion(txt){
+  const sel = '.biShuttleAvailableValuesItem[data-bi-shuttle-display-value="'+CSS.escape(txt)+'"]';
+  const els = [...document.querySelectorAll(sel)];
+  const porTexto = [...document.querySelectorAll('.biShuttleAvailableValuesItem')]
+    .filter(el=>(el.textContent||'').trim()===txt);
+  return els.concat(porTexto).find(visible) || null;
+}
+// Panel 'Selecciones' del popup: se sube desde el rótulo hasta el primer ancestro
+// que contenga el texto sin ser la lista de disponibles
+function enSelecciones(cont, txt){
+  const w = document.createTreeWalker(cont, NodeFilter.SHOW_TEXT);
+  let n;
+  while ((n = w.nextNode())) {
+    if (!/Selecciones/i.test(n.nodeValue)) continue;
+    for (let el = n.parentElement; el && el !== cont.parentElement; el = el.parentElement) {
+      if ((el.textContent||'').includes(txt)) {
+        const disp = [...el.querySelectorAll('.biShuttleAvailableValuesItem')]
+          .some(it=>(it.textContent||'').trim()===txt);
+        return !disp;
+      }
+    }
+  }
+  return false;
+}
+async function shuttle(tile, txt, agregar){
+  const t0 = performance.now();
+  const op = await abrirTile(tile, ()=>opcion(txt));
+  if (!op) return {ok:false, step:'opcion-no-encontrada', opcion:txt};
+  const cont = contenedor(op);
+  clickear(op);
+  let ok = await esperar(()=>enSelecciones(cont, txt), cont, agregar ? 1500 : 1000);
+  if (!ok && agregar) {
+    const btn = [...cont.querySelectorAll('button, a')]
+      .find(b=>/agregar/i.test(b.textContent||'') || /agregar/i.test(b.getAttribute('aria-label')||''));
+    if (btn) clickear(btn);
+    ok = await esperar(()=>enSelecciones(cont, txt), cont, timeoutMs);
+    if (!ok) return {ok:false, step:'no-quedo-en-selecciones', opcion:txt, ms:Math.round(performance.now()-t0)};
+  }
+  // Tipo de Cambio: basta el click (como click_shuttle_option_only); se informa si se confirmó
+  return {ok:true, step:'done', opcion:txt, confirmado:!!ok, ms:Math.round(performance.now()-t0)};
+}
+async function fecha(tile){
+  const t0 = performance.now();
+  const combo = await abrirTile(tile, ()=>{
+    const c = document.querySelector('div[role="combobox"][aria-label="Tipo de Rango"]');
+    return visible(c) && c;
+  });
+  if (!combo) return {ok:false, step:'combo-no-encontrado'};
+  const r = await __setFecha(q.comparador, q.fecha);
+  return Object.assign({}, r, {ms:Math.round(performance.now()-t0)});
+}
+
+(async ()=>{
+  const t0 = performance.now(), filtros = {};
+  delete window.__bancoFiltros;  // filtros aplicados en esta página (para reconectarse, ver adoptar_pestana)
+  if (tiles.fecha) filtros.fecha = await fecha(tiles.fecha);
+  if (tiles.tasa) filtros.tasa = await shuttle(tiles.tasa, q.tasa, true);
+  if (tiles.cambio) filtros.cambio = await shuttle(tiles.cambio, q.cambio, false);
+  const ok = Object.values(filtros).every(f=>f && f.ok);
+  if (ok) window.__bancoFiltros = q;
+  cb({ok, filtros, ms:Math.round(performance.now()-t0)});
+})().catch(e=>cb({ok:false, step:'js-error', error:String(e)}));
+"""
 
 # =========================================================
 # Iframe + esperar grid
 # =========================================================
-def switch_to_frame_with_selector(driver, css_selector, max_depth=5):
+# Ruta de iframes (índices en window.frames) hasta cada selector, por sesión de WebDriver
+_RUTAS_FRAME = {}
+
+def _seguir_ruta_frame(driver, ruta):
     driver.switch_to.default_content()
+    for i in ruta:
+        driver.switch_to.frame(i)
 
+def switch_to_frame_with_selector(driver, css_selector, max_depth=5):
+    """
+    Deja el driver dentro del (i)frame cuyo documento contiene `css_selector`.
+    La ruta encontrada se recuerda por sesión: las siguientes llamadas van directo
+    y confirman con una sola consulta; solo si falla se vuelve a buscar.
+    """
     def doc_has_selector(drv):
         try:
             return bool(drv.execute_script(
@@ -335,29 +802,51 @@ def switch_to_frame_with_selector(driver, css_selector, max_depth=5):
         except Exception:
             return False
 
+    clave = (driver.session_id, css_selector)
+    ruta = _RUTAS_FRAME.get(clave)
+    if ruta is not None:
+        try:
+            _seguir_ruta_frame(driver, ruta)
+            if doc_has_selector(driver):
+                return True
+        except Exception:
+            pass
+        del _RUTAS_FRAME[clave]
+
+    driver.switch_to.default_content()
     if doc_has_selector(driver):
+        _RUTAS_FRAME[clave] = []
         return True
 
     def dfs(level=1):
         if level > max_depth:
-            return False
+            return None
         frames = driver.find_elements(By.CSS_SELECTOR, "iframe")
         for f in frames:
             if not f.is_displayed():
                 continue
             try:
+                idx = driver.execute_script(
+                    "return Array.prototype.indexOf.call(window.frames, arguments[0].contentWindow);", f)
                 driver.switch_to.frame(f)
                 if doc_has_selector(driver):
-                    return True
-                if dfs(level+1):
-                    return True
+                    return [idx]
+                sub = dfs(level+1)
+                if sub is not None:
+                    return [idx] + sub
             except Exception:
                 pass
             finally:
                 driver.switch_to.parent_frame()
-        return False
+        return None
 
-    return dfs()
+    ruta = dfs()
+    if ruta is None:
+        return False
+    # dfs vuelve al documento raíz al salir; entrar de nuevo por la ruta hallada
+    _RUTAS_FRAME[clave] = ruta
+    _seguir_ruta_frame(driver, ruta)
+    return True
 
 def wait_for_grid_loaded(driver, timeout=60):
     ok = switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6)
@@ -380,48 +869,588 @@ def wait_for_grid_loaded(driver, timeout=60):
         """) is True
     )
 
+# =========================================================
+# Huella del contenido del grid (detectar que ya se re-consultó)
+# =========================================================
+# Hash de headers nivel 0/1 + header de fila (fecha) y celdas de la primera fila.
+# Devuelve null si no hay grid.
+_JS_HUELLA = r"""
+function __huellaGrid(){
+  const grid = document.querySelector('oj-data-grid');
+  if (!grid) return null;
+  const txt = sel => [...document.querySelectorAll(sel)].map(d=>{
+    const s=d.getAttribute('style')||'';
+    const l=/left:\s*([0-9.]+)px/i.exec(s), t=/top:\s*([0-9.]+)px/i.exec(s);
+    return {left:l?parseFloat(l[1]):0, top:t?parseFloat(t[1]):0, text:(d.textContent||'').trim()};
+  });
+  const h0 = txt('div.oj-datagrid-header-grouping[data-oj-level="0"] > div.oj-datagrid-header-cell');
+  const h1 = txt('div.oj-datagrid-header-grouping[data-oj-level="1"] > div.oj-datagrid-header-cell');
+  const cells = txt('div.oj-datagrid-databody div.oj-datagrid-cell');
+  const rh = txt('div.oj-datagrid-row-header div.oj-datagrid-header-cell');
+  if (!h0.length && !cells.length) return null;
+  const top0 = cells.length ? Math.min(...cells.map(c=>c.top)) : 0;
+  const fila0 = cells.filter(c=>Math.abs(c.top-top0)<1);
+  const rh0 = rh.filter(c=>Math.abs(c.top-top0)<1);
+  const ord = a => a.sort((x,y)=>x.left-y.left).map(x=>x.text).join('\u0001');
+  const s = ord(h0)+'\u0002'+ord(h1)+'\u0002'+ord(rh0)+'\u0002'+ord(fila0);
+  let h = 5381;
+  for (let i=0;i<s.length;i++) h = ((h<<5) + h + s.charCodeAt(i)) | 0;
+  return (h>>>0).toString(16) + ':' + s.length;
+}
+"""
+
+JS_HUELLA_GRID = _JS_HUELLA + "return __huellaGrid();"
+
+# Espera (en el navegador) a que la huella cambie respecto de `previa` y se mantenga
+# estable durante quietMs. Devuelve {ok, huella, ms} o {ok:false, step:'timeout', huella}.
+JS_ESPERAR_CAMBIO_GRID = _JS_HUELLA + r"""
+var cb = arguments[arguments.length-1];
+var previa = arguments[0], quietMs = arguments[1], timeoutMs = arguments[2];
+var t0 = Date.now(), ultima = null, desde = 0;
+(function tick(){
+  let h = null;
+  try { h = __huellaGrid(); } catch(e) {}
+  const ahora = Date.now();
+  if (h && h !== previa) {
+    if (h !== ultima) { ultima = h; desde = ahora; }
+    else if (ahora - desde >= quietMs) { cb({ok:true, huella:h, ms:ahora-t0}); return; }
+  } else { ultima = null; }
+  if (ahora - t0 >= timeoutMs) { cb({ok:false, step:'timeout', huella:h, ms:ahora-t0}); return; }
+  setTimeout(tick, 50);
+})();
+"""
+
+def grid_fingerprint(driver):
+    """Huella del grid actual (o None si todavía no hay grid). Deja el driver en default_content."""
+    try:
+        if not switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6):
+            return None
+        return llamar_js(driver, "huellaGrid")
+    except Exception:
+        return None
+    finally:
+        driver.switch_to.default_content()
+
+def capturar_huella(driver, timeout=15):
+    """Espera hasta `timeout` s a que exista un grid con contenido y devuelve su huella."""
+    fin = time.time() + timeout
+    while True:
+        h = grid_fingerprint(driver)
+        if h or time.time() >= fin:
+            return h
+        time.sleep(0.25)
+
+def wait_for_grid_change(driver, previa, quiet_ms=500, timeout=60):
+    """
+    Espera a que el contenido del grid deje de ser el de `previa` y quede estable
+    `quiet_ms`. Debe llamarse con el driver ya dentro del iframe del grid
+    (p.ej. después de wait_for_grid_loaded). Devuelve la nueva huella.
+    """
+    driver.set_script_timeout(timeout + 5)
+    res = llamar_js(driver, "esperarCambioGrid", previa, quiet_ms, int(timeout * 1000))
+    if not res or not res.get("ok"):
+        print(f"[Espera] La huella del grid no cambió en {timeout}s; se lee lo que haya.", file=sys.stderr)
+        return (res or {}).get("huella")
+    return res["huella"]
+
 # ============
 # Barrido (scroll) del grid y captura de TODAS las columnas
 # ============
-def sweep_and_read_all_columns(driver, settle_ms=120):
+# Piezas comunes de los barridos en el navegador. Esperan definidos `db`, `grid`,
+# `quietMs` y `maxStepMs` en el script que las incluye.
+_JS_BARRIDO_COMUN = r"""
+function pos(div){
+  const s=div.getAttribute('style')||'';
+  const l=/left:\s*([0-9.]+)px/i.exec(s), t=/top:\s*([0-9.]+)px/i.exec(s);
+  const left=l?parseFloat(l[1]):0, top=t?parseFloat(t[1]):0;
+  return {left, top, leftKey:String(Math.round(left)), topKey:String(Math.round(top)),
+          text:(div.textContent||'').trim()};
+}
+function celdas(sel){ return [...document.querySelectorAll(sel)].map(pos); }
+const SEL_H0 = 'div.oj-datagrid-header-grouping[data-oj-level="0"] > div.oj-datagrid-header-cell';
+const SEL_H1 = 'div.oj-datagrid-header-grouping[data-oj-level="1"] > div.oj-datagrid-header-cell';
+const SEL_RH = 'div.oj-datagrid-row-header div.oj-datagrid-header-cell';
+const SEL_CELDA = 'div.oj-datagrid-databody div.oj-datagrid-cell';
+
+// rAF con respaldo por timer (pestañas en segundo plano no pintan frames)
+function nextFrame(){
+  return new Promise(r=>{
+    let done=false; const fin=()=>{ if(!done){ done=true; r(); } };
+    requestAnimationFrame(fin); setTimeout(fin, 50);
+  });
+}
+// Si alguna celda abarca la posición p (px del databody) sobre el eje 'left' o 'top'
+function abarca(divs, eje, p){
+  for (const d of divs) {
+    const a = pos(d)[eje], b = a + (eje === 'left' ? d.offsetWidth : d.offsetHeight);
+    if (a <= p && p < b) return true;
+  }
+  return false;
+}
+// Si ya se pintó el borde del viewport hacia el que se movió el scroll (el que las
+// celdas del viewport anterior no cubren). Sin filas, los headers para el ancho.
+function bordePintado(antes){
+  const cs = document.querySelectorAll(SEL_CELDA), hs = cs.length ? cs : document.querySelectorAll(SEL_H0);
+  const l = db.scrollLeft, t = db.scrollTop;
+  if (l > antes.left && !abarca(hs, 'left', Math.min(l + db.clientWidth, db.scrollWidth) - 2)) return false;
+  if (l < antes.left && !abarca(hs, 'left', l + 1)) return false;
+  if (!cs.length) return true;
+  if (t > antes.top && !abarca(cs, 'top', Math.min(t + db.clientHeight, db.scrollHeight) - 2)) return false;
+  if (t < antes.top && !abarca(cs, 'top', t + 1)) return false;
+  return true;
+}
+// Resuelve cuando el grid lleva quietMs sin mutaciones (o al llegar a maxStepMs).
+// La ventana de quietud empieza recién cuando el viewport nuevo tiene celdas: un
+// render virtualizado que llega tarde no se confunde con un grid ya quieto.
+function settle(mover){
+  return new Promise(resolve=>{
+    let quietTimer=null, hardTimer=null, obs=null, pintado=false;
+    const antes = {left: db.scrollLeft, top: db.scrollTop};
+    const fin=()=>{ if(obs) obs.disconnect(); clearTimeout(quietTimer); clearTimeout(hardTimer); resolve(); };
+    const rearm=()=>{
+      pintado = pintado || bordePintado(antes);
+      if (!pintado) return;
+      clearTimeout(quietTimer); quietTimer=setTimeout(fin, quietMs);
+    };
+    obs = new MutationObserver(rearm);
+    obs.observe(grid, {childList:true, subtree:true, characterData:true});
+    hardTimer = setTimeout(fin, maxStepMs);
+    mover();
+    nextFrame().then(()=>nextFrame()).then(rearm);
+  });
+}
+// Recorre todo el ancho desde scrollLeft=0 llamando snapshot() en cada viewport;
+// deja en pasosMs lo que tardó cada paso (scroll + render)
+const pasosMs = [];
+async function barrerHorizontal(db, snapshot){
+  await settle(()=>{ db.scrollLeft = 0; });
+  snapshot();
+  const scrollW = db.scrollWidth, clientW = db.clientWidth;
+  if (!scrollW || !clientW) return -1;
+  const maxLeft = Math.max(0, scrollW - clientW);
+  const step = Math.max(40, Math.floor(clientW * 0.85));  // paso de ~85% del viewport
+  let cur = 0, pasos = 0;
+  while (cur < maxLeft - 1) {
+    cur = Math.min(cur + step, maxLeft);
+    const t0 = performance.now();
+    await settle(()=>{ db.scrollLeft = cur; });
+    snapshot(); pasos++;
+    pasosMs.push(Math.round(performance.now() - t0));
+  }
+  return pasos;
+}
+"""
+
+# Barrido completo dentro del navegador: un solo execute_async_script que hace
+# scroll, espera el render virtualizado (MutationObserver + rAF) y une por leftKey.
+JS_SWEEP_ASYNC = r"""
+var cb = arguments[arguments.length-1];
+var quietMs = arguments[0], maxStepMs = arguments[1];
+const db = document.querySelector('div[id$="OJDataGrid:databody"]');
+if (!db) { cb({ok:false, step:'databody-not-found'}); return; }
+const grid = document.querySelector('oj-data-grid') || document.body;
+""" + _JS_BARRIDO_COMUN + r"""
+const h0Map = new Map(), h1Map = new Map(), cellMap = new Map();
+function merge(items, map){ for (const it of items) if (!map.has(it.leftKey)) map.set(it.leftKey, it); }
+function snapshot(){
+  merge(celdas(SEL_H0), h0Map);
+  merge(celdas(SEL_H1), h1Map);
+  merge(celdas(SEL_CELDA), cellMap);
+}
+
+(async ()=>{
+  const pasos = await barrerHorizontal(db, snapshot);
+  if (pasos < 0) { cb({ok:false, step:'measure-failed'}); return; }
+  const keys = [...new Set([...h0Map.keys(), ...cellMap.keys()])].sort((a,b)=>parseFloat(a)-parseFloat(b));
+  const out = [], layout = {};
+  for (const k of keys) {
+    const name = ((h0Map.get(k)||{}).text||'').trim();
+    const code = ((h1Map.get(k)||{}).text||'').trim();
+    const value = ((cellMap.get(k)||{}).text||'').trim();
+    if (name || value) { out.push({name, code, value}); layout[k] = [name, code]; }
+  }
+  cb({ok:true, rows:out, layout, pasos, pasosMs});
+})().catch(e=>cb({ok:false, step:'js-error', error:String(e)}));
+"""
+
+# Una banda vertical: fija scrollTop, barre todo el ancho y devuelve headers por
+# leftKey, headers de fila por topKey y celdas por "topKey|leftKey".
+JS_SWEEP_BANDA = r"""
+var cb = arguments[arguments.length-1];
+var top = arguments[0], quietMs = arguments[1], maxStepMs = arguments[2];
+const db = document.querySelector('div[id$="OJDataGrid:databody"]');
+if (!db) { cb({ok:false, step:'databody-not-found'}); return; }
+const grid = document.querySelector('oj-data-grid') || document.body;
+""" + _JS_BARRIDO_COMUN + r"""
+const h0 = {}, h1 = {}, rh = {}, cells = {};
+function snapshot(){
+  for (const it of celdas(SEL_H0)) if (!(it.leftKey in h0)) h0[it.leftKey] = it.text;
+  for (const it of celdas(SEL_H1)) if (!(it.leftKey in h1)) h1[it.leftKey] = it.text;
+  for (const it of celdas(SEL_RH)) if (!(it.topKey in rh)) rh[it.topKey] = it.text;
+  for (const it of celdas(SEL_CELDA)) {
+    const k = it.topKey + '|' + it.leftKey;
+    if (!(k in cells)) cells[k] = it.text;
+  }
+}
+
+(async ()=>{
+  await settle(()=>{ db.scrollTop = top; });
+  const pasos = await barrerHorizontal(db, snapshot);
+  if (pasos < 0) { cb({ok:false, step:'measure-failed'}); return; }
+  cb({ok:true, h0, h1, rh, cells, pasos, pasosMs, scrollTop: db.scrollTop,
+      scrollHeight: db.scrollHeight, clientHeight: db.clientHeight});
+})().catch(e=>cb({ok:false, step:'js-error', error:String(e)}));
+"""
+
+# Lectura dirigida: solo las columnas cuyos leftKey se conocen (layout de un barrido
+# previo). Cada scroll deja la siguiente columna pendiente en el borde izquierdo y
+# toma todas las pendientes que quedaron visibles. Devuelve {leftKey: {name,code,value}};
+# null para las que no aparecieron en su posición.
+JS_LEER_COLUMNAS = r"""
+var cb = arguments[arguments.length-1];
+var lefts = arguments[0], quietMs = arguments[1], maxStepMs = arguments[2];
+const db = document.querySelector('div[id$="OJDataGrid:databody"]');
+if (!db) { cb({ok:false, step:'databody-not-found'}); return; }
+const grid = document.querySelector('oj-data-grid') || document.body;
+""" + _JS_BARRIDO_COMUN + r"""
+function porLeft(sel){
+  const m = {};
+  for (const it of celdas(sel)) if (!(it.leftKey in m)) m[it.leftKey] = it.text;
+  return m;
+}
+
+(async ()=>{
+  const pend = lefts.map(Number).sort((a,b)=>a-b), cols = {};
+  const maxLeft = Math.max(0, db.scrollWidth - db.clientWidth);
+  let i = 0, pasos = 0;
+  while (i < pend.length) {
+    const destino = Math.min(pend[i], maxLeft), t0 = performance.now();
+    await settle(()=>{ db.scrollLeft = destino; });
+    pasos++; pasosMs.push(Math.round(performance.now() - t0));
+    const h0 = porLeft(SEL_H0), h1 = porLeft(SEL_H1), cs = porLeft(SEL_CELDA);
+    for (const l of pend.slice(i)) {
+      const k = String(Math.round(l));
+      if (!(k in cols) && (k in h0)) cols[k] = {name:h0[k], code:h1[k]||'', value:cs[k]||''};
+    }
+    const k0 = String(Math.round(pend[i]));
+    if (!(k0 in cols)) cols[k0] = null;
+    while (i < pend.length && String(Math.round(pend[i])) in cols) i++;
+  }
+  cb({ok:true, cols, pasos, pasosMs});
+})().catch(e=>cb({ok:false, step:'js-error', error:String(e)}));
+"""
+
+# Barrido por pasos (dirigido desde Python): foto de lo visible, scroll y medida
+JS_SNAPSHOT_GRID = r"""
+const h0 = Array.from(document.querySelectorAll('div.oj-datagrid-header-grouping[data-oj-level="0"] > div.oj-datagrid-header-cell'));
+const h1 = Array.from(document.querySelectorAll('div.oj-datagrid-header-grouping[data-oj-level="1"] > div.oj-datagrid-header-cell'));
+const cells = Array.from(document.querySelectorAll('div.oj-datagrid-databody div.oj-datagrid-cell'));
+
+function pick(items){
+  return items.map(div=>{
+    const s=div.getAttribute('style')||'';
+    const m=/left:\s*([0-9.]+)px/i.exec(s);
+    const left=m?parseFloat(m[1]):0;
+    return {left,leftKey:String(Math.round(left)), text:(div.textContent||'').trim()};
+  });
+}
+return {h0: pick(h0), h1: pick(h1), cells: pick(cells)};
+"""
+
+JS_MEDIR_DATABODY = r"""
+const db=document.querySelector('div[id$="OJDataGrid:databody"]');
+return db ? {scrollWidth: db.scrollWidth, clientWidth: db.clientWidth} : null;
+"""
+
+JS_SCROLL_DATABODY = r"""
+const db=document.querySelector('div[id$="OJDataGrid:databody"]');
+if (db) db.scrollLeft = arguments[0];
+return !!db;
+"""
+
+# Exportación nativa: pasa el mouse por el grid (la barra de la visualización
+# aparece al hover) y hace clic, en orden, en el elemento visible cuyo texto,
+# aria-label o title coincide con cada paso. Args: (pasos [{re, opcional}], esperaMs).
+JS_CLICS_EXPORTAR = r"""
+const pasos = arguments[0], esperaMs = arguments[1], cb = arguments[arguments.length-1];
+const SEL = 'button,a,li,[role="button"],[role="menuitem"],[role="option"],[aria-label],[title]';
+const grid = document.querySelector('oj-data-grid');
+if (grid) for (const t of ['mouseover','mouseenter','mousemove'])
+  grid.dispatchEvent(new MouseEvent(t, {bubbles: true}));
+function visible(el){
+  const r = el.getBoundingClientRect();
+  return r.width > 0 && r.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+}
+function buscar(re){
+  let mejor = null, largo = 1e9;
+  for (const el of document.querySelectorAll(SEL)) {
+    const txt = (el.getAttribute('aria-label') || el.getAttribute('title') || el.textContent || '').trim();
+    if (txt.length < largo && txt.length <= 80 && re.test(txt) && visible(el)) { mejor = el; largo = txt.length; }
+  }
+  return mejor;
+}
+function clic(el){
+  for (const t of ['pointerdown','mousedown','pointerup','mouseup'])
+    el.dispatchEvent(new MouseEvent(t, {bubbles: true}));
+  el.click();
+}
+(async () => {
+  const hechos = [];
+  for (const p of pasos) {
+    const re = new RegExp(p.re, 'i'), fin = performance.now() + (p.opcional ? Math.min(esperaMs, 1500) : esperaMs);
+    let el = buscar(re);
+    while (!el && performance.now() < fin) { await new Promise(r => setTimeout(r, 100)); el = buscar(re); }
+    if (!el) {
+      if (p.opcional) continue;
+      return {ok: false, paso: p.re, hechos};
+    }
+    hechos.push((el.getAttribute('aria-label') || el.textContent || '').trim().slice(0, 40));
+    clic(el);
+    await new Promise(r => setTimeout(r, 150));
+  }
+  return {ok: true, hechos};
+})().then(cb, e => cb({ok: false, error: String(e)}));
+"""
+
+# =========================================================
+# Bundle de helpers JS: se instala una vez por documento en window.__banco
+# =========================================================
+# Cada script se envuelve en una función: los async reciben el callback como
+# último argumento (igual que en execute_async_script) y devuelven una Promise.
+_JS_HELPERS = {
+    "setFecha": ("sync", JS_FN_SET_FECHA + "\nreturn __setFecha.apply(null, arguments);"),
+    "aplicarFiltros": ("async", JS_APLICAR_FILTROS),
+    "huellaGrid": ("sync", JS_HUELLA_GRID),
+    "esperarCambioGrid": ("async", JS_ESPERAR_CAMBIO_GRID),
+    "barrer": ("async", JS_SWEEP_ASYNC),
+    "barrerBanda": ("async", JS_SWEEP_BANDA),
+    "leerColumnas": ("async", JS_LEER_COLUMNAS),
+    "snapshotGrid": ("sync", JS_SNAPSHOT_GRID),
+    "medirDatabody": ("sync", JS_MEDIR_DATABODY),
+    "scrollDatabody": ("sync", JS_SCROLL_DATABODY),
+    "clicsExportar": ("async", JS_CLICS_EXPORTAR),
+}
+
+def _envolver_helper(tipo, js):
+    if tipo == "sync":
+        return "function(){\n" + js + "\n}"
+    return ("function(){ var a = Array.prototype.slice.call(arguments);\n"
+            "return new Promise(function(cb){ (function(){\n" + js + "\n}).apply(null, a.concat([cb])); }); }")
+
+_JS_FUNCIONES = ",\n".join(f"{json.dumps(n)}: {_envolver_helper(t, js)}" for n, (t, js) in _JS_HELPERS.items())
+# La versión cambia sola cuando cambia cualquier helper
+VERSION_JS = hashlib.sha1(_JS_FUNCIONES.encode("utf-8")).hexdigest()[:12]
+JS_BUNDLE = "window.__banco = {version: %s, fn: {\n%s\n}};\n" % (json.dumps(VERSION_JS), _JS_FUNCIONES)
+
+# Llamada por nombre; si el documento no tiene el bundle (o es de otra versión)
+# responde {__sinBundle: true} y llamar_js reintenta instalándolo en el mismo viaje.
+JS_LLAMAR = r"""
+var cb = arguments[arguments.length-1];
+var b = window.__banco;
+if (!b || b.version !== arguments[0]) { cb({__sinBundle: true}); return; }
+try {
+  Promise.resolve(b.fn[arguments[1]].apply(null, arguments[2]))
+    .then(cb, function(e){ cb({ok:false, step:'js-error', error:String(e)}); });
+} catch(e) { cb({ok:false, step:'js-throw', error:String(e)}); }
+"""
+
+def llamar_js(driver, nombre, *args):
+    """
+    Ejecuta el helper `nombre` del bundle en el documento actual del driver (página
+    o iframe). Solo viajan el nombre y los argumentos; el código del bundle se envía
+    de nuevo únicamente si una navegación o un cambio de frame lo dejó sin instalar.
+    El timeout es el de set_script_timeout del driver.
+    """
+    res = driver.execute_async_script(JS_LLAMAR, VERSION_JS, nombre, list(args))
+    if isinstance(res, dict) and res.get("__sinBundle"):
+        with fase("instalar_js"):
+            res = driver.execute_async_script(JS_BUNDLE + JS_LLAMAR, VERSION_JS, nombre, list(args))
+    return res
+
+# Variante sin esperar: arranca el helper, guarda su Promise en __banco.tareas[id]
+# y vuelve de inmediato. JS_TAREA consulta (y al terminar, entrega y borra) el resultado.
+JS_LANZAR = r"""
+var v = arguments[0], nombre = arguments[1], args = arguments[2], id = arguments[3];
+var b = window.__banco;
+if (!b || b.version !== v) return {__sinBundle: true};
+var tareas = b.tareas = b.tareas || {};
+var t = tareas[id] = {listo: false};
+Promise.resolve().then(function(){ return b.fn[nombre].apply(null, args); })
+  .then(function(r){ t.valor = r; t.listo = true; },
+        function(e){ t.valor = {ok:false, step:'js-error', error:String(e)}; t.listo = true; });
+return {id: id};
+"""
+
+JS_TAREA = r"""
+var b = window.__banco, id = arguments[0];
+var t = b && b.tareas && b.tareas[id];
+if (!t) return {listo: true, valor: {ok:false, step:'tarea-perdida'}};
+if (t.listo) delete b.tareas[id];
+return t;
+"""
+
+_ids_tarea = iter(range(1, 1 << 62))
+
+def lanzar_js(driver, nombre, *args):
+    """Arranca el helper `nombre` en el documento actual sin esperarlo. Devuelve el id de la tarea."""
+    id_tarea = next(_ids_tarea)
+    res = driver.execute_script(JS_LANZAR, VERSION_JS, nombre, list(args), id_tarea)
+    if isinstance(res, dict) and res.get("__sinBundle"):
+        with fase("instalar_js"):
+            driver.execute_script(JS_BUNDLE + JS_LANZAR, VERSION_JS, nombre, list(args), id_tarea)
+    return id_tarea
+
+def tarea_js(driver, id_tarea):
+    """(listo, valor) de una tarea de lanzar_js; debe llamarse en el mismo documento."""
+    t = driver.execute_script(JS_TAREA, id_tarea) or {}
+    return bool(t.get("listo")), t.get("valor")
+
+def sweep_in_browser(driver, quiet_ms=40, max_step_ms=3000, timeout=120):
+    """
+    Igual que el barrido por pasos, pero todo ocurre en el navegador en una única
+    llamada al bundle: un solo round trip de WebDriver sin importar el ancho.
+    """
+    driver.set_script_timeout(timeout)
+    res = llamar_js(driver, "barrer", quiet_ms, max_step_ms)
+    if not res or not res.get("ok"):
+        raise RuntimeError(f"Falló el barrido en el navegador: {res}")
+    _registrar_pasos(res)
+    if res.get("layout"):
+        _LAYOUTS[driver.session_id] = res["layout"]
+    return res["rows"]
+
+# Layout del último barrido completo por sesión de WebDriver: leftKey -> [nombre, código]
+_LAYOUTS = {}
+
+def seek_columns(driver, buscadas, quiet_ms=40, max_step_ms=3000, timeout=120):
+    """
+    Lee solo las columnas de `buscadas`, yendo directo a los viewports donde el
+    layout del último barrido completo dice que están. Devuelve las filas como
+    sweep_in_browser (solo esas columnas) o None si no hay layout o ya no coincide
+    con los headers encontrados: en ese caso hay que barrer todo el ancho.
+    """
+    layout = _LAYOUTS.get(driver.session_id)
+    if not layout or not buscadas:
+        return None
+    # Emparejar contra el layout como si fuera el grid: el "valor" es la posición
+    filas_layout = [{"name": n, "code": c, "value": k} for k, (n, c) in layout.items()]
+    lefts = [r["venta"] for r in extraer_objetivo(filas_layout, buscadas) if r["venta"]]
+    if not lefts:
+        return None
+    driver.set_script_timeout(timeout)
+    res = llamar_js(driver, "leerColumnas", lefts, quiet_ms, max_step_ms)
+    if not res or not res.get("ok"):
+        return None
+    _registrar_pasos(res)
+    rows = []
+    for k in lefts:
+        col = res["cols"].get(k)
+        if not col or [col["name"], col["code"]] != layout[k]:
+            del _LAYOUTS[driver.session_id]  # el grid cambió de columnas
+            return None
+        rows.append(col)
+    return rows
+
+def _registrar_pasos(res):
+    # Los pasos del barrido ocurren dentro de un solo round trip: se registran ya medidos
+    if _TRAZA:
+        for ms in res.get("pasosMs") or []:
+            _TRAZA.registrar("paso_barrido", ms)
+
+FORMATOS_FECHA_FILA = ["%d/%m/%Y", "%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y", "%d.%m.%Y"]
+
+def _fecha_fila(texto):
+    """Fecha del header de fila como dd/mm/yyyy (o el texto tal cual si no se reconoce)."""
+    t = (texto or "").strip()
+    for f in FORMATOS_FECHA_FILA:
+        try:
+            return datetime.strptime(t, f).strftime("%d/%m/%Y")
+        except ValueError:
+            pass
+    return t
+
+def sweep_rows(driver, quiet_ms=40, max_step_ms=3000, timeout=120):
+    """
+    Barrido 2D para resultados de varias filas (p.ej. comparador 'Iniciar en'):
+    baja por el databody en bandas de ~85% del alto visible y en cada una recorre
+    todo el ancho, con las celdas por (top, left). Generador: entrega cada fila
+    apenas se completa, como {'fecha', 'columnas': [{'name','code','value'}]}.
+    """
+    switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6)
+    driver.set_script_timeout(timeout)
+    h0, h1, vistas = {}, {}, set()
+    top = 0
+    while True:
+        with fase("banda", top=top):
+            res = llamar_js(driver, "barrerBanda", top, quiet_ms, max_step_ms)
+        if not res or not res.get("ok"):
+            raise RuntimeError(f"Falló el barrido 2D en el navegador: {res}")
+        _registrar_pasos(res)
+        for k, v in res["h0"].items(): h0.setdefault(k, v)
+        for k, v in res["h1"].items(): h1.setdefault(k, v)
+
+        por_fila = {}
+        for k, v in res["cells"].items():
+            t, l = k.split("|")
+            por_fila.setdefault(t, {})[l] = v
+        # Cada banda barre todo el ancho: toda fila vista en ella ya está completa
+        for t in sorted(por_fila, key=float):
+            if t in vistas:
+                continue
+            vistas.add(t)
+            celdas = por_fila[t]
+            columnas = []
+            for l in sorted(set(h0) | set(celdas), key=float):
+                name, val = h0.get(l, "").strip(), celdas.get(l, "").strip()
+                if name or val:
+                    columnas.append({"name": name, "code": h1.get(l, "").strip(), "value": val})
+            yield {"fecha": _fecha_fila(res["rh"].get(t, "")), "columnas": columnas}
+
+        max_top = max(0, res["scrollHeight"] - res["clientHeight"])
+        if top >= max_top - 1:
+            return
+        top = min(top + max(20, int(res["clientHeight"] * 0.85)), max_top)
+
+def sweep_and_read_all_columns(driver, settle_ms=120, modo="async", buscadas=None):
     """
     Recorre horizontalmente el databody, capturando:
     - headers nivel 0 (nombre) y nivel 1 (código), ordenados por 'left'
     - celdas de la primera fila, ordenadas por 'left'
     Devuelve lista de dicts: {'name','code','value'}
+    modo="async" hace todo el barrido en el navegador; modo="pasos" lo dirige
+    desde Python con una espera fija de settle_ms por paso; modo="seek" lee solo
+    las columnas de `buscadas` (ver seek_columns) y barre completo si no puede;
+    modo="exportar"/"exportar-xlsx" usa la exportación nativa del dashboard (una
+    sola operación del servidor, sin scroll) y barre en el navegador si falla.
     """
     # Llevar al iframe que contiene el grid (si hay)
     switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6)
 
+    if modo == "seek":
+        rows = seek_columns(driver, buscadas)
+        if rows is not None:
+            return rows
+        modo = "async"  # sin layout o cambió: barrido completo, que lo vuelve a aprender
+
+    if modo in MODOS_EXPORTAR:
+        try:
+            primera = next(leer_exportado(driver, MODOS_EXPORTAR[modo]), None)
+            return primera["columnas"] if primera else []
+        except (RuntimeError, TimeoutError) as e:
+            print(f"[Exportar] {e} -> barrido en el navegador", file=sys.stderr)
+        switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6)
+        modo = "async"
+
+    if modo == "async":
+        return sweep_in_browser(driver)
+
     # Referencias
-    body = driver.execute_script("return document.querySelector('div[id$=\"OJDataGrid:databody\"]');")
-    if not body:
+    medida = llamar_js(driver, "medirDatabody")
+    if not medida:
         raise RuntimeError("No encontré el databody del oj-data-grid.")
 
-    # Funciones JS auxiliares
-    js_snapshot = r"""
-      const grid = document.querySelector('oj-data-grid');
-      const h0 = Array.from(document.querySelectorAll('div.oj-datagrid-header-grouping[data-oj-level="0"] > div.oj-datagrid-header-cell'));
-      const h1 = Array.from(document.querySelectorAll('div.oj-datagrid-header-grouping[data-oj-level="1"] > div.oj-datagrid-header-cell'));
-      const cells = Array.from(document.querySelectorAll('div.oj-datagrid-databody div.oj-datagrid-cell'));
-
-      function pick(items){
-        return items.map(div=>{
-          const s=div.getAttribute('style')||'';
-          const m=/left:\s*([0-9.]+)px/i.exec(s);
-          const left=m?parseFloat(m[1]):0;
-          return {left,leftKey:String(Math.round(left)), text:(div.textContent||'').trim()};
-        });
-      }
-      return {
-        h0: pick(h0),
-        h1: pick(h1),
-        cells: pick(cells)
-      };
-    """
-
     # Ajustes de scroll
-    driver.execute_script("const db=document.querySelector('div[id$=\"OJDataGrid:databody\"]'); if(db) db.scrollLeft=0;")
+    llamar_js(driver, "scrollDatabody", 0)
     time.sleep(settle_ms/1000.0)
 
     # Acumuladores por clave "left" redondeada
@@ -436,12 +1465,11 @@ def sweep_and_read_all_columns(driver, settle_ms=120):
             cell_map.setdefault(it["leftKey"], it)
 
     # Primera foto
-    snap = driver.execute_script(js_snapshot)
+    snap = llamar_js(driver, "snapshotGrid")
     merge_snapshot(snap)
 
     # Scroll horizontal hasta el final
-    scroll_w = driver.execute_script("const db=document.querySelector('div[id$=\"OJDataGrid:databody\"]'); return db?db.scrollWidth:0;")
-    client_w = driver.execute_script("const db=document.querySelector('div[id$=\"OJDataGrid:databody\"]'); return db?db.clientWidth:0;")
+    scroll_w, client_w = medida["scrollWidth"], medida["clientWidth"]
     if not scroll_w or not client_w:
         raise RuntimeError("No pude medir scrollWidth/clientWidth del grid.")
 
@@ -451,9 +1479,10 @@ def sweep_and_read_all_columns(driver, settle_ms=120):
     cur = 0
     while cur < max_left - 1:
         cur = min(cur + step, max_left)
-        driver.execute_script("const db=document.querySelector('div[id$=\"OJDataGrid:databody\"]'); if(db) db.scrollLeft=arguments[0];", cur)
-        time.sleep(settle_ms/1000.0)  # dar tiempo a render virtualizado
-        snap = driver.execute_script(js_snapshot)
+        with fase("paso_barrido", left=cur):
+            llamar_js(driver, "scrollDatabody", cur)
+            time.sleep(settle_ms/1000.0)  # dar tiempo a render virtualizado
+            snap = llamar_js(driver, "snapshotGrid")
         merge_snapshot(snap)
 
     # Unir por posición
@@ -467,6 +1496,203 @@ def sweep_and_read_all_columns(driver, settle_ms=120):
             out.append({"name": name, "code": code, "value": val})
     return out
 
+# =========================
+# Exportación nativa del grid (CSV / Excel) en vez de barrer el DOM
+# =========================
+# Menú de la visualización -> Exportar -> formato -> confirmar (si hay diálogo)
+PASOS_EXPORTAR = {
+    "csv": [r"^(m[aá]s opciones|opciones|men[uú]|more options|options|acciones)$", r"^export",
+            r"csv|^datos"],
+    "xlsx": [r"^(m[aá]s opciones|opciones|men[uú]|more options|options|acciones)$", r"^export",
+             r"excel|xlsx"],
+}
+RE_CONFIRMAR_EXPORTAR = r"^(exportar|export|guardar|save|aceptar|ok)$"
+MODOS_EXPORTAR = {"exportar": "csv", "exportar-xlsx": "xlsx"}  # --barrido -> formato
+EXTENSIONES_PARCIALES = (".crdownload", ".partial", ".tmp", ".download")
+
+# Directorio de descargas por sesión de WebDriver: (ruta, conservar archivos)
+_DESCARGAS = {}
+
+def preparar_descargas(driver, directorio=None):
+    """
+    Manda las descargas del driver a `directorio` (uno temporal si es None) sin
+    preguntar, por CDP; así también funciona en headless y en un driver ya creado.
+    Devuelve la ruta. Lo descargado en un directorio temporal se borra al leerlo.
+    """
+    conservar = directorio is not None
+    directorio = os.path.abspath(directorio or tempfile.mkdtemp(prefix="banco-descargas-"))
+    os.makedirs(directorio, exist_ok=True)
+    params = {"behavior": "allow", "downloadPath": directorio}
+    try:
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", params)
+    except Exception:
+        try: driver.execute_cdp_cmd("Page.setDownloadBehavior", params)
+        except Exception: pass  # quedan las prefs de build_driver
+    _DESCARGAS[driver.session_id] = (directorio, conservar)
+    return directorio
+
+def esperar_descarga(directorio, antes, timeout=120):
+    """Ruta del archivo nuevo de `directorio` (no listado en `antes`) cuando terminó de bajar."""
+    fin = time.time() + timeout
+    tamanos = {}
+    while time.time() < fin:
+        nuevos = [n for n in os.listdir(directorio) if n not in antes]
+        listos = [n for n in nuevos if not n.endswith(EXTENSIONES_PARCIALES) and not n.startswith(".")]
+        if listos and len(listos) == len(nuevos):
+            ruta = max((os.path.join(directorio, n) for n in listos), key=os.path.getmtime)
+            tam = os.path.getsize(ruta)
+            if tam and tamanos.get(ruta) == tam:  # mismo tamaño en dos vueltas: terminado
+                return ruta
+            tamanos[ruta] = tam
+        time.sleep(0.2)
+    raise TimeoutError(f"La exportación no terminó de descargarse en {timeout}s ({directorio})")
+
+def exportar_grid(driver, formato="csv", timeout=120):
+    """
+    Dispara la exportación nativa de la visualización del grid (los filtros ya
+    aplicados) y devuelve la ruta del archivo descargado. RuntimeError si no
+    encuentra el menú de exportar. Deja el driver en el iframe del grid.
+    """
+    directorio = (_DESCARGAS.get(driver.session_id) or (None,))[0] or preparar_descargas(driver)
+    antes = set(os.listdir(directorio))
+    pasos = [{"re": r} for r in PASOS_EXPORTAR[formato]] + [{"re": RE_CONFIRMAR_EXPORTAR, "opcional": True}]
+    driver.set_script_timeout(60)
+    res = None
+    # El menú puede estar en el iframe del grid o en el documento de afuera
+    try:
+        for en_frame in (True, False):
+            if en_frame:
+                if not switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6):
+                    continue
+            else:
+                driver.switch_to.default_content()
+            with fase("clics_exportar", formato=formato):
+                res = llamar_js(driver, "clicsExportar", pasos, 10000 if en_frame else 3000)
+            if res and res.get("ok"):
+                break
+    finally:
+        # De vuelta al grid: huellaGrid fuera del iframe da null y la próxima
+        # espera del cambio aceptaría el grid viejo
+        switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6)
+    if not res or not res.get("ok"):
+        raise RuntimeError(f"No pude exportar el grid: {res}")
+    with fase("esperar_descarga"):
+        return esperar_descarga(directorio, antes, timeout)
+
+def _filas_csv(ruta):
+    with open(ruta, "rb") as f:
+        inicio = f.read(4096)
+    enc = "utf-16" if inicio[:2] in (b"\xff\xfe", b"\xfe\xff") else "utf-8-sig"
+    with open(ruta, newline="", encoding=enc) as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t")
+        except csv.Error:
+            dialecto = csv.excel
+        yield from csv.reader(f, dialecto)
+
+def _columna_xlsx(ref):
+    # 'AB12' -> 27 (índice desde 0)
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + ord(ch.upper()) - 64
+    return n - 1
+
+def _filas_xlsx(ruta):
+    # Lectura en streaming de la primera hoja (iterparse), sin openpyxl
+    with zipfile.ZipFile(ruta) as z:
+        nombres = z.namelist()
+        compartidas = []
+        if "xl/sharedStrings.xml" in nombres:
+            with z.open("xl/sharedStrings.xml") as f:
+                for _, el in ET.iterparse(f):
+                    if el.tag.endswith("}si"):
+                        compartidas.append("".join(t.text or "" for t in el.iter() if t.tag.endswith("}t")))
+                        el.clear()
+        hojas = sorted((n for n in nombres if re.fullmatch(r"xl/worksheets/sheet\d+\.xml", n)),
+                       key=lambda n: int(re.search(r"\d+", n.rsplit("/", 1)[1]).group()))
+        with z.open(hojas[0]) as f:
+            for _, el in ET.iterparse(f):
+                if not el.tag.endswith("}row"):
+                    continue
+                fila = []
+                for c in el:
+                    if not c.tag.endswith("}c"):
+                        continue
+                    i = _columna_xlsx(c.get("r") or "") if c.get("r") else len(fila)
+                    fila.extend([""] * (i - len(fila)))
+                    v = next((x.text for x in c.iter() if x.tag.endswith("}v") or x.tag.endswith("}t")), None)
+                    if c.get("t") == "s" and v is not None:
+                        v = compartidas[int(v)]
+                    fila.append(v or "")
+                yield fila
+                el.clear()
+
+def _es_codigos(celdas):
+    # Segunda fila de headers del grid: códigos ('EUR', 'JPY'...), no valores
+    llenas = [x for x in celdas if x.strip()]
+    codigos = sum(bool(re.fullmatch(r"[A-Z][A-Z0-9]{2,4}", x.strip())) for x in llenas)
+    return bool(llenas) and codigos >= len(llenas) * 0.8
+
+def filas_exportadas(ruta):
+    """
+    Genera las filas de un archivo exportado con la misma forma que sweep_rows:
+    {'fecha': dd/mm/yyyy, 'columnas': [{'name','code','value'}, ...]}. Entiende la
+    tabla cruzada del grid (fila de nombres, fila de códigos, una fila por fecha)
+    y el formato largo (columnas fecha / moneda / código / valor).
+    """
+    filas = (_filas_xlsx if zipfile.is_zipfile(ruta) else _filas_csv)(ruta)
+    filas = ([x.strip() for x in f] for f in filas if any(x.strip() for x in f))
+    nombres = next(filas, None)
+    if nombres is None:
+        return
+    cab = [_norm(x) for x in nombres]
+
+    def col(*claves):
+        return next((i for i, x in enumerate(cab) if any(x.startswith(k) for k in claves)), None)
+
+    i_cod, i_mon, i_val = col("codigo", "code", "iso"), col("moneda", "nombre", "currency"), col("valor", "value")
+    if i_cod is not None and i_val is not None:
+        # Formato largo: una moneda por fila, agrupadas por fecha
+        i_fecha = col("fecha", "date")
+        actual, columnas = None, []
+        for f in filas:
+            f = f + [""] * (len(cab) - len(f))
+            fecha = _fecha_fila(f[i_fecha]) if i_fecha is not None else ""
+            if columnas and fecha != actual:
+                yield {"fecha": actual, "columnas": columnas}
+                columnas = []
+            actual = fecha
+            columnas.append({"name": f[i_mon] if i_mon is not None else "", "code": f[i_cod], "value": f[i_val]})
+        if columnas:
+            yield {"fecha": actual, "columnas": columnas}
+        return
+
+    # Tabla cruzada: la primera columna es la fecha (header de fila)
+    codigos = [""] * len(nombres)
+    primera = next(filas, None)
+    if primera is not None and _es_codigos(primera[1:]):
+        codigos, primera = primera, next(filas, None)
+    for f in chain([primera] if primera is not None else [], filas):
+        f = f + [""] * (len(nombres) - len(f))
+        yield {"fecha": _fecha_fila(f[0]),
+               "columnas": [{"name": nombres[j], "code": codigos[j] if j < len(codigos) else "", "value": f[j]}
+                            for j in range(1, len(nombres)) if nombres[j] or f[j]]}
+
+def leer_exportado(driver, formato="csv", timeout=120):
+    """Exporta el grid y genera sus filas (ver filas_exportadas); borra el archivo si es temporal."""
+    ruta = exportar_grid(driver, formato, timeout)
+    try:
+        with fase("leer_exportado"):
+            yield from filas_exportadas(ruta)
+    finally:
+        if not _DESCARGAS.get(driver.session_id, (None, False))[1]:
+            try: os.remove(ruta)
+            except OSError: pass
+
 # =========================
 # Normalización y matching
 # =========================
@@ -477,100 +1703,2851 @@ def _norm(s):
     s = "".join(ch for ch in s if not unicodedata.combining(ch))
     return s.lower()
 
-def _similar(a, b):
-    A = set(_norm(a).split())
-    B = set(_norm(b).split())
+def _tokens(s):
+    return frozenset(_norm(s).split())
+
+def _jaccard(A, B):
     if not A or not B:
         return 0.0
     return len(A & B) / float(len(A | B))
 
-def extraer_objetivo(rows, buscadas=TARGETS):
+def _similar(a, b):
+    return _jaccard(_tokens(a), _tokens(b))
+
+class IndiceAlias:
+    """
+    Índice persistente (JSON) de alias -> código ISO canónico. Los alias son
+    nombres normalizados y los propios códigos. Arranca con TARGETS/CODE_BY_NAME y crece
+    con cada encabezado nombre/código que trae el grid. Los tokens para el
+    emparejamiento difuso se calculan una vez por alias.
+    """
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.por_alias = {}   # alias normalizado o código -> código canónico
+        self.nombres = {}     # código canónico -> nombre tal como lo muestra el grid
+        self._tokens = {}     # alias normalizado -> tokens
+        self._cambios = False
+        for nombre in TARGETS:
+            self.agregar(nombre, CODE_BY_NAME.get(_norm(nombre)))
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                data = json.load(f)
+            for alias, code in data.get("alias", {}).items():
+                self.agregar(alias, code)
+            self.nombres.update(data.get("nombres", {}))
+        self._cambios = False
+
+    def agregar(self, nombre, code):
+        code = (code or "").strip().upper()
+        n = _norm(nombre)
+        if not code or not n:
+            return
+        for alias in (n, code.lower()):
+            if self.por_alias.get(alias) != code:
+                self.por_alias[alias] = code
+                self._tokens[alias] = _tokens(alias)
+                self._cambios = True
+        if code not in self.nombres:
+            self.nombres[code] = nombre.strip()
+            self._cambios = True
+
+    def aprender(self, rows):
+        for r in rows:
+            if r.get("name") and r.get("code"):
+                self.agregar(r["name"], r["code"])
+
+    def resolver(self, nombre_o_codigo, umbral=0.5):
+        """Código canónico de un nombre o código; difuso solo si no hay coincidencia exacta."""
+        n = _norm(nombre_o_codigo)
+        code = self.por_alias.get(n)
+        if code or not n:
+            return code
+        A = _tokens(n)
+        best, best_s = None, 0.0
+        for alias, B in self._tokens.items():
+            s = _jaccard(A, B)
+            if s > best_s:
+                best_s, best = s, alias
+        return self.por_alias[best] if best and best_s >= umbral else None
+
+    def guardar(self):
+        if not (self.ruta and self._cambios):
+            return
+        tmp = self.ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"alias": self.por_alias, "nombres": self.nombres}, f, ensure_ascii=False,
+                      indent=1, sort_keys=True)
+        os.replace(tmp, self.ruta)
+        self._cambios = False
+
+def cargar_objetivos(ruta):
+    """Monedas a extraer desde un archivo: lista JSON o un nombre/código por línea (# comenta)."""
+    with open(ruta, encoding="utf-8-sig") as f:
+        if ruta.lower().endswith(".json"):
+            return [str(x) for x in json.load(f)]
+        return [l.strip() for l in f if l.strip() and not l.lstrip().startswith("#")]
+
+def extraer_objetivo(rows, buscadas=TARGETS, indice=None):
+    indice = indice or IndiceAlias()
+    indice.aprender(rows)
     idx_by_name = { _norm(r["name"]): r for r in rows }
     idx_by_code = {}
     for r in rows:
         c = (r.get("code") or "").strip().upper()
         if c: idx_by_code[c] = r
+    tokens_filas = None  # solo si hace falta el difuso
 
     out = []
     for nombre in buscadas:
         n = _norm(nombre)
-        r = idx_by_name.get(n)
+        r = idx_by_name.get(n) or idx_by_code.get(nombre.strip().upper())
 
         if not r:
-            exp_code = CODE_BY_NAME.get(n, "")
+            exp_code = indice.resolver(nombre)
             if exp_code:
                 r = idx_by_code.get(exp_code)
 
         if not r:
+            if tokens_filas is None:
+                tokens_filas = [(_tokens(cand["name"]), cand) for cand in rows]
+            A = _tokens(n)
             best = None; best_s = 0.0
-            for cand in rows:
-                s = _similar(nombre, cand["name"])
+            for B, cand in tokens_filas:
+                s = _jaccard(A, B)
                 if s > best_s: best_s, best = s, cand
             if best and best_s >= 0.5: r = best
 
-        if r and r.get("value"):
-            out.append({"moneda": nombre, "codigo": r.get("code",""), "venta": r["value"]})
-        else:
-            out.append({"moneda": nombre, "codigo": r.get("code","") if r else "", "venta": "ERROR"})
+        # venta: texto tal cual lo muestra el grid; valor: Decimal exacto (ambos None si no hay dato)
+        texto = (r.get("value") or None) if r else None
+        out.append({"moneda": nombre, "codigo": r.get("code","") if r else "", "venta": texto,
+                    "valor": valor_decimal(texto, DECIMAL_GRID)})
     return out
 
-# =========================
-# Flujo principal
-# =========================
-def main(url, fecha, comparador, texto_tasa, texto_cambio, espera):
-    driver = build_driver()
-    driver.get(url)
+def extraer_catalogo(rows, indice=None):
+    """Todas las columnas capturadas, con su código canónico según el índice de alias."""
+    indice = indice or IndiceAlias()
+    indice.aprender(rows)
+    out = []
+    for r in rows:
+        code = (r.get("code") or "").strip().upper() or indice.resolver(r["name"]) or ""
+        out.append({"moneda": r["name"] or indice.nombres.get(code, ""), "codigo": code,
+                    "venta": r["value"] or None, "valor": valor_decimal(r["value"], DECIMAL_GRID)})
+    return out
+
+# =========================
+# Valores numéricos y tasas cruzadas
+# =========================
+NAN = float("nan")
+DECIMAL_GRID = ","  # el grid muestra los números en es-CO: '1.234' es mil doscientos treinta y cuatro
+_RE_DECIMAL = re.compile(r"-?(\d+(\.\d*)?|\.\d+)")
+_RE_CIENTIFICA = re.compile(r"[+-]?\d+(\.\d+)?[eE][+-]?\d+")
+
+def valor_decimal(texto, decimal=None):
+    """
+    Decimal exacto de una celda ('4.123,45', '0,000245', '4,123.45', '1 234,5',
+    '$ 4,1', '12 %') o None si está vacía o no es un número ('N/D', '12abc34'). Con los dos separadores, el último es
+    el decimal; con uno solo que aparece una vez, también ('1.234' -> 1.234).
+    `decimal` (',' o '.') fija el separador cuando el origen es conocido.
+    """
+    if texto is None or isinstance(texto, bool):
+        return None
+    if isinstance(texto, Decimal):
+        return texto
+    if isinstance(texto, (int, float)):
+        return Decimal(repr(texto)) if texto == texto else None
+    s = str(texto).strip()
+    if _RE_CIENTIFICA.fullmatch(s):
+        return Decimal(s)
+    # Solo se quitan espacios (también NBSP), símbolos de moneda y %; si queda una
+    # letra ('N/D', '12abc34') la celda no es un número
+    s = "".join(ch for ch in s.replace("−", "-") if not (ch.isspace() or ch == "%"
+                                                       or unicodedata.category(ch) == "Sc"))
+    if s.startswith("+"):
+        s = s[1:]
+    if decimal is None:
+        if "," in s and "." in s:
+            decimal = "," if s.rfind(",") > s.rfind(".") else "."
+        elif s.count(",") == 1:
+            decimal = ","
+        elif s.count(".") == 1:
+            decimal = "."
+    miles = ",." if decimal is None else ("." if decimal == "," else ",")
+    for sep in miles:
+        s = s.replace(sep, "")
+    if decimal:
+        s = s.replace(decimal, ".")
+    if not _RE_DECIMAL.fullmatch(s):
+        return None
+    return Decimal(s)
+
+def _usd_por_unidad(cambio):
+    # "Dólares estadounidenses por cada moneda" -> True; "Monedas por cada dólar..." -> False
+    return "por cada moneda" in _norm(cambio)
+
+_NUMPY = []
+
+def _numpy():
+    """numpy si está instalado (opcional), o None para usar listas de array('d')."""
+    if not _NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    return _NUMPY[0]
+
+class TablaTasas:
+    """
+    Valores de un tipo de tasa y de cambio como matriz fechas x monedas (float64,
+    NaN = sin dato) con índice (fecha, código ISO). Las filas son array('d');
+    matriz() las entrega como ndarray si hay numpy, y cruzadas()/cruce() operan
+    sobre columnas enteras en vez de valor por valor.
+    """
+
+    def __init__(self, cambio=None):
+        self.usd_por_unidad = cambio is None or _usd_por_unidad(cambio)
+        self.fechas, self.codigos = [], []
+        self.ifecha, self.icodigo = {}, {}
+        self.filas = []
+        self._matriz = None
+
+    def poner(self, fecha, codigo, valor):
+        """fecha: date o ISO; valor: Decimal/float/None (None deja el NaN)."""
+        if isinstance(fecha, str):
+            fecha = datetime.fromisoformat(fecha).date()
+        i = self.ifecha.get(fecha)
+        if i is None:
+            i = self.ifecha[fecha] = len(self.fechas)
+            self.fechas.append(fecha)
+            self.filas.append(array("d"))
+        j = self.icodigo.get(codigo)
+        if j is None:
+            j = self.icodigo[codigo] = len(self.codigos)
+            self.codigos.append(codigo)
+        fila = self.filas[i]
+        if len(fila) <= j:
+            fila.extend([NAN] * (j + 1 - len(fila)))
+        fila[j] = NAN if valor is None else float(valor)
+        self._matriz = None
+
+    def agregar(self, regs):
+        """
+        Carga registros de registros(). Se omiten los que no traen código y los de
+        una fecha que no se pudo leer (el header de fila tal cual), avisando por stderr.
+        """
+        malas = set()
+        for r in regs:
+            if not r["codigo"] or r["fecha"] in malas:
+                continue
+            try:
+                self.poner(r["fecha"], r["codigo"], r["valor"])
+            except ValueError:
+                malas.add(r["fecha"])
+                print(f"[Cruzadas] fecha no reconocida {r['fecha']!r}: se omite esa fila", file=sys.stderr)
+        return self
+
+    def valor(self, fecha, codigo):
+        if isinstance(fecha, str):
+            fecha = datetime.fromisoformat(fecha).date()
+        i, j = self.ifecha.get(fecha), self.icodigo.get(codigo)
+        if i is None or j is None or j >= len(self.filas[i]):
+            return None
+        v = self.filas[i][j]
+        return None if v != v else v
+
+    def matriz(self):
+        """Fechas x monedas (en el orden de self.fechas / self.codigos)."""
+        if self._matriz is None:
+            n = len(self.codigos)
+            np = _numpy()
+            if np is not None:
+                m = np.full((len(self.fechas), n), np.nan)
+                for i, fila in enumerate(self.filas):
+                    m[i, :len(fila)] = np.frombuffer(fila, dtype=np.float64)
+            else:
+                m = [fila + array("d", [NAN] * (n - len(fila))) for fila in self.filas]
+            self._matriz = m
+        return self._matriz
+
+    def _usd(self, valores):
+        # Dólares por unidad de moneda, sea cual sea el sentido del tipo de cambio
+        if self.usd_por_unidad:
+            return valores
+        if _numpy() is not None:
+            with _numpy().errstate(divide="ignore"):
+                return 1.0 / valores
+        return [1.0 / v if v else NAN for v in valores]
+
+    def cruzadas(self, fecha=None):
+        """
+        (códigos, matriz) con M[i][j] = unidades de la moneda j por 1 unidad de la i,
+        para `fecha` (por defecto la más reciente). Si el grid no trae USD, va al final.
+        """
+        fecha = max(self.fechas) if fecha is None else fecha
+        if isinstance(fecha, str):
+            fecha = datetime.fromisoformat(fecha).date()
+        u = self._usd(self.matriz()[self.ifecha[fecha]])
+        codigos = list(self.codigos)
+        np = _numpy()
+        if "USD" not in self.icodigo:
+            codigos.append("USD")
+            u = np.append(u, 1.0) if np is not None else list(u) + [1.0]
+        if np is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return codigos, u[:, None] / u[None, :]
+        return codigos, [[a / b if b else NAN for b in u] for a in u]
+
+    def cruce(self, de, a):
+        """[(fecha, unidades de `a` por 1 `de`)] para todas las fechas, en orden cronológico."""
+        np = _numpy()
+        orden = sorted(range(len(self.fechas)), key=self.fechas.__getitem__)
+
+        def usd(codigo):
+            if codigo == "USD" and codigo not in self.icodigo:
+                return [1.0] * len(self.fechas) if np is None else np.ones(len(self.fechas))
+            j = self.icodigo[codigo]
+            m = self.matriz()
+            return self._usd(m[:, j] if np is not None else [fila[j] for fila in m])
+
+        x, y = usd(de), usd(a)
+        if np is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r = (x / y).tolist()
+        else:
+            r = [p / q if q else NAN for p, q in zip(x, y)]
+        return [(self.fechas[i], None if r[i] != r[i] else r[i]) for i in orden]
+
+def _json_valor(o):
+    # json.dumps(default=...): los Decimal salen como número JSON
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"{type(o).__name__} no es serializable a JSON")
+
+def escribir_cruzadas(tablas, ruta):
+    """CSV fecha,tasa,de,a,valor con todas las tasas cruzadas de cada tabla y fecha."""
+    n = 0
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["fecha", "tasa", "de", "a", "valor"])
+        for (tasa, _), tabla in sorted(tablas.items()):
+            for fecha in sorted(tabla.fechas):
+                codigos, m = tabla.cruzadas(fecha)
+                for i, de in enumerate(codigos):
+                    for j, a in enumerate(codigos):
+                        v = m[i][j]
+                        if i != j and v == v:
+                            w.writerow([fecha.isoformat(), tasa, de, a, repr(float(v))])
+                            n += 1
+    return n
+
+# =========================
+# Vigilancia del navegador: memoria, latencia y reciclado
+# =========================
+def _rss_proc(pid):
+    # Suma del RSS de `pid` y sus descendientes leyendo /proc (Linux, sin psutil)
+    hijos = {}
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        hijos.setdefault(ppid, []).append(int(d))
+    total, pendientes = 0, [pid]
+    while pendientes:
+        p = pendientes.pop()
+        pendientes.extend(hijos.get(p, ()))
+        try:
+            with open(f"/proc/{p}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+def rss_navegador_mb(driver):
+    """
+    Memoria residente (MB) de msedgedriver y todos los procesos de Edge que lanzó.
+    Usa psutil si está instalado, /proc en Linux y, si no hay proceso propio (o no
+    se puede medir), el heap JS del documento actual. None si nada funciona.
+    """
+    proceso = getattr(getattr(driver, "service", None), "process", None)
+    pid = getattr(proceso, "pid", None)
+    if pid:
+        try:
+            import psutil
+            raiz = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [raiz] + raiz.children(recursive=True)
+                       if p.is_running()) / 2**20
+        except ImportError:
+            if os.path.isdir("/proc"):
+                return _rss_proc(pid) / 2**20
+        except Exception:
+            pass
+    try:
+        heap = driver.execute_script("return performance.memory ? performance.memory.usedJSHeapSize : null;")
+        return heap / 2**20 if heap else None
+    except Exception:
+        return None
+
+class Vigia:
+    """
+    Decide cuándo reciclar un navegador: tras `max_consultas`, si pasa de
+    `max_rss_mb` o si la mediana de las últimas `ventana` consultas supera
+    `factor_latencia` veces la de las primeras desde que arrancó. 0/None = sin ese límite.
+    """
+
+    def __init__(self, max_consultas=None, max_rss_mb=None, factor_latencia=None, ventana=5):
+        self.max_consultas = max_consultas
+        self.max_rss_mb = max_rss_mb
+        self.factor_latencia = factor_latencia
+        self.ventana = ventana
+        self.reiniciar()
 
-    wait_until_ready(driver)
-    aceptar_cookies(driver)
+    def reiniciar(self):
+        self.consultas = 0
+        self.primeras = []
+        self.recientes = deque(maxlen=self.ventana)
 
+    def anotar(self, ms):
+        self.consultas += 1
+        if len(self.primeras) < self.ventana:
+            self.primeras.append(ms)
+        self.recientes.append(ms)
+
+    def motivo(self, driver):
+        """Por qué habría que reciclar `driver` ahora, o None."""
+        if self.max_consultas and self.consultas >= self.max_consultas:
+            return f"{self.consultas} consultas"
+        if self.factor_latencia and self.consultas >= 2 * self.ventana:
+            base = _percentil(sorted(self.primeras), 50)
+            ahora = _percentil(sorted(self.recientes), 50)
+            if base and ahora > self.factor_latencia * base:
+                return f"latencia {ahora:.0f} ms (al arrancar {base:.0f} ms)"
+        if self.max_rss_mb and self.consultas:
+            rss = rss_navegador_mb(driver)
+            if rss and rss > self.max_rss_mb:
+                return f"memoria {rss:.0f} MB"
+        return None
+
+def reciclar_driver(driver, crear_driver, motivo):
+    """Cierra `driver` y devuelve uno nuevo de crear_driver()."""
+    print(f"[Reciclar] Navegador nuevo: {motivo}", file=sys.stderr)
+    with fase("reciclar", motivo=motivo):
+        sid = getattr(driver, "session_id", None)
+        _LAYOUTS.pop(sid, None)
+        _DESCARGAS.pop(sid, None)
+        _ESPERA_COOKIES.pop(sid, None)
+        _RAPIDOS.discard(sid)
+        for clave in [k for k in _RUTAS_FRAME if k[0] == sid]:  # (session_id, selector)
+            del _RUTAS_FRAME[clave]
+        try: driver.quit()
+        except Exception: pass
+        return crear_driver()
+
+# =========================
+# Consultas y lote (una sola sesión de navegador)
+# =========================
+Consulta = namedtuple("Consulta", ["fecha", "comparador", "tasa", "cambio"])
+
+COMPARADOR_IGUAL = "Igual que"
+COMPARADOR_DESDE = "Iniciar en"
+
+TILE_FECHA = "dashboardfilterviz_box_0"
+TILE_TASA = "dashboardfilterviz_box_2"
+TILE_CAMBIO = "dashboardfilterviz_box_3"
+
+def _parse_fecha(s):
+    return datetime.strptime(s.strip(), "%d/%m/%Y").date()
+
+def rango_fechas(desde, hasta):
+    """Lista de fechas dd/mm/yyyy entre desde y hasta (ambas incluidas)."""
+    d, h = _parse_fecha(desde), _parse_fecha(hasta)
+    out = []
+    while d <= h:
+        out.append(d.strftime("%d/%m/%Y"))
+        d += timedelta(days=1)
+    return out
+
+def cargar_consultas(ruta, comparador, tasa, cambio):
+    """
+    Lee consultas desde JSON (lista de objetos o de listas) o CSV con encabezado
+    fecha,comparador,tasa,cambio. Los campos faltantes toman los valores por defecto.
+    """
+    def _una(d):
+        return Consulta(d["fecha"].strip(), (d.get("comparador") or comparador).strip(),
+                        (d.get("tasa") or tasa).strip(), (d.get("cambio") or cambio).strip())
+
+    with open(ruta, encoding="utf-8-sig", newline="") as f:
+        if ruta.lower().endswith(".json"):
+            data = json.load(f)
+            campos = list(Consulta._fields)
+            return [_una(d if isinstance(d, dict) else dict(zip(campos, d))) for d in data]
+        return [_una(d) for d in csv.DictReader(f) if (d.get("fecha") or "").strip()]
+
+def planificar_consultas(consultas):
+    """
+    Quita duplicados y ordena para tocar el mínimo de filtros entre consultas:
+    agrupa por tasa (cambiarla obliga a recargar), luego cambio y comparador,
+    y dentro de cada grupo solo se mueve la fecha.
+    """
+    unicas = list(dict.fromkeys(consultas))
+    return sorted(unicas, key=lambda c: (c.tasa, c.cambio, c.comparador, _parse_fecha(c.fecha)))
+
+def preparar_pagina(driver, url):
+    with fase("driver.get"):
+        driver.get(url)
+    with fase("wait_until_ready"):
+        wait_until_ready(driver)
+    with fase("aceptar_cookies"):
+        aceptar_cookies(driver)
+
+# Peor caso de JS_APLICAR_FILTROS por filtro: (esperas de `timeout`, segundos fijos).
+# Abrir el tile son dos esperas; la tasa suma la de 'Agregar' y 1,5 s de confirmación,
+# el cambio 1 s, y la fecha hasta 5 s buscando la lista del comparador.
+ESPERAS_FILTRO_JS = {"fecha": (2, 5.0), "tasa": (3, 1.5), "cambio": (2, 1.0)}
+
+def _tope_filtros_js(filtros, timeout):
+    """Segundos que puede tardar JS_APLICAR_FILTROS con `filtros` sin haber fallado."""
+    return sum(n * timeout + fijo for n, fijo in (ESPERAS_FILTRO_JS[f] for f in filtros))
+
+def aplicar_filtros_js(driver, consulta, filtros, timeout=40):
+    """
+    Aplica `filtros` (subconjunto de fecha/tasa/cambio) en una sola llamada al
+    navegador. Devuelve {filtro: estado} solo con los que quedaron aplicados.
+    """
+    tiles = {"fecha": TILE_FECHA, "tasa": TILE_TASA, "cambio": TILE_CAMBIO}
+    driver.set_script_timeout(_tope_filtros_js(filtros, timeout) + 5)
+    try:
+        res = llamar_js(driver, "aplicarFiltros", consulta._asdict(),
+                        {f: tiles[f] for f in filtros}, int(timeout * 1000))
+    except Exception as e:
+        res = {"ok": False, "step": "webdriver", "error": repr(e)}
+    estados = (res or {}).get("filtros") or {}
+    return {f: st for f, st in estados.items() if st and st.get("ok")}
+
+def aplicar_filtros(driver, consulta, previa=None, verbose=True, modo="js"):
+    """
+    Aplica solo los filtros que difieren de `previa` (None = aplicar todos).
+    Un cambio de tasa requiere página recién cargada: el shuttle acumula selecciones.
+    modo="js" los aplica en una sola llamada (JS_APLICAR_FILTROS); lo que falle ahí,
+    y todo con modo="pasos", se hace tile por tile desde Python.
+    """
+    driver.switch_to.default_content()
+    filtros = [f for f, difiere in (
+        ("fecha", previa is None or (consulta.fecha, consulta.comparador) != (previa.fecha, previa.comparador)),
+        ("tasa", previa is None or consulta.tasa != previa.tasa),
+        ("cambio", previa is None or consulta.cambio != previa.cambio)) if difiere]
+    estado = {}
+    if modo == "js" and filtros:
+        with fase("filtros_js", filtros=",".join(filtros)):
+            estado = aplicar_filtros_js(driver, consulta, filtros)
+        if verbose:
+            for f in filtros:
+                print(f"[Filtro {f}]", estado.get(f, "falló en una sola llamada -> tile por tile"))
+    return filtros_por_tile(driver, consulta, [f for f in filtros if f not in estado], estado, verbose)
+
+def filtros_por_tile(driver, consulta, filtros, estado=None, verbose=True):
+    """Aplica `filtros` abriendo cada tile desde Python (el camino lento y seguro). Agrega a `estado`."""
+    estado = {} if estado is None else estado
+    if filtros:
+        driver.execute_script("delete window.__bancoFiltros;")
     # 1) FECHA
-    open_filter_tile(driver, "dashboardfilterviz_box_0")
-    res_fecha = call_js_function(driver, JS_FN_SET_FECHA, "__setFecha", comparador, fecha)
-    print("[Fecha]", res_fecha)
+    if "fecha" in filtros:
+        with fase("open_filter_tile", tile=TILE_FECHA):
+            open_filter_tile(driver, TILE_FECHA)
+        with fase("filtro_fecha"):
+            estado["fecha"] = llamar_js(driver, "setFecha", consulta.comparador, consulta.fecha)
+        if verbose: print("[Fecha]", estado["fecha"])
 
     # 2) TIPO DE TASA
-    open_filter_tile(driver, "dashboardfilterviz_box_2")
-    click_shuttle_option_and_add(driver, texto_tasa)
-    print("[Tipo de Tasa] OK ->", texto_tasa)
+    if "tasa" in filtros:
+        with fase("open_filter_tile", tile=TILE_TASA):
+            open_filter_tile(driver, TILE_TASA)
+        with fase("filtro_tasa"):
+            click_shuttle_option_and_add(driver, consulta.tasa)
+        estado["tasa"] = "OK"
+        if verbose: print("[Tipo de Tasa] OK ->", consulta.tasa)
 
     # 3) TIPO DE CAMBIO
-    open_filter_tile(driver, "dashboardfilterviz_box_3")
-    click_shuttle_option_only(driver, texto_cambio)
-    print("[Tipo de Cambio] OK ->", texto_cambio)
+    if "cambio" in filtros:
+        with fase("open_filter_tile", tile=TILE_CAMBIO):
+            open_filter_tile(driver, TILE_CAMBIO)
+        with fase("filtro_cambio"):
+            click_shuttle_option_only(driver, consulta.cambio)
+        estado["cambio"] = "OK"
+        if verbose: print("[Tipo de Cambio] OK ->", consulta.cambio)
+
+    if filtros:
+        driver.execute_script("window.__bancoFiltros = arguments[0];", consulta._asdict())
+    return estado
+
+def adoptar_pestana(driver):
+    """
+    Si el driver se conectó a un Edge abierto cuya pestaña ya tenía el dashboard
+    (build_driver(conectar=...)) y este script le aplicó filtros, devuelve esa
+    Consulta: se sigue desde ahí sin recargar. Si no, None (hay que cargar la página).
+    """
+    if driver.session_id not in _ADOPTABLES:
+        return None
+    _ADOPTABLES.discard(driver.session_id)
+    try:
+        driver.switch_to.default_content()
+        if not driver.execute_script(JS_DASHBOARD_LISTO):
+            return None
+        q = driver.execute_script("return window.__bancoFiltros || null;")
+        return Consulta(**{k: q[k] for k in Consulta._fields}) if q else None
+    except Exception:
+        return None
+
+def leer_grid_filas(driver, huella_previa, quieto_ms=500, timeout_grid=60, barrido="async"):
+    """
+    Como leer_grid pero con barrido 2D: genera las filas del grid a medida que se leen
+    (con un barrido de exportación, las del archivo exportado).
+    """
+    with fase("wait_for_grid_loaded"):
+        wait_for_grid_loaded(driver, timeout=timeout_grid)
+    with fase("wait_for_grid_change"):
+        wait_for_grid_change(driver, huella_previa, quiet_ms=quieto_ms, timeout=timeout_grid)
+    if barrido in MODOS_EXPORTAR:
+        try:
+            yield from leer_exportado(driver, MODOS_EXPORTAR[barrido])
+            return
+        except (RuntimeError, TimeoutError) as e:
+            print(f"[Exportar] {e} -> barrido 2D en el navegador", file=sys.stderr)
+        switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6)
+    yield from sweep_rows(driver)
+
+def leer_grid(driver, huella_previa, barrido="async", quieto_ms=500, timeout_grid=60, buscadas=None):
+    """Espera a que el grid cambie y lo barre. Devuelve (rows, huella_actual)."""
+    with fase("wait_for_grid_loaded"):
+        wait_for_grid_loaded(driver, timeout=timeout_grid)
+    with fase("wait_for_grid_change"):
+        wait_for_grid_change(driver, huella_previa, quiet_ms=quieto_ms, timeout=timeout_grid)
+    with fase("barrido", modo=barrido):
+        rows = sweep_and_read_all_columns(driver, settle_ms=120, modo=barrido, buscadas=buscadas)
+    # La huella se toma después del barrido: el scroll cambia las celdas visibles
+    return rows, llamar_js(driver, "huellaGrid")
+
+class SesionLote:
+    """
+    Página del dashboard ya cargada que recuerda los filtros aplicados y la huella del grid.
+    Con `crear_driver` y `reciclar` (kwargs de Vigia) cambia de navegador entre consultas
+    cuando el actual se degrada, y reintenta una vez en uno nuevo la consulta que falle.
+    """
+
+    def __init__(self, driver, url, barrido="async", quieto_ms=500, timeout_grid=60, filtros="js",
+                 buscadas=None, reciclar=None, crear_driver=None):
+        self.driver = driver
+        self.crear_driver = crear_driver
+        self.vigia = Vigia(**reciclar) if reciclar and crear_driver else None
+        self.url = url
+        self.barrido = barrido
+        self.filtros = filtros
+        self.buscadas = buscadas
+        self.quieto_ms = quieto_ms
+        self.timeout_grid = timeout_grid
+        self.previa = None
+        self.huella = None
+        self.limpia = False  # página recién cargada, sin filtros aplicados
+        self.adoptada = False  # pestaña de un Edge abierto, con filtros de una corrida anterior
+
+    def preparar(self):
+        """
+        Carga la página (sin filtros); la siguiente consulta no la vuelve a cargar.
+        Conectado a un Edge abierto, adopta la pestaña del dashboard con sus filtros.
+        """
+        previa = adoptar_pestana(self.driver)
+        if previa is None:
+            preparar_pagina(self.driver, self.url)
+        with fase("capturar_huella"):
+            self.huella = capturar_huella(self.driver)
+        self.previa = previa
+        self.limpia = previa is None
+        self.adoptada = previa is not None
+
+    def reciclar(self, motivo):
+        """Navegador nuevo con la página cargada; la siguiente consulta aplica todos los filtros."""
+        self.driver = reciclar_driver(self.driver, self.crear_driver, motivo)
+        self.preparar()
+        if self.vigia:
+            self.vigia.reiniciar()
 
-    # Espera fija extra para que el grid se reprocese
-    if espera and espera > 0:
-        print(f"[Espera] {espera:.1f}s para que el grid termine de renderizar…")
-        time.sleep(espera)
+    def cerrar(self):
+        try: self.driver.quit()
+        except Exception: pass
 
-    # 4) Esperar grid y leer TODO el ancho
-    wait_for_grid_loaded(driver, timeout=60)
-    rows = sweep_and_read_all_columns(driver, settle_ms=120)
+    def descartar(self):
+        """Tras una consulta fallida la página quedó en un estado desconocido: la próxima recarga."""
+        self.previa, self.limpia, self.adoptada = None, False, False
+
+    def _vigilar(self):
+        # Entre consultas: nunca se recicla con una consulta a medio entregar
+        motivo = self.vigia and self.vigia.motivo(self.driver)
+        if motivo:
+            self.reciclar(motivo)
+
+    def _filtrar(self, c):
+        if not self.limpia and self.previa is None:
+            self.preparar()  # puede adoptar una pestaña ya filtrada
+        # Otra tasa, o la misma consulta otra vez (refresco): sin filtros que cambiar el
+        # grid no se re-consulta y se esperaría timeout_grid un cambio que no llega
+        if not self.limpia and (c.tasa != self.previa.tasa or (c == self.previa and not self.adoptada)):
+            self.preparar()
+        if self.adoptada and c == self.previa:
+            self.huella = None  # pestaña adoptada que ya muestra esta consulta: nada que esperar
+        self.adoptada = False
+        aplicar_filtros(self.driver, c, self.previa, verbose=False, modo=self.filtros)
+        self.previa = c
+        self.limpia = False
+
+    def _consultar(self, c):
+        with fase("consulta", fecha=c.fecha, tasa=c.tasa):
+            self._filtrar(c)
+            rows, self.huella = leer_grid(self.driver, self.huella, self.barrido,
+                                          self.quieto_ms, self.timeout_grid, self.buscadas)
+        return rows
+
+    def consultar(self, c):
+        self._vigilar()
+        t0 = time.time()
+        try:
+            rows = self._consultar(c)
+        except Exception as e:
+            if not self.crear_driver:
+                raise
+            # Un navegador caído o colgado no se arregla reintentando en él
+            self.reciclar(f"falló {c.fecha} {c.tasa}: {e!r}")
+            t0 = time.time()
+            rows = self._consultar(c)
+        if self.vigia:
+            self.vigia.anotar((time.time() - t0) * 1000)
+        return rows
+
+    def filas(self, c):
+        """
+        Genera (consulta_del_día, rows). Con 'Iniciar en' el grid trae una fila por
+        fecha: se barre en 2D y cada fila sale como una consulta 'Igual que'.
+        """
+        if c.comparador != COMPARADOR_DESDE:
+            yield c, self.consultar(c)
+            return
+        self._vigilar()
+        entregadas = []
+        try:
+            yield from self._filas_desde(c, entregadas)
+        except Exception as e:
+            if not self.crear_driver:
+                raise
+            self.reciclar(f"falló {c.fecha} {c.tasa} (Iniciar en): {e!r}")
+            # Si lo entregado venía en orden se sigue desde el día siguiente; si no, se
+            # vuelve a pedir todo y se saltan las fechas ya entregadas
+            try:
+                dias = [_parse_fecha(f) for f in entregadas]
+            except ValueError:
+                dias = []
+            if dias and dias == sorted(dias):
+                if dias[-1] >= datetime.now().date():
+                    return  # ya se entregó hasta hoy
+                c = c._replace(fecha=(dias[-1] + timedelta(days=1)).strftime("%d/%m/%Y"))
+            yield from self._filas_desde(c, entregadas)
+
+    def _filas_desde(self, c, entregadas):
+        with fase("filtros", fecha=c.fecha, tasa=c.tasa):
+            self._filtrar(c)
+        for fila in leer_grid_filas(self.driver, self.huella, self.quieto_ms, self.timeout_grid, self.barrido):
+            if fila["fecha"] in entregadas:
+                continue
+            entregadas.append(fila["fecha"])
+            yield Consulta(fila["fecha"], COMPARADOR_IGUAL, c.tasa, c.cambio), fila["columnas"]
+        self.huella = llamar_js(self.driver, "huellaGrid")
+
+def ejecutar_lote(driver, url, consultas, barrido="async", quieto_ms=500, timeout_grid=60, filtros="js",
+                  buscadas=None, reciclar=None, crear_driver=None):
+    """
+    Ejecuta todas las consultas sobre una sola página cargada, en el orden de
+    planificar_consultas. Generador: entrega (consulta, rows) apenas termina cada una
+    (una por fecha para las consultas 'Iniciar en', ver SesionLote.filas); rows es
+    None si la consulta falló, y el lote sigue con la siguiente.
+    Si la sesión recicla el navegador, el nuevo se cierra aquí al terminar;
+    `driver` lo sigue cerrando quien lo creó.
+    """
+    sesion = SesionLote(driver, url, barrido, quieto_ms, timeout_grid, filtros, buscadas, reciclar, crear_driver)
+    try:
+        for c in planificar_consultas(consultas):
+            try:
+                yield from sesion.filas(c)
+            except Exception as e:
+                print(f"[Lote] {c.fecha} {c.tasa}: {e!r}", file=sys.stderr)
+                sesion.descartar()
+                yield c, None
+    finally:
+        if sesion.driver is not driver:
+            sesion.cerrar()
+
+class PestanaLote:
+    """Estado de una pestaña en ejecutar_pestanas: handle, paso en curso y filtros aplicados."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.paso = "cargar"   # cargar -> cargando -> libre -> filtros -> espera -> barrido -> libre
+        self.tarea = None
+        self.desde = 0.0       # cuándo empezó el paso (para el timeout)
+        self.consulta = None
+        self.previa = None
+        self.huella = None
+        self.inicio = 0.0      # cuándo se tomó la consulta (latencia para el vigía)
+        self.filtros = ()      # filtros lanzados en el paso "filtros"
+        self.recargas = 0      # cargas seguidas que no llegaron a tener grid
+
+def ejecutar_pestanas(driver, url, consultas, pestanas=3, barrido="async", quieto_ms=500, timeout_grid=60,
+                      filtros="js", buscadas=None, max_reintentos=1, reciclar=None, crear_driver=None):
+    """
+    Como ejecutar_lote, pero con `pestanas` pestañas del dashboard en el mismo
+    navegador. Cada paso (filtros, espera del grid, barrido) se lanza dentro de la
+    pestaña sin esperarlo (lanzar_js) y Python va rotando entre pestañas para ver
+    cuál terminó y lanzar su siguiente paso: las esperas de todas se solapan.
+    Generador: entrega (consulta, rows) en el orden en que terminan; rows es None
+    si la consulta falló más de `max_reintentos` veces. Las 'Iniciar en' (barrido
+    2D) se hacen al final en la primera pestaña, como en ejecutar_lote.
+    El driver conviene crearlo con build_driver(varias_pestanas=True). Para reciclarlo
+    (ver Vigia) se dejan de repartir consultas y se cambia cuando todas terminaron.
+    """
+    plan = planificar_consultas(consultas)
+    cola = deque(c for c in plan if c.comparador != COMPARADOR_DESDE)
+    historicas = [c for c in plan if c.comparador == COMPARADOR_DESDE]
+    tiles = {"fecha": TILE_FECHA, "tasa": TILE_TASA, "cambio": TILE_CAMBIO}
+    limite = timeout_grid * 3
+    vigia = Vigia(**reciclar) if reciclar and crear_driver else None
+    original, drenar = driver, None
+
+    def abrir():
+        tabs = [PestanaLote(driver.current_window_handle)]
+        for _ in range(min(pestanas, len(cola)) - 1):
+            driver.switch_to.new_window("tab")
+            bloquear_recursos(driver)
+            tabs.append(PestanaLote(driver.current_window_handle))
+        return tabs
+
+    def hecha(p):
+        # Consulta entregada: la pestaña queda libre y el vigía decide si hay que drenar
+        nonlocal drenar
+        p.consulta, p.tarea, p.paso = None, None, "libre"
+        if vigia:
+            vigia.anotar((time.time() - p.inicio) * 1000)
+            drenar = drenar or vigia.motivo(driver)
+
+    tabs = abrir()
+    intentos = Counter()
+
+    def fallo(p, motivo):
+        # La pestaña se recarga; la consulta vuelve a la cola o se da por fallida
+        c, p.consulta, p.tarea, p.paso, p.previa = p.consulta, None, None, "cargar", None
+        intentos[c] += 1
+        print(f"[Pestañas] {c.fecha} {c.tasa}: {motivo}", file=sys.stderr)
+        if intentos[c] > max_reintentos:
+            return c
+        cola.appendleft(c)
+        return None
+
+    try:
+        while cola or any(p.consulta for p in tabs):
+            if drenar and not any(p.consulta for p in tabs):
+                driver = reciclar_driver(driver, crear_driver, drenar)
+                tabs, drenar = abrir(), None
+                vigia.reiniciar()
+            avanzo = False
+            for p in tabs:
+                if p.consulta is None and not cola and p.paso not in ("cargar", "cargando"):
+                    continue
+                driver.switch_to.window(p.handle)
+                ahora = time.time()
+
+                if p.paso == "cargar":
+                    # Navegación sin bloquear: se sigue con las demás mientras carga
+                    driver.execute_script("location.href = arguments[0];", url)
+                    p.paso, p.desde, p.huella = "cargando", ahora, None
+                    avanzo = True
+                    continue
+                if p.paso == "cargando":
+                    try:
+                        listo = driver.execute_script("return document.readyState") == "complete" and \
+                            driver.execute_script(JS_DASHBOARD_LISTO)
+                        p.huella = grid_fingerprint(driver) if listo else None
+                    except Exception:
+                        p.huella = None
+                    if p.huella:
+                        aceptar_cookies(driver)
+                        p.paso, p.previa, p.recargas = "libre", None, 0
+                        avanzo = True
+                    elif ahora - p.desde > limite:
+                        p.recargas += 1
+                        if p.recargas > 3:
+                            raise RuntimeError(f"La pestaña no cargó el dashboard en {p.recargas} intentos")
+                        p.paso = "cargar"
+                    continue
+
+                if p.paso == "libre":
+                    if not cola or drenar:
+                        continue
+                    c = cola.popleft()
+                    if p.previa is not None and c.tasa != p.previa.tasa:
+                        # El shuttle acumula selecciones: tasa distinta = pestaña recargada
+                        cola.appendleft(c)
+                        p.paso = "cargar"
+                        continue
+                    p.consulta, p.inicio = c, ahora
+                    p.filtros = [f for f, difiere in (
+                        ("fecha", p.previa is None or (c.fecha, c.comparador) != (p.previa.fecha, p.previa.comparador)),
+                        ("tasa", p.previa is None or c.tasa != p.previa.tasa),
+                        ("cambio", p.previa is None or c.cambio != p.previa.cambio)) if difiere]
+                    driver.switch_to.default_content()
+                    if filtros == "js" and p.filtros:
+                        p.tarea = lanzar_js(driver, "aplicarFiltros", c._asdict(), {f: tiles[f] for f in p.filtros},
+                                            int(timeout_grid * 1000))
+                        p.paso, p.desde = "filtros", ahora
+                    else:
+                        filtros_por_tile(driver, c, p.filtros, verbose=False)
+                        p.paso, p.tarea = "filtros", None
+                    avanzo = True
+                    continue
+
+                # Pasos en curso: ver si la tarea de la pestaña terminó
+                if p.paso == "filtros":
+                    driver.switch_to.default_content()
+                elif not switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6):
+                    if ahora - p.desde > limite:
+                        malo = fallo(p, "no apareció el grid")
+                        if malo:
+                            yield malo, None
+                    continue
+                listo, valor = tarea_js(driver, p.tarea) if p.tarea else (True, {"ok": True})
+                if not listo:
+                    tope = max(limite, _tope_filtros_js(p.filtros, timeout_grid) + 5) if p.paso == "filtros" else limite
+                    if ahora - p.desde > tope:
+                        malo = fallo(p, f"sin respuesta en el paso '{p.paso}'")
+                        if malo:
+                            yield malo, None
+                    continue
+                avanzo = True
+                c = p.consulta
+
+                if p.paso == "filtros":
+                    estados = (valor or {}).get("filtros") or {}
+                    faltan = [f for f in p.filtros if not (estados.get(f) or {}).get("ok")]
+                    if faltan and p.tarea:
+                        # Lo que no salió en el navegador se hace tile por tile (bloquea solo esta vuelta)
+                        try:
+                            filtros_por_tile(driver, c, faltan, verbose=False)
+                        except Exception as e:
+                            malo = fallo(p, f"filtros {faltan}: {e!r}")
+                            if malo:
+                                yield malo, None
+                            continue
+                    p.previa = c
+                    if not switch_to_frame_with_selector(driver, "oj-data-grid", max_depth=6):
+                        malo = fallo(p, "no apareció el grid")
+                        if malo:
+                            yield malo, None
+                        continue
+                    p.tarea = lanzar_js(driver, "esperarCambioGrid", p.huella, quieto_ms, int(timeout_grid * 1000))
+                    p.paso, p.desde = "espera", ahora
+                elif p.paso == "espera":
+                    if not (valor or {}).get("ok"):
+                        print(f"[Pestañas] {c.fecha} {c.tasa}: la huella no cambió; se lee lo que haya",
+                              file=sys.stderr)
+                    if barrido == "seek" or barrido in MODOS_EXPORTAR:
+                        # seek decide según el layout y exportar espera la descarga: se hacen directo
+                        rows = sweep_and_read_all_columns(driver, modo=barrido, buscadas=buscadas)
+                        p.huella = llamar_js(driver, "huellaGrid")
+                        hecha(p)
+                        yield c, rows
+                        continue
+                    p.tarea = lanzar_js(driver, "barrer", 40, 3000)
+                    p.paso, p.desde = "barrido", ahora
+                elif p.paso == "barrido":
+                    if not (valor or {}).get("ok"):
+                        malo = fallo(p, f"barrido: {valor}")
+                        if malo:
+                            yield malo, None
+                        continue
+                    _registrar_pasos(valor)
+                    if valor.get("layout"):
+                        _LAYOUTS[driver.session_id] = valor["layout"]
+                    p.huella = llamar_js(driver, "huellaGrid")
+                    hecha(p)
+                    yield c, valor["rows"]
+            if not avanzo:
+                time.sleep(0.05)
+
+        if historicas:
+            driver.switch_to.window(tabs[0].handle)
+            yield from ejecutar_lote(driver, url, historicas, barrido, quieto_ms, timeout_grid, filtros, buscadas,
+                                     reciclar, crear_driver)
+    finally:
+        if driver is not original:
+            try: driver.quit()
+            except Exception: pass
+        else:
+            # Con un Edge conectado (ver build_driver) las pestañas extra quedarían abiertas
+            try:
+                for p in tabs[1:]:
+                    driver.switch_to.window(p.handle)
+                    driver.close()
+                driver.switch_to.window(tabs[0].handle)
+            except Exception:
+                pass
+
+# =========================
+# Pool de procesos (varios navegadores headless)
+# =========================
+def _partir_bloques(plan, tam_bloque):
+    """Índices del plan en bloques consecutivos con mismos tasa/cambio/comparador (máx. tam_bloque)."""
+    bloques, actual = [], []
+    for i, c in enumerate(plan):
+        if actual and (len(actual) >= tam_bloque or
+                       (c.tasa, c.cambio, c.comparador) != (plan[actual[-1]].tasa, plan[actual[-1]].cambio,
+                                                            plan[actual[-1]].comparador)):
+            bloques.append(actual); actual = []
+        actual.append(i)
+    if actual: bloques.append(actual)
+    return bloques
+
+def _worker_pool(wid, url, plan, opciones, perfil, conn, trazar=False):
+    # Cada worker pide un bloque, lo procesa y pide otro hasta recibir None.
+    # Antes de cada consulta espera permiso del padre (tope de concurrencia).
+    # Con trazar, al terminar le manda al padre sus spans.
+    driver = sesion = None
+    if trazar:
+        iniciar_traza("worker")
+    try:
+        # Un user-data-dir no se comparte entre navegadores vivos, y cada worker
+        # reconoce su descarga por archivo nuevo: un subdirectorio de cada uno por worker
+        for clave in ("dir_perfil", "dir_descargas"):
+            if perfil.get(clave):
+                perfil = dict(perfil, **{clave: os.path.join(perfil[clave], f"worker{wid}")})
+        driver = build_driver(headless=True, **perfil)
+        sesion = SesionLote(driver, url, crear_driver=lambda: build_driver(headless=True, **perfil), **opciones)
+        while True:
+            conn.send(("pido", None, None))
+            bloque = conn.recv()
+            if bloque is None:
+                if _TRAZA:
+                    conn.send(("traza", None, _TRAZA.a_dict()["spans"]))
+                return
+            for idx in bloque:
+                conn.send(("permiso", idx, None))
+                conn.recv()
+                conn.send(("ok", idx, list(sesion.filas(plan[idx]))))
+    except Exception as e:
+        try: conn.send(("error", None, repr(e)))
+        except Exception: pass
+        sys.exit(1)
+    finally:
+        if sesion is not None:
+            sesion.cerrar()
+        elif driver is not None:
+            try: driver.quit()
+            except Exception: pass
+
+def ejecutar_pool(url, consultas, workers, max_concurrentes=None, tam_bloque=8,
+                  max_reintentos=2, perfil=None, trazar=False, **opciones):
+    """
+    Reparte las consultas entre `workers` procesos con su propio navegador headless.
+    Los workers libres piden el siguiente bloque (así los rápidos le quitan trabajo a
+    los lentos). Si un worker muere, lo que le faltaba de su bloque vuelve a la cola y
+    se lanza un reemplazo. `max_concurrentes` limita las consultas simultáneas al
+    servidor; los permisos los reparte el padre, así un worker caído no se queda con
+    uno. `perfil` son kwargs extra de build_driver (p.ej. rapido=True). Generador:
+    entrega (consulta, rows) en el orden del plan, como ejecutar_lote; rows es None
+    si la consulta falló más de `max_reintentos` veces. Con `trazar`, los spans de
+    cada worker se anexan a la traza activa del padre.
+    """
+    plan = planificar_consultas(consultas)
+    pendientes = deque(_partir_bloques(plan, tam_bloque))
+    ctx = mp.get_context("spawn")
+    tope = max_concurrentes or workers
+    procesos, asignado = {}, {}          # wid -> (Process, Connection) / índices por terminar
+    activos, en_espera = set(), deque()  # permisos de concurrencia
+    intentos = Counter()
+    listos, siguiente = {}, 0
+    wid_nuevo = 0
+    caidas_seguidas = 0  # workers caídos sin ninguna consulta terminada entre medio
+
+    def lanzar():
+        nonlocal wid_nuevo
+        if caidas_seguidas > workers * (max_reintentos + 1):
+            return False
+        wid, wid_nuevo = wid_nuevo, wid_nuevo + 1
+        conn, conn_hijo = ctx.Pipe()
+        p = ctx.Process(target=_worker_pool, args=(wid, url, plan, opciones, perfil or {}, conn_hijo, trazar),
+                        daemon=True)
+        p.start()
+        conn_hijo.close()
+        procesos[wid] = (p, conn)
+        return True
+
+    def retirar(wid):
+        # Devuelve a la cola lo que el worker no alcanzó a terminar
+        nonlocal caidas_seguidas
+        p, conn = procesos.pop(wid)
+        p.join(timeout=5)
+        if p.exitcode not in (0, None):
+            caidas_seguidas += 1
+        try:
+            while conn.poll():  # su traza puede haber llegado justo antes de salir
+                tipo, _, dato = conn.recv()
+                if tipo == "traza" and _TRAZA:
+                    _TRAZA.anexar(dato, worker=wid)
+        except (EOFError, OSError):
+            pass
+        conn.close()
+        activos.discard(wid)
+        resto = [i for i in asignado.pop(wid, []) if i >= siguiente and i not in listos]
+        if resto:
+            intentos[resto[0]] += 1  # la que estaba en curso
+            if intentos[resto[0]] > max_reintentos:
+                listos[resto.pop(0)] = None
+            if resto:
+                pendientes.appendleft(resto)
+        if pendientes and len(procesos) < workers:
+            lanzar()
+
+    for _ in range(min(workers, len(pendientes))):
+        lanzar()
+
+    try:
+        while siguiente < len(plan):
+            por_conn = {conn: wid for wid, (_, conn) in procesos.items()}
+            caidos = set()
+            for conn in mp_connection.wait(list(por_conn), timeout=1.0):
+                wid = por_conn[conn]
+                try:
+                    tipo, idx, dato = conn.recv()
+                except (EOFError, OSError):
+                    caidos.add(wid)
+                    continue
+                if tipo == "pido":
+                    bloque = pendientes.popleft() if pendientes else None
+                    asignado[wid] = list(bloque or [])
+                    conn.send(bloque)
+                elif tipo == "permiso":
+                    en_espera.append(wid)
+                elif tipo == "ok":
+                    caidas_seguidas = 0
+                    activos.discard(wid)
+                    if idx in asignado.get(wid, []):
+                        asignado[wid].remove(idx)
+                    if idx >= siguiente and idx not in listos:
+                        listos[idx] = dato
+                elif tipo == "error":
+                    print(f"[Pool] worker {wid} falló: {dato}", file=sys.stderr)
+                elif tipo == "traza" and _TRAZA:
+                    _TRAZA.anexar(dato, worker=wid)
+
+            caidos |= {wid for wid, (p, _) in procesos.items() if not p.is_alive()}
+            for wid in caidos:
+                retirar(wid)
+
+            while en_espera and len(activos) < tope:
+                wid = en_espera.popleft()
+                if wid in procesos:
+                    activos.add(wid)
+                    procesos[wid][1].send("adelante")
+
+            while siguiente in listos:
+                pares = listos.pop(siguiente)
+                if pares is None:
+                    yield plan[siguiente], None
+                else:
+                    yield from pares
+                siguiente += 1
+
+            if not procesos and siguiente < len(plan):
+                # Nadie vivo: relanzar con lo que falte o, agotados los reinicios, dar por fallido
+                faltan = [i for i in range(siguiente, len(plan)) if i not in listos]
+                pendientes.clear()
+                pendientes.append(faltan)
+                if not lanzar():
+                    print("[Pool] demasiados workers caídos; se abandonan las consultas restantes",
+                          file=sys.stderr)
+                    for i in faltan:
+                        listos[i] = None
+
+        # Cierre ordenado: a los que piden más trabajo se les responde None y
+        # entregan su traza antes de salir
+        vivos = {conn: wid for wid, (_, conn) in procesos.items()}
+        limite = time.monotonic() + 5
+        while vivos and time.monotonic() < limite:
+            for conn in mp_connection.wait(list(vivos), timeout=0.5):
+                try:
+                    tipo, _, dato = conn.recv()
+                except (EOFError, OSError):
+                    del vivos[conn]
+                    continue
+                if tipo == "pido":
+                    conn.send(None)
+                elif tipo == "traza" and _TRAZA:
+                    _TRAZA.anexar(dato, worker=vivos[conn])
+    finally:
+        for p, conn in procesos.values():
+            conn.close()
+            if p.is_alive():
+                p.terminate()
+
+# =========================
+# Caché local de resultados (SQLite)
+# =========================
+def _cubre(guardadas, pedidas):
+    """Si filas leídas con `guardadas` (None = grid completo) sirven a quien pide `pedidas` (None = todo)."""
+    if not guardadas:
+        return True
+    return pedidas is not None and set(pedidas) <= set(guardadas)
+
+class CacheResultados:
+    """
+    Filas del grid ya consultadas, en SQLite. Cada consulta (fecha, comparador,
+    tasa, cambio) guarda sus filas por código de moneda. Las fechas dentro de los
+    últimos `dias_recientes` días pueden traer valores provisionales: solo se
+    aceptan si se guardaron hace menos de `ttl_horas`. Lo leído con el barrido
+    seek se guarda con sus `monedas` y solo sirve a quien pide un subconjunto.
+    """
+
+    def __init__(self, ruta, dias_recientes=3, ttl_horas=6, entre_hilos=False):
+        # entre_hilos: la conexión se usa desde varios hilos (el llamador serializa el acceso)
+        self.dias_recientes = dias_recientes
+        self.ttl_horas = ttl_horas
+        self.conn = sqlite3.connect(ruta, check_same_thread=not entre_hilos)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS consultas (
+                fecha TEXT, comparador TEXT, tasa TEXT, cambio TEXT, guardado REAL,
+                PRIMARY KEY (fecha, comparador, tasa, cambio));
+            CREATE TABLE IF NOT EXISTS filas (
+                fecha TEXT, comparador TEXT, tasa TEXT, cambio TEXT, codigo TEXT,
+                orden INTEGER, nombre TEXT, code TEXT, valor TEXT,
+                PRIMARY KEY (fecha, comparador, tasa, cambio, codigo));
+        """)
+        try:  # cachés de antes de guardar las monedas: todo lo guardado era el grid completo
+            self.conn.execute("ALTER TABLE consultas ADD COLUMN monedas TEXT")
+        except sqlite3.OperationalError:
+            pass
+
+    def vigente(self, c, monedas=None):
+        """Si hay filas al día de la consulta con `monedas` (None = el grid completo)."""
+        fila = self.conn.execute(
+            "SELECT guardado, monedas FROM consultas WHERE fecha=? AND comparador=? AND tasa=? AND cambio=?", c
+        ).fetchone()
+        if not fila or not _cubre(fila[1] and json.loads(fila[1]), monedas):
+            return False
+        limite = datetime.now().date() - timedelta(days=self.dias_recientes)
+        if _parse_fecha(c.fecha) > limite:
+            return time.time() - fila[0] < self.ttl_horas * 3600
+        return True
+
+    def leer(self, c, monedas=None):
+        """Filas {'name','code','value'} de la consulta, o None si no está, está vencida o le faltan `monedas`."""
+        if not self.vigente(c, monedas):
+            return None
+        cur = self.conn.execute(
+            "SELECT nombre, code, valor FROM filas WHERE fecha=? AND comparador=? AND tasa=? AND cambio=? "
+            "ORDER BY orden", c
+        )
+        return [{"name": n, "code": k, "value": v} for n, k, v in cur]
+
+    def guardar(self, c, rows, monedas=None):
+        """`monedas`: las únicas que se leyeron (barrido seek); None = el grid completo."""
+        if monedas and self.vigente(c):
+            return  # no se cambia el grid completo vigente por unas pocas monedas
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM filas WHERE fecha=? AND comparador=? AND tasa=? AND cambio=?", c)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO filas VALUES (?,?,?,?,?,?,?,?,?)",
+                # Columnas sin código ni nombre se guardan por su posición, para no pisarse
+                [(*c, (r.get("code") or "").strip().upper() or _norm(r.get("name")) or f"#{i}", i,
+                  r.get("name", ""), r.get("code", ""), r.get("value", ""))
+                 for i, r in enumerate(rows)])
+            self.conn.execute("INSERT OR REPLACE INTO consultas VALUES (?,?,?,?,?,?)",
+                              (*c, time.time(), monedas and json.dumps(sorted(monedas), ensure_ascii=False)))
+
+    def faltantes(self, consultas, monedas=None):
+        return [c for c in consultas if not self.vigente(c, monedas)]
+
+    def close(self):
+        self.conn.close()
+
+# =========================
+# Motor directo: réplica de la consulta del backend (sin UI)
+# =========================
+class ErrorMotorDirecto(RuntimeError):
+    pass
+
+FORMATOS_FECHA = ["%d/%m/%Y", "%Y-%m-%d", "%m/%d/%Y", "%Y%m%d"]
+_RE_MARCA = re.compile(r"\{\{(\w+)((?:\|[^|}]*)*)\}\}")
+# Cabeceras que no se copian: las pone http.client o dependen de la sesión
+_CABECERAS_OMITIDAS = {"host", "content-length", "connection", "accept-encoding", "cookie"}
+
+def _num(v, decimal=None):
+    """Número de una celda ('1.234,56', '1,234.56', 0.5) o None."""
+    d = valor_decimal(v, decimal)
+    return None if d is None else float(d)
+
+_CODIFICACIONES = ("", "json", "url", "url+")
+
+def _codificar(valor, enc):
+    return {"": valor, "json": json.dumps(valor)[1:-1],
+            "url": urllib.parse.quote(valor, safe=""), "url+": urllib.parse.quote_plus(valor)}[enc]
+
+def _marca(campo, *args):
+    args = [a for a in args if a]
+    return "{{" + "|".join([campo] + args) + "}}" if args else "{{%s}}" % campo
+
+def _marcar(texto, c):
+    """
+    Reemplaza en `texto` los valores de la consulta por marcas {{campo|...}}:
+    {{fecha|formato|codificación}} y {{tasa|codificación}} (json, url, url+).
+    """
+    d = _parse_fecha(c.fecha)
+    pares = []
+    for enc in _CODIFICACIONES:
+        pares += [(_codificar(d.strftime(f), enc), _marca("fecha", f, enc)) for f in FORMATOS_FECHA]
+        pares += [(_codificar(getattr(c, k), enc), _marca(k, enc)) for k in ("cambio", "comparador", "tasa")]
+    # Los textos largos primero, para no partir uno que contiene a otro
+    for valor, marca in sorted(pares, key=lambda p: -len(p[0])):
+        if valor:
+            texto = texto.replace(valor, marca)
+    return texto
+
+def _rellenar(texto, c):
+    d = _parse_fecha(c.fecha)
+    def sub(m):
+        campo, args = m.group(1), m.group(2).split("|")[1:]
+        if campo == "fecha":
+            fmt = args[0] if args else "%d/%m/%Y"
+            return _codificar(d.strftime(fmt), args[1] if len(args) > 1 else "")
+        return _codificar(getattr(c, campo), args[0] if args else "")
+    return _RE_MARCA.sub(sub, texto)
+
+def _parsear_cuerpo(texto):
+    try:
+        return json.loads(texto)
+    except ValueError:
+        pass
+    try:
+        return ET.fromstring(texto)
+    except ET.ParseError:
+        raise ErrorMotorDirecto("La respuesta no es JSON ni XML.")
+
+def _tablas(doc, ruta=()):
+    """Listas de registros dentro de la respuesta: (ruta, [dict, ...])."""
+    if isinstance(doc, ET.Element):
+        por_tag = {}
+        for el in doc.iter():
+            hijos = list(el)
+            if hijos and all(len(h) == 0 for h in hijos):
+                por_tag.setdefault(el.tag, []).append(el)
+        for tag, els in por_tag.items():
+            yield ("xml", tag), [{h.tag.split("}")[-1]: (h.text or "").strip() for h in el} for el in els]
+    elif isinstance(doc, dict):
+        for k, v in doc.items():
+            yield from _tablas(v, ruta + (k,))
+    elif isinstance(doc, list) and doc:
+        if all(isinstance(x, dict) for x in doc):
+            yield ruta, doc
+            for k in doc[0]:
+                if isinstance(doc[0][k], (list, dict)):
+                    yield from _tablas([x.get(k) for x in doc if isinstance(x.get(k), (list, dict))],
+                                       ruta + ("*", k))
+        elif all(isinstance(x, list) for x in doc):
+            yield ruta, [{str(i): v for i, v in enumerate(x)} for x in doc]
+            if all(all(isinstance(y, dict) for y in x) for x in doc):
+                yield from _tablas([y for x in doc for y in x], ruta + ("*",))
+
+def _registros(doc, ruta):
+    for r, regs in _tablas(doc):
+        if list(r) == list(ruta):
+            return regs
+    return []
+
+def _decimales(s):
+    # Cifras tras la coma decimal de una celda del grid
+    s = str(s).strip()
+    m = re.search(re.escape(DECIMAL_GRID) + r"(\d+)$", s)
+    return len(m.group(1)) if m else 0
+
+def _emparejar(doc, rows):
+    """
+    Busca en la respuesta la tabla y las claves que reproducen las filas leídas
+    del grid. Devuelve (extractor, filas_coincidentes) o (None, 0).
+    """
+    esperado = {}
+    for r in rows:
+        v = _num(r.get("value"), DECIMAL_GRID)
+        if r.get("name") and v is not None:
+            esperado[_norm(r["name"])] = (v, 0.5 * 10 ** -_decimales(r["value"]) + 1e-12)
+    codigos = {(r.get("code") or "").strip().upper() for r in rows} - {""}
+    mejor, mejor_n = None, 0
+    for ruta, regs in _tablas(doc):
+        claves = set().union(*(reg.keys() for reg in regs[:50]))
+        k_name = max(claves, key=lambda k: sum(_norm(str(reg.get(k))) in esperado for reg in regs),
+                     default=None)
+        if k_name is None:
+            continue
+        con_nombre = [reg for reg in regs if _norm(str(reg.get(k_name))) in esperado]
+        def aciertos(k):
+            n = 0
+            for reg in con_nombre:
+                v, tol = esperado[_norm(str(reg[k_name]))]
+                x = _num(reg.get(k))
+                n += x is not None and abs(x - v) <= tol
+            return n
+        resto = claves - {k_name}
+        k_val = max(resto, key=aciertos, default=None)
+        n = aciertos(k_val) if k_val is not None else 0
+        if n > mejor_n:
+            k_code = max(resto - {k_val}, default=None,
+                         key=lambda k: sum(str(reg.get(k) or "").strip().upper() in codigos for reg in regs))
+            if k_code is not None and not any(str(reg.get(k_code) or "").strip().upper() in codigos
+                                              for reg in regs):
+                k_code = None
+            mejor = {"ruta": list(ruta), "name": k_name, "code": k_code, "value": k_val}
+            mejor_n = n
+    if mejor_n < max(1, len(esperado) // 2):
+        return None, 0
+    return mejor, mejor_n
+
+def filas_desde_respuesta(texto, extractor):
+    """Filas {'name','code','value'} (como las del barrido) a partir de la respuesta del backend."""
+    doc = _parsear_cuerpo(texto)
+    out = []
+    for reg in _registros(doc, extractor["ruta"]):
+        name = str(reg.get(extractor["name"]) or "").strip()
+        code = str(reg.get(extractor["code"]) or "").strip() if extractor.get("code") else ""
+        val = reg.get(extractor["value"])
+        if isinstance(val, (int, float)):
+            val = repr(val)
+        val = str(val if val is not None else "").strip()
+        if re.fullmatch(r"-?\d+\.\d+", val):
+            val = val.replace(".", ",")  # mismo formato decimal que muestra el grid
+        if name or val:
+            out.append({"name": name, "code": code, "value": val})
+    return out
+
+def _clave_captura(metodo, ruta, cuerpo):
+    return hashlib.sha1(f"{metodo.upper()} {ruta}\n{cuerpo or ''}".encode("utf-8")).hexdigest()
+
+def guardar_captura(directorio, metodo, url, cuerpo, status, content_type, texto):
+    """Guarda una respuesta para servirla después sin red (ver servir_capturas)."""
+    os.makedirs(directorio, exist_ok=True)
+    partes = urllib.parse.urlsplit(url)
+    ruta = partes.path + (("?" + partes.query) if partes.query else "")
+    nombre = os.path.join(directorio, _clave_captura(metodo, ruta, cuerpo) + ".json")
+    with open(nombre, "w", encoding="utf-8") as f:
+        json.dump({"metodo": metodo, "ruta": ruta, "status": status,
+                   "content_type": content_type, "cuerpo": texto}, f, ensure_ascii=False)
+    return nombre
+
+def descubrir_consulta_directa(driver, consulta, rows, ruta_plantilla, dir_capturas=None):
+    """
+    Busca en el log de performance (requiere build_driver(capturar_red=True)) la
+    petición XHR cuya respuesta reproduce las filas recién leídas del grid, y la
+    guarda como plantilla con los valores de la consulta reemplazados por marcas.
+    """
+    pedidos, respuestas = {}, []
+    for e in driver.get_log("performance"):
+        ev = json.loads(e["message"])["message"]
+        p = ev.get("params", {})
+        if ev.get("method") == "Network.requestWillBeSent":
+            pedidos[p["requestId"]] = p["request"]
+        elif ev.get("method") == "Network.responseReceived" and p.get("type") in ("XHR", "Fetch"):
+            respuestas.append(p)
+
+    mejor = None
+    for resp in respuestas:
+        rid = resp["requestId"]
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": rid})
+            texto = body["body"]
+            if body.get("base64Encoded"):
+                texto = base64.b64decode(texto).decode("utf-8")
+            extractor, n = _emparejar(_parsear_cuerpo(texto), rows)
+        except Exception:
+            continue
+        if extractor and (mejor is None or n > mejor[0]):
+            mejor = (n, rid, extractor, texto, resp["response"])
+    if not mejor or mejor[1] not in pedidos:
+        raise ErrorMotorDirecto("No encontré ninguna respuesta XHR con los datos del grid.")
+
+    n, rid, extractor, texto, meta = mejor
+    req = pedidos[rid]
+    cuerpo = req.get("postData")
+    if cuerpo is None and req.get("hasPostData"):
+        cuerpo = driver.execute_cdp_cmd("Network.getRequestPostData", {"requestId": rid}).get("postData")
+    cookies = driver.execute_cdp_cmd("Network.getCookies", {"urls": [req["url"]]}).get("cookies", [])
+    plantilla = {
+        "url": _marcar(req["url"], consulta),
+        "metodo": req.get("method", "GET"),
+        "cabeceras": {k: v for k, v in req.get("headers", {}).items()
+                      if k.lower() not in _CABECERAS_OMITIDAS and not k.startswith(":")},
+        "cuerpo": _marcar(cuerpo or "", consulta),
+        "cookies": {c["name"]: c["value"] for c in cookies},
+        "extractor": extractor,
+        "descubierta": dict(consulta._asdict(), filas=n),
+    }
+    with open(ruta_plantilla, "w", encoding="utf-8") as f:
+        json.dump(plantilla, f, ensure_ascii=False, indent=2)
+    if dir_capturas:
+        guardar_captura(dir_capturas, plantilla["metodo"], req["url"], cuerpo,
+                        meta.get("status", 200), meta.get("mimeType", ""), texto)
+    return plantilla
+
+class MotorDirecto:
+    """
+    Repite la consulta del backend descubierta con descubrir_consulta_directa sobre
+    conexiones HTTP keep-alive reutilizadas. `base` cambia esquema/host/puerto (p.ej.
+    el servidor local de servir_capturas); `grabar_en` guarda cada respuesta obtenida.
+    """
+
+    def __init__(self, ruta_plantilla, base=None, grabar_en=None, timeout=30):
+        with open(ruta_plantilla, encoding="utf-8") as f:
+            self.plantilla = json.load(f)
+        self.base = urllib.parse.urlsplit(base) if base else None
+        self.grabar_en = grabar_en
+        self.timeout = timeout
+        self._conns = {}
+
+    def _conexion(self, esquema, host):
+        conn = self._conns.get((esquema, host))
+        if conn is None:
+            cls = http.client.HTTPSConnection if esquema == "https" else http.client.HTTPConnection
+            conn = self._conns[(esquema, host)] = cls(host, timeout=self.timeout)
+        return conn
+
+    def _pedir(self, esquema, host, metodo, ruta, cuerpo, cabeceras):
+        for intento in (1, 2):
+            conn = self._conexion(esquema, host)
+            try:
+                conn.request(metodo, ruta, body=cuerpo.encode("utf-8") if cuerpo else None,
+                             headers=cabeceras)
+                resp = conn.getresponse()
+                datos = resp.read()
+            except (http.client.HTTPException, OSError):
+                # El servidor cerró la conexión keep-alive: abrir otra una vez
+                conn.close()
+                del self._conns[(esquema, host)]
+                if intento == 2:
+                    raise
+                continue
+            if resp.getheader("Content-Encoding", "").lower() == "gzip":
+                datos = gzip.decompress(datos)
+            return resp.status, resp.getheader("Content-Type", ""), datos.decode("utf-8", "replace")
+
+    def consultar(self, c):
+        pl = self.plantilla
+        url = urllib.parse.urlsplit(_rellenar(pl["url"], c))
+        esquema, host = (self.base.scheme, self.base.netloc) if self.base else (url.scheme, url.netloc)
+        ruta = url.path + (("?" + url.query) if url.query else "")
+        cuerpo = _rellenar(pl["cuerpo"], c) if pl.get("cuerpo") else None
+        cabeceras = dict(pl.get("cabeceras", {}), **{"Accept-Encoding": "gzip"})
+        if pl.get("cookies"):
+            cabeceras["Cookie"] = "; ".join(f"{k}={v}" for k, v in pl["cookies"].items())
+        try:
+            status, ctype, texto = self._pedir(esquema, host, pl.get("metodo", "GET"), ruta, cuerpo, cabeceras)
+        except (http.client.HTTPException, OSError) as e:
+            raise ErrorMotorDirecto(f"Fallo de red: {e!r}")
+        if status != 200:
+            raise ErrorMotorDirecto(f"HTTP {status}")
+        if self.grabar_en:
+            guardar_captura(self.grabar_en, pl.get("metodo", "GET"), ruta, cuerpo, status, ctype, texto)
+        rows = filas_desde_respuesta(texto, pl["extractor"])
+        if not rows:
+            raise ErrorMotorDirecto("La respuesta no trae filas (¿sesión vencida?).")
+        return rows
+
+    def actualizar_cookies(self, driver):
+        """Toma las cookies vigentes del navegador (tras un fallback por sesión vencida)."""
+        url = _rellenar(self.plantilla["url"], Consulta(**{k: v for k, v in
+                        self.plantilla["descubierta"].items() if k in Consulta._fields}))
+        cookies = driver.execute_cdp_cmd("Network.getCookies", {"urls": [url]}).get("cookies", [])
+        if cookies:
+            self.plantilla["cookies"] = {c["name"]: c["value"] for c in cookies}
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+def servir_capturas(directorio, puerto=8765, host="127.0.0.1"):
+    """
+    Servidor HTTP local que responde con las capturas de guardar_captura, buscadas
+    por método + ruta + cuerpo. Para probar el motor directo sin red:
+    MotorDirecto(plantilla, base=f"http://{host}:{puerto}").
+    """
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como el backend real
+
+        def _responder(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            cuerpo = self.rfile.read(n).decode("utf-8") if n else ""
+            archivo = os.path.join(directorio, _clave_captura(self.command, self.path, cuerpo) + ".json")
+            if not os.path.exists(archivo):
+                self.send_error(404, "Captura no encontrada")
+                return
+            with open(archivo, encoding="utf-8") as f:
+                cap = json.load(f)
+            datos = cap["cuerpo"].encode("utf-8")
+            self.send_response(cap.get("status", 200))
+            self.send_header("Content-Type", cap.get("content_type") or "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        do_GET = do_POST = _responder
+
+        def log_message(self, *a):
+            pass
+
+    return ThreadingHTTPServer((host, puerto), Manejador)
+
+# =========================
+# Salidas estructuradas (JSONL / CSV / Parquet), solo-anexar
+# =========================
+CAMPOS_SALIDA = ["fecha", "codigo", "moneda", "tasa", "cambio", "valor", "texto", "origen"]
+
+def registros(c, resultados, origen=""):
+    """
+    Un registro tipado por moneda: fecha ISO, código, tipo de tasa/cambio y valor
+    numérico (None si la celda vino vacía o con error; el texto original va aparte).
+    """
+    try:
+        fecha = _parse_fecha(c.fecha).isoformat()
+    except ValueError:
+        fecha = c.fecha
+    for r in resultados:
+        valor = r["valor"]
+        yield {"fecha": fecha, "codigo": r["codigo"], "moneda": r["moneda"], "tasa": c.tasa,
+               "cambio": c.cambio, "valor": None if valor is None else float(valor),
+               "texto": r["venta"] or "", "origen": origen}
+
+class SalidaJSONL:
+    def __init__(self, ruta):
+        self.f = open(ruta, "a", encoding="utf-8")
+
+    def escribir(self, regs):
+        for r in regs:
+            self.f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        self.f.flush()  # visible para quien hace tail del archivo
+
+    def close(self):
+        self.f.close()
+
+class SalidaCSV:
+    def __init__(self, ruta):
+        nuevo = not os.path.exists(ruta) or os.path.getsize(ruta) == 0
+        self.f = open(ruta, "a", encoding="utf-8", newline="")
+        self.w = csv.DictWriter(self.f, fieldnames=CAMPOS_SALIDA)
+        if nuevo:
+            self.w.writeheader()
+
+    def escribir(self, regs):
+        self.w.writerows(regs)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class SalidaParquet:
+    """
+    Dataset Parquet: `ruta` es un directorio y cada ejecución agrega un archivo
+    part-*.parquet (Parquet no admite anexar a un archivo cerrado). Los registros
+    se juntan en grupos de filas de hasta `filas_por_grupo` para acotar la memoria.
+    """
+
+    def __init__(self, ruta, filas_por_grupo=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("La salida Parquet requiere pyarrow (pip install pyarrow).")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("fecha", pa.date32()), ("codigo", pa.string()), ("moneda", pa.string()),
+            ("tasa", pa.string()), ("cambio", pa.string()), ("valor", pa.float64()),
+            ("texto", pa.string()), ("origen", pa.string()),
+        ])
+        os.makedirs(ruta, exist_ok=True)
+        nombre = f"part-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.parquet"
+        self.writer = pq.ParquetWriter(os.path.join(ruta, nombre), self.schema)
+        self.filas_por_grupo = filas_por_grupo
+        self.buffer = []
+
+    def escribir(self, regs):
+        for r in regs:
+            try:
+                fecha = datetime.fromisoformat(r["fecha"]).date()
+            except ValueError:
+                fecha = None
+            self.buffer.append(dict(r, fecha=fecha))
+        if len(self.buffer) >= self.filas_por_grupo:
+            self._volcar()
+
+    def _volcar(self):
+        if self.buffer:
+            self.writer.write_table(self.pa.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._volcar()
+        self.writer.close()
+
+SALIDAS = {"jsonl": SalidaJSONL, "csv": SalidaCSV, "parquet": SalidaParquet}
+
+def abrir_salida(ruta, formato=None):
+    """Salida según `formato` o la extensión de `ruta` (.jsonl/.ndjson, .csv, .parquet)."""
+    if not formato:
+        ext = os.path.splitext(ruta)[1].lower().lstrip(".")
+        formato = {"ndjson": "jsonl", "json": "jsonl"}.get(ext, ext)
+    if formato not in SALIDAS:
+        raise ValueError(f"Formato de salida desconocido: {formato!r} (jsonl, csv o parquet)")
+    return SALIDAS[formato](ruta)
+
+# =========================
+# Dashboard simulado (pruebas y benchmarks sin red)
+# =========================
+# Reproduce los contratos del DOM que usa este script: tiles de filtro
+# dashboardfilterviz_box_*, shuttle biShuttleAvailableValuesItem, combo oj-select
+# con su listbox (para __selectFromFilter), iframes anidados y un oj-data-grid
+# virtualizado. Parámetros por query string de la página: columnas, filas (máx. de
+# filas con 'Iniciar en'), latencia (ms de render tras scroll o datos nuevos),
+# latencia_datos (ms del backend), carga (ms hasta mostrar los filtros), cookies=1.
+_MONEDAS_SIMULADO = [
+    ("Corona sueca", "SEK"), ("Dólar canadiense", "CAD"), ("Dólar australiano", "AUD"),
+    ("Euro", "EUR"), ("Franco suizo", "CHF"), ("Peso chileno", "CLP"),
+    ("Libra esterlina", "GBP"), ("Real brasileño", "BRL"), ("Yen japonés", "JPY"),
+    ("Peso mexicano", "MXN"), ("Sol peruano", "PEN"), ("Peso argentino", "ARS"),
+    ("Yuan chino", "CNY"), ("Won surcoreano", "KRW"), ("Rupia india", "INR"),
+    ("Corona noruega", "NOK"), ("Corona danesa", "DKK"), ("Zloty polaco", "PLN"),
+    ("Rand sudafricano", "ZAR"), ("Dólar neozelandés", "NZD"), ("Dólar de Singapur", "SGD"),
+    ("Dólar de Hong Kong", "HKD"), ("Lira turca", "TRY"), ("Shekel israelí", "ILS"),
+    ("Peso uruguayo", "UYU"), ("Guaraní paraguayo", "PYG"), ("Boliviano", "BOB"),
+    ("Colón costarricense", "CRC"), ("Quetzal guatemalteco", "GTQ"), ("Peso dominicano", "DOP"),
+]
+CAMBIOS_SIMULADO = ["Dólares estadounidenses por cada moneda", "Monedas por cada dólar estadounidense"]
+TASAS_SIMULADO = ["VENTA", "COMPRA", "PROMEDIO"]
+
+def _valor_simulado(codigo, fecha, tasa, cambio):
+    # Determinístico por (moneda, fecha, tasa, cambio), con separadores colombianos
+    h = int(hashlib.md5(f"{codigo}|{fecha}|{tasa}".encode("utf-8")).hexdigest()[:8], 16)
+    v = 0.01 + (h % 500000) / 1000.0
+    if cambio != CAMBIOS_SIMULADO[0]:
+        v = 1 / v
+    return f"{v:,.{4 if v >= 1 else 6}f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+def datos_simulados(fecha, comparador, tasa, cambio, columnas=150, filas=30):
+    """Lo que devuelve el backend simulado: {'columnas': [{name, code}], 'filas': [{fecha, valores}]}."""
+    monedas = _MONEDAS_SIMULADO[:columnas] + [
+        (f"Moneda {i:03d}", f"X{i:02d}") for i in range(len(_MONEDAS_SIMULADO), columnas)]
+    # Orden estable pero mezclado: las monedas buscadas quedan repartidas a lo ancho
+    monedas.sort(key=lambda m: hashlib.md5(m[1].encode("utf-8")).hexdigest())
+    try:
+        d = _parse_fecha(fecha)
+    except ValueError:
+        return {"columnas": [{"name": n, "code": c} for n, c in monedas], "filas": []}
+    if comparador == COMPARADOR_DESDE:
+        fechas = [(d + timedelta(days=i)).strftime("%d/%m/%Y") for i in range(filas)
+                  if d + timedelta(days=i) <= datetime.now().date()]
+    else:
+        fechas = [fecha]
+    return {"columnas": [{"name": n, "code": c} for n, c in monedas],
+            "filas": [{"fecha": f, "valores": [_valor_simulado(c, f, tasa, cambio) for _, c in monedas]}
+                      for f in fechas]}
+
+HTML_SIMULADO_DASHBOARD = r"""<!doctype html>
+<html><head><meta charset="utf-8"><title>Dashboard simulado</title>
+<style>
+body{font-family:sans-serif;margin:0}
+.tiles{display:flex;gap:8px;padding:8px}
+.bi_dashboardfilterviz_tile_wrapper{border:1px solid #888;padding:6px 10px;cursor:pointer}
+.oj-popup{position:absolute;top:48px;left:8px;background:#fff;border:1px solid #444;padding:8px;z-index:10;min-width:320px}
+.biShuttleAvailableValuesItem{padding:2px 4px;cursor:pointer}
+#oj-listbox-drop-tiporango{position:absolute;top:90px;left:8px;background:#fff;border:1px solid #444;z-index:20}
+#banner-cookies{position:absolute;bottom:0;left:0;right:0;background:#eee;padding:8px;z-index:30}
+iframe{border:0;width:1000px;height:420px;display:block}
+</style></head>
+<body>
+<oracle-dv id="dv"><div class="tiles" id="tiles"></div></oracle-dv>
+<div id="popups"></div>
+<div id="oj-listbox-drop-tiporango"><ul class="oj-listbox-results" style="display:none"></ul></div>
+<iframe id="marco" src="/marco.html?__QS__"></iframe>
+<script>
+const P = new URLSearchParams(location.search);
+const TASAS = __TASAS__, CAMBIOS = __CAMBIOS__;
+const COMPARADORES = ['Igual que', 'Iniciar en', 'Antes de', 'Después de'];
+const hoy = new Date(), dd = n => String(n).padStart(2, '0');
+window.__simulado = {fecha: dd(hoy.getDate()) + '/' + dd(hoy.getMonth() + 1) + '/' + hoy.getFullYear(),
+                     comparador: 'Igual que', tasa: '', cambio: CAMBIOS[0], version: 0};
+function aplicar(cambios){
+  Object.assign(window.__simulado, cambios);
+  window.__simulado.version++;
+  window.dispatchEvent(new Event('simulado-filtros'));
+}
+function esc(s){ return String(s).replace(/[&<>"']/g, c => '&#' + c.charCodeAt(0) + ';'); }
+function cerrarPopups(){
+  for (const p of document.querySelectorAll('.oj-popup')) p.style.display = 'none';
+  document.querySelector('#oj-listbox-drop-tiporango ul').style.display = 'none';
+}
+function shuttle(id, opciones){
+  const items = opciones.map(o => '<div class="biShuttleAvailableValuesItem" data-bi-shuttle-display-value="' +
+                                  esc(o) + '">' + esc(o) + '</div>').join('');
+  return '<div class="oj-popup" id="popup_' + id + '" style="display:none"><div class="biShuttle">' +
+         '<div class="biShuttleAvailableValues">' + items + '</div>' +
+         '<div class="biShuttleSelections oj-panel"><span>Selecciones</span><div class="sel"></div></div>' +
+         '<button class="oj-button"><span>Agregar</span></button></div></div>';
+}
+function montarFiltros(){
+  const tiles = [['0', 'Fecha'], ['1', 'Periodicidad'], ['2', 'Tipo de Tasa'], ['3', 'Tipo de Cambio']];
+  document.getElementById('tiles').innerHTML = tiles.map(([i, t]) =>
+    '<div id="dashboardfilterviz_box_' + i + '"><div class="bi_dashboardfilterviz_tile_wrapper">' + t + '</div></div>').join('');
+  document.getElementById('popups').innerHTML =
+    '<div class="oj-popup" id="popup_0" style="display:none">' +
+      '<div role="combobox" aria-label="Tipo de Rango" class="oj-select" id="oj-select-choice-tiporango">' +
+        '<span class="oj-select-chosen" id="tiporango_selected">Igual que</span><a class="oj-select-arrow">&#9662;</a></div>' +
+      '<input class="oj-inputdatetime-input" type="text"></div>' +
+    '<div class="oj-popup" id="popup_1" style="display:none">Diaria</div>' +
+    shuttle('2', TASAS) + shuttle('3', CAMBIOS);
+  document.querySelector('#oj-listbox-drop-tiporango ul').innerHTML =
+    COMPARADORES.map(c => '<li class="oj-listbox-result"><div class="oj-listbox-result-label">' + esc(c) + '</div></li>').join('');
+
+  for (const [i] of tiles) {
+    document.querySelector('#dashboardfilterviz_box_' + i + ' .bi_dashboardfilterviz_tile_wrapper')
+      .addEventListener('click', () => { cerrarPopups(); document.getElementById('popup_' + i).style.display = 'block'; });
+  }
+  // Combo 'Tipo de Rango' y su listbox
+  const ul = document.querySelector('#oj-listbox-drop-tiporango ul');
+  document.getElementById('oj-select-choice-tiporango')
+    .addEventListener('click', () => { ul.style.display = 'block'; });
+  ul.addEventListener('click', e => {
+    const li = e.target.closest('li');
+    if (!li) return;
+    const txt = li.textContent.trim();
+    document.getElementById('tiporango_selected').textContent = txt;
+    ul.style.display = 'none';
+    if (txt !== window.__simulado.comparador) aplicar({comparador: txt});
+  });
+  const input = document.querySelector('#popup_0 input');
+  const fijarFecha = () => {
+    if (/^\d{2}\/\d{2}\/\d{4}$/.test(input.value) && input.value !== window.__simulado.fecha) aplicar({fecha: input.value});
+  };
+  input.addEventListener('change', fijarFecha);
+  input.addEventListener('keydown', e => { if (e.key === 'Enter') fijarFecha(); });
+  // Shuttles: un click en una opción la pasa a Selecciones y aplica el filtro
+  for (const [id, campo] of [['2', 'tasa'], ['3', 'cambio']]) {
+    const pop = document.getElementById('popup_' + id);
+    pop.addEventListener('click', e => {
+      const it = e.target.closest('.biShuttleAvailableValuesItem');
+      if (!it) return;
+      const v = it.getAttribute('data-bi-shuttle-display-value');
+      const sel = pop.querySelector('.sel');
+      if (campo === 'cambio') sel.innerHTML = '';
+      sel.insertAdjacentHTML('beforeend', '<div>' + esc(v) + '</div>');
+      aplicar({[campo]: v});
+    });
+  }
+  document.getElementById('dv').classList.add('oj-complete');
+}
+setTimeout(montarFiltros, +(P.get('carga') || 0));
+if (P.get('cookies') === '1') {
+  document.body.insertAdjacentHTML('beforeend',
+    '<div id="banner-cookies">Usamos cookies. <button>Aceptar</button></div>');
+  document.querySelector('#banner-cookies button').addEventListener('click', () => {
+    document.getElementById('banner-cookies').remove();
+  });
+}
+</script></body></html>
+"""
+
+HTML_SIMULADO_MARCO = r"""<!doctype html>
+<html><head><meta charset="utf-8"><style>body{margin:0}iframe{border:0;width:980px;height:400px;display:block}</style></head>
+<body><iframe src="/grid.html?__QS__"></iframe></body></html>
+"""
+
+HTML_SIMULADO_GRID = r"""<!doctype html>
+<html><head><meta charset="utf-8"><style>
+body{margin:0;font-family:sans-serif;font-size:12px}
+oj-data-grid{display:block;position:relative;width:960px;height:380px}
+.oj-datagrid-column-header{position:absolute;left:90px;top:0;right:0;height:48px;overflow:hidden}
+.oj-datagrid-header-grouping{position:absolute;left:0;height:24px}
+.oj-datagrid-header-grouping[data-oj-level="1"]{top:24px}
+.oj-datagrid-row-header{position:absolute;left:0;top:48px;width:90px;bottom:0;overflow:hidden}
+.oj-datagrid-databody{position:absolute;left:90px;top:48px;right:0;bottom:0;overflow:auto}
+.oj-datagrid-header-cell,.oj-datagrid-cell{position:absolute;width:110px;height:26px;overflow:hidden;white-space:nowrap}
+.lienzo{position:relative}
+.viz-menu{position:absolute;right:4px;top:388px}
+.menu{position:absolute;right:4px;top:410px;margin:0;padding:2px;list-style:none;background:#eee}
+.menu li{padding:3px 12px;cursor:pointer}
+</style></head>
+<body>
+<button class="viz-menu" aria-label="Más opciones" title="Más opciones">&#8942;</button>
+<ul class="menu" role="menu" hidden></ul>
+<oj-data-grid id="grid1">
+  <div class="oj-datagrid-column-header"><div class="cabeza">
+    <div class="oj-datagrid-header-grouping" data-oj-level="0"></div>
+    <div class="oj-datagrid-header-grouping" data-oj-level="1"></div>
+  </div></div>
+  <div class="oj-datagrid-row-header"><div class="cabeza-filas"></div></div>
+  <div id="grid1OJDataGrid:databody" class="oj-datagrid-databody"><div class="lienzo"></div></div>
+</oj-data-grid>
+<script>
+const P = new URLSearchParams(location.search);
+const ANCHO = 110, ALTO = 26, MARGEN = 1;
+const LATENCIA = +(P.get('latencia') || 0);
+const db = document.getElementById('grid1OJDataGrid:databody');
+const lienzo = db.querySelector('.lienzo');
+const h0 = document.querySelector('[data-oj-level="0"]'), h1 = document.querySelector('[data-oj-level="1"]');
+const cabeza = document.querySelector('.cabeza'), cabezaFilas = document.querySelector('.cabeza-filas');
+let datos = {columnas: [], filas: []}, pedido = 0, pendiente = null;
+
+function esc(s){ return String(s).replace(/[&<>"']/g, c => '&#' + c.charCodeAt(0) + ';'); }
+function celda(cls, left, top, txt){
+  return '<div class="' + cls + '" style="left:' + left + 'px;top:' + top + 'px">' + txt + '</div>';
+}
+// Solo se pintan las columnas y filas visibles (más un margen), como el grid real
+function pintar(){
+  const c0 = Math.max(0, Math.floor(db.scrollLeft / ANCHO) - MARGEN);
+  const c1 = Math.min(datos.columnas.length, Math.ceil((db.scrollLeft + db.clientWidth) / ANCHO) + MARGEN);
+  const f0 = Math.max(0, Math.floor(db.scrollTop / ALTO) - MARGEN);
+  const f1 = Math.min(datos.filas.length, Math.ceil((db.scrollTop + db.clientHeight) / ALTO) + MARGEN);
+  let a = '', b = '', rh = '', cs = '';
+  for (let j = c0; j < c1; j++) {
+    a += celda('oj-datagrid-header-cell', j * ANCHO, 0, esc(datos.columnas[j].name));
+    b += celda('oj-datagrid-header-cell', j * ANCHO, 0, esc(datos.columnas[j].code));
+  }
+  for (let i = f0; i < f1; i++) {
+    rh += celda('oj-datagrid-header-cell', 0, i * ALTO, esc(datos.filas[i].fecha));
+    for (let j = c0; j < c1; j++) cs += celda('oj-datagrid-cell', j * ANCHO, i * ALTO, '<span>' + esc(datos.filas[i].valores[j]) + '</span>');
+  }
+  h0.innerHTML = a; h1.innerHTML = b; cabezaFilas.innerHTML = rh; lienzo.innerHTML = cs;
+}
+function programar(){
+  clearTimeout(pendiente);
+  if (LATENCIA > 0) pendiente = setTimeout(pintar, LATENCIA); else pintar();
+}
+function cargar(){
+  const e = top.__simulado, n = ++pedido;
+  if (!e) { setTimeout(cargar, 50); return; }
+  const q = new URLSearchParams({fecha: e.fecha, comparador: e.comparador, tasa: e.tasa, cambio: e.cambio,
+                                 columnas: P.get('columnas') || 150, filas: P.get('filas') || 30,
+                                 latencia_datos: P.get('latencia_datos') || 0});
+  fetch('/datos?' + q).then(r => r.json()).then(d => {
+    if (n !== pedido) return;
+    datos = d;
+    lienzo.style.width = (d.columnas.length * ANCHO) + 'px';
+    lienzo.style.height = (Math.max(1, d.filas.length) * ALTO) + 'px';
+    programar();
+  });
+}
+db.addEventListener('scroll', () => {
+  cabeza.style.transform = 'translateX(' + (-db.scrollLeft) + 'px)';
+  cabezaFilas.style.transform = 'translateY(' + (-db.scrollTop) + 'px)';
+  programar();
+});
+top.addEventListener('simulado-filtros', cargar);
+cargar();
+// Menú de la visualización: Exportar -> Datos (csv) / Excel (xlsx), descarga desde /exportar
+const menu = document.querySelector('.menu');
+function opciones(items){
+  menu.innerHTML = items.map(([t, a]) => '<li role="menuitem" data-a="' + a + '">' + esc(t) + '</li>').join('');
+  menu.hidden = false;
+}
+document.querySelector('.viz-menu').addEventListener('click', () => opciones([['Exportar', 'sub'], ['Ordenar', '']]));
+menu.addEventListener('click', ev => {
+  const a = ev.target.dataset.a;
+  if (a === 'sub') { opciones([['Datos (csv)', 'csv'], ['Excel (xlsx)', 'xlsx']]); return; }
+  menu.hidden = true;
+  if (!a) return;
+  const e = top.__simulado;
+  const q = new URLSearchParams({fecha: e.fecha, comparador: e.comparador, tasa: e.tasa, cambio: e.cambio,
+                                 columnas: P.get('columnas') || 150, filas: P.get('filas') || 30, formato: a});
+  const enlace = document.createElement('a');
+  enlace.href = '/exportar?' + q; enlace.download = 'grid.' + a;
+  document.body.appendChild(enlace); enlace.click(); enlace.remove();
+});
+</script></body></html>
+"""
+
+def exportacion_simulada(d, formato="csv"):
+    """Archivo (bytes) que exportaría el grid simulado: tabla cruzada en CSV o XLSX."""
+    tabla = [[""] + [c["name"] for c in d["columnas"]], [""] + [c["code"] for c in d["columnas"]]]
+    tabla += [[f["fecha"]] + list(f["valores"]) for f in d["filas"]]
+    if formato == "csv":
+        out = io.StringIO()
+        csv.writer(out).writerows(tabla)
+        return out.getvalue().encode("utf-8-sig")
+    def celda(j, i, v):
+        ref = ""
+        j += 1
+        while j:
+            j, r = divmod(j - 1, 26)
+            ref = chr(65 + r) + ref
+        return f'<c r="{ref}{i + 1}" t="inlineStr"><is><t>{html.escape(v)}</t></is></c>'
+    hoja = "".join(f'<row r="{i + 1}">' + "".join(celda(j, i, v) for j, v in enumerate(f)) + "</row>"
+                   for i, f in enumerate(tabla))
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types xmlns="http://schemas.openxmlformats.org/'
+                   'package/2006/content-types"><Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+                   '"application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>')
+        z.writestr("xl/worksheets/sheet1.xml", f'<?xml version="1.0"?><worksheet {ns}><sheetData>{hoja}'
+                   '</sheetData></worksheet>')
+    return buf.getvalue()
+
+def servir_simulado(puerto=8765, host="127.0.0.1"):
+    """
+    Servidor HTTP local con el dashboard simulado: la página en '/', los iframes
+    anidados y el backend '/datos' (JSON). Puerto 0 = uno libre cualquiera.
+    """
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _enviar(self, cuerpo, tipo):
+            datos = cuerpo.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            u = urllib.parse.urlsplit(self.path)
+            q = dict(urllib.parse.parse_qsl(u.query))
+            qs = html.escape(u.query)
+            if u.path in ("/", "/index.html"):
+                pagina = (HTML_SIMULADO_DASHBOARD.replace("__QS__", qs)
+                          .replace("__TASAS__", json.dumps(TASAS_SIMULADO))
+                          .replace("__CAMBIOS__", json.dumps(CAMBIOS_SIMULADO)))
+                self._enviar(pagina, "text/html; charset=utf-8")
+            elif u.path == "/marco.html":
+                self._enviar(HTML_SIMULADO_MARCO.replace("__QS__", qs), "text/html; charset=utf-8")
+            elif u.path == "/grid.html":
+                self._enviar(HTML_SIMULADO_GRID, "text/html; charset=utf-8")
+            elif u.path == "/exportar":
+                d = datos_simulados(q.get("fecha", ""), q.get("comparador", COMPARADOR_IGUAL),
+                                    q.get("tasa", ""), q.get("cambio", ""),
+                                    int(q.get("columnas") or 150), int(q.get("filas") or 30))
+                formato = "xlsx" if q.get("formato") == "xlsx" else "csv"
+                datos = exportacion_simulada(d, formato)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv" if formato == "csv" else
+                                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                self.send_header("Content-Disposition", f'attachment; filename="grid.{formato}"')
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+            elif u.path == "/datos":
+                time.sleep(float(q.get("latencia_datos") or 0) / 1000.0)
+                d = datos_simulados(q.get("fecha", ""), q.get("comparador", COMPARADOR_IGUAL),
+                                    q.get("tasa", ""), q.get("cambio", ""),
+                                    int(q.get("columnas") or 150), int(q.get("filas") or 30))
+                self._enviar(json.dumps(d, ensure_ascii=False), "application/json; charset=utf-8")
+            else:
+                self.send_error(404)
+
+        def log_message(self, *a):
+            pass
+
+    return ThreadingHTTPServer((host, puerto), Manejador)
+
+def _commit_actual():
+    try:
+        r = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return r.stdout.strip() or None
+    except Exception:
+        return None
+
+def benchmark(columnas=(40, 150, 400), latencias=(0, 50, 200), repeticiones=3,
+              barridos=("async", "pasos", "seek", "exportar"),
+              rapido=True, quieto_ms=500, timeout_grid=60, filtros="js"):
+    """
+    Mide el flujo completo (carga, filtros, espera y barrido) contra el dashboard
+    simulado para cada combinación de columnas x latencia de render x barrido.
+    Devuelve un informe con los percentiles por fase (resumen_trazas) y cuántas
+    repeticiones leyeron bien todas las columnas, más el commit para comparar.
+    """
+    global _TRAZA
+    traza_previa = _TRAZA
+    srv = servir_simulado(0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_address[1]}/"
+    consulta = Consulta("20/09/2025", COMPARADOR_IGUAL, TASAS_SIMULADO[0], CAMBIOS_SIMULADO[0])
+    casos = []
+    driver = None
+    try:
+        arranque = iniciar_traza("arranque")
+        driver = build_driver(headless=True, rapido=rapido)
+        for n in columnas:
+            esperado = datos_simulados(consulta.fecha, consulta.comparador, consulta.tasa, consulta.cambio, n)
+            esperado = [{"name": c["name"], "code": c["code"], "value": v}
+                        for c, v in zip(esperado["columnas"], esperado["filas"][0]["valores"])]
+            for lat in latencias:
+                url = base + "?" + urllib.parse.urlencode({"columnas": n, "latencia": lat})
+                for barrido in barridos:
+                    traza = iniciar_traza("caso")
+                    correctas = 0
+                    for _ in range(repeticiones):
+                        try:
+                            with fase("flujo"):
+                                preparar_pagina(driver, url)
+                                with fase("capturar_huella"):
+                                    previa = capturar_huella(driver)
+                                with fase("filtros"):
+                                    aplicar_filtros(driver, consulta, verbose=False, modo=filtros)
+                                rows, _ = leer_grid(driver, previa, barrido, quieto_ms, timeout_grid, TARGETS)
+                            # seek solo trae las buscadas (salvo cuando cae al barrido completo)
+                            leidas = {r["name"] for r in rows}
+                            correctas += all(r in esperado for r in rows) and (
+                                set(TARGETS) <= leidas if barrido == "seek" else len(rows) == len(esperado))
+                        except Exception as e:
+                            print(f"[Bench] {n} columnas, {lat} ms, {barrido}: {e!r}", file=sys.stderr)
+                    casos.append({"columnas": n, "latencia_ms": lat, "barrido": barrido, "filtros": filtros,
+                                  "repeticiones": repeticiones, "correctas": correctas,
+                                  "fases": resumen_trazas(traza.spans)})
+    finally:
+        if driver is not None:
+            driver.quit()
+        srv.shutdown()
+        _TRAZA = traza_previa
+    return {"commit": _commit_actual(), "fecha": datetime.now().isoformat(timespec="seconds"),
+            "rapido": rapido, "arranque": resumen_trazas(arranque.spans), "casos": casos}
+
+def imprimir_benchmark(informe, archivo=sys.stdout):
+    print(f"[Bench] commit {informe['commit'] or '?'}", file=archivo)
+    print(f"{'columnas':>9}{'lat ms':>8}{'barrido':>9}{'flujo p50':>11}{'barrido p50':>13}{'rt p50':>8}{'ok':>6}",
+          file=archivo)
+    for c in informe["casos"]:
+        f = c["fases"]
+        flujo, barrido = f.get("flujo"), f.get("barrido")
+        print(f"{c['columnas']:>9}{c['latencia_ms']:>8}{c['barrido']:>9}"
+              f"{flujo['ms']['p50'] if flujo else float('nan'):>11.0f}"
+              f"{barrido['ms']['p50'] if barrido else float('nan'):>13.0f}"
+              f"{flujo['round_trips']['p50'] if flujo else '-':>8}"
+              f"{c['correctas']:>3}/{c['repeticiones']:<2}", file=archivo)
+
+# =========================
+# Flujo principal
+# =========================
+def _abrir_cache(args):
+    if not args.cache:
+        return None
+    return CacheResultados(args.cache, args.cache_dias_recientes, args.cache_ttl_horas)
+
+def _abrir_motor(args):
+    if not args.directo:
+        return None
+    return MotorDirecto(args.directo, args.directo_base, args.grabar_capturas)
+
+def _reciclar(args):
+    """kwargs de Vigia según la CLI (None = nunca reciclar)."""
+    reciclar = dict(max_consultas=args.reciclar_cada, max_rss_mb=args.reciclar_rss_mb,
+                    factor_latencia=args.reciclar_latencia)
+    return reciclar if any(reciclar.values()) else None
+
+def _objetivos(args):
+    """Monedas pedidas, o None con --todas."""
+    if args.todas:
+        return None
+    return cargar_objetivos(args.objetivos) if args.objetivos else TARGETS
+
+def _leidas(args):
+    """Monedas a las que se limita lo leído en el navegador (barrido seek); None = grid completo."""
+    return _objetivos(args) if args.barrido == "seek" else None
+
+def _extraer(args, rows, indice):
+    objetivos = _objetivos(args)
+    if objetivos is None:
+        return extraer_catalogo(rows, indice)
+    return extraer_objetivo(rows, objetivos, indice)
+
+def _en_rango(fecha, hasta):
+    try:
+        return hasta is None or _parse_fecha(fecha) <= _parse_fecha(hasta)
+    except ValueError:
+        return True
+
+def resultados_lote(args, consultas, hasta=None, cache=None, motor=None):
+    """
+    Generador (consulta, rows, origen): primero lo que está en caché, luego el motor
+    directo y lo que falte por el navegador (una sesión o el pool de --workers).
+    rows es None si la consulta falló. `hasta` descarta las filas posteriores de
+    las consultas 'Iniciar en' (modo --historico). Los días de un 'Iniciar en' sin
+    fila en el grid (fines de semana, feriados) quedan en caché como vacíos.
+    """
+    opciones = dict(barrido=args.barrido, quieto_ms=args.quieto_ms, timeout_grid=args.timeout_grid,
+                    filtros=args.filtros, buscadas=_objetivos(args), reciclar=_reciclar(args))
+    emitidas = set()
+    pedidas = opciones["buscadas"]  # lo que necesita _extraer (None = el grid completo)
+
+    # Lo que ya está en caché sale de inmediato; solo se navega por lo que falta.
+    # Un 'Iniciar en' arranca en el primer día que no está en caché.
+    if cache:
+        faltan = []
+        for c in planificar_consultas(consultas):
+            if c.comparador == COMPARADOR_DESDE:
+                ultimo = hasta or datetime.now().strftime("%d/%m/%Y")
+                dias = [Consulta(f, COMPARADOR_IGUAL, c.tasa, c.cambio) for f in rango_fechas(c.fecha, ultimo)]
+                sin_cache = None
+                for d in dias:
+                    rows = cache.leer(d, pedidas)
+                    if rows is not None:
+                        emitidas.add(d)
+                        if rows:  # [] = día sin valores publicados (ver más abajo)
+                            yield d, rows, "cache"
+                    elif sin_cache is None:
+                        sin_cache = d
+                if sin_cache:
+                    faltan.append(c._replace(fecha=sin_cache.fecha))
+                continue
+            rows = cache.leer(c, pedidas)
+            if rows is None:
+                faltan.append(c)
+            else:
+                emitidas.add(c)
+                yield c, rows, "cache"
+        consultas = faltan
+
+    # Motor directo primero; lo que falle se hace por el navegador
+    if motor:
+        faltan = []
+        for c in planificar_consultas(consultas):
+            if c.comparador == COMPARADOR_DESDE:
+                faltan.append(c)  # la plantilla es de una sola fecha
+                continue
+            try:
+                rows = motor.consultar(c)
+            except ErrorMotorDirecto as e:
+                print(f"[Directo] {c.fecha} {c.tasa}: {e} -> navegador", file=sys.stderr)
+                faltan.append(c)
+                continue
+            if cache:
+                cache.guardar(c, rows)
+            yield c, rows, "directo"
+        consultas = faltan
+    if not consultas:
+        return
+
+    # 'Iniciar en' que van al navegador -> último día que deberían traer
+    hoy = datetime.now().strftime("%d/%m/%Y")
+    desde = {c: hasta or hoy for c in consultas if cache and c.comparador == COMPARADOR_DESDE}
+    vistas = set()
+
+    driver = None
+    if args.workers > 1:
+        flujo = ejecutar_pool(args.url, consultas, args.workers, args.max_concurrentes,
+                              args.bloque, perfil=dict(rapido=args.rapido, dir_perfil=args.perfil,
+                                                       dir_descargas=args.descargas),
+                              trazar=bool(_TRAZA), **opciones)
+    elif args.pestanas > 1:
+        def crear():
+            return build_driver(headless=args.headless, rapido=args.rapido, varias_pestanas=True,
+                                dir_perfil=args.perfil, dir_descargas=args.descargas,
+                                conectar=args.conectar, url=args.url)
+        driver = crear()
+        flujo = ejecutar_pestanas(driver, args.url, consultas, args.pestanas, crear_driver=crear, **opciones)
+    else:
+        def crear():
+            return build_driver(headless=args.headless, rapido=args.rapido, dir_perfil=args.perfil,
+                                dir_descargas=args.descargas, conectar=args.conectar, url=args.url)
+        driver = crear()
+        flujo = ejecutar_lote(driver, args.url, consultas, crear_driver=crear, **opciones)
+    try:
+        for c, rows in flujo:
+            vistas.add(c)
+            if rows is None:
+                desde.pop(c, None)
+            if c in emitidas or not _en_rango(c.fecha, hasta):
+                continue
+            if cache and rows is not None:
+                cache.guardar(c, rows, _leidas(args))
+            yield c, rows, "web"
+        # Los días que el grid no trajo no tienen tasa publicada: vacíos en caché, así
+        # el próximo 'Iniciar en' incremental arranca después y no los vuelve a pedir
+        # (los de los últimos días vencen como cualquier fecha reciente)
+        for c, ultimo in desde.items():
+            for f in rango_fechas(c.fecha, ultimo):
+                d = Consulta(f, COMPARADOR_IGUAL, c.tasa, c.cambio)
+                if d not in vistas and d not in emitidas:
+                    cache.guardar(d, [])
+    finally:
+        flujo.close()  # cierra los navegadores que haya reciclado
+        if driver is not None:
+            try: driver.quit()
+            except Exception: pass
+
+def main_lote(args, consultas, hasta=None):
+    cache = _abrir_cache(args)
+    motor = _abrir_motor(args)
+    indice = IndiceAlias(args.alias)
+    salida = abrir_salida(args.salida, args.formato) if args.salida else None
+    tablas = {}  # (tasa, cambio) -> TablaTasas, solo con --cruzadas
+    try:
+        for c, rows, origen in resultados_lote(args, consultas, hasta, cache, motor):
+            if rows is None:
+                if salida:
+                    print(f"[Lote] {c.fecha} {c.tasa}: consulta fallida tras reintentos", file=sys.stderr)
+                else:
+                    rec = dict(c._asdict(), resultados=None, error="consulta fallida tras reintentos")
+                    print(json.dumps(rec, ensure_ascii=False), flush=True)
+                continue
+            resultados = _extraer(args, rows, indice)
+            if args.cruzadas:
+                tabla = tablas.setdefault((c.tasa, c.cambio), TablaTasas(c.cambio))
+                tabla.agregar(registros(c, resultados, origen))
+            if salida:
+                salida.escribir(registros(c, resultados, origen))
+            else:
+                rec = dict(c._asdict(), resultados=resultados, origen=origen)
+                print(json.dumps(rec, ensure_ascii=False, default=_json_valor), flush=True)
+        if args.cruzadas:
+            n = escribir_cruzadas(tablas, args.cruzadas)
+            print(f"[Cruzadas] {n} tasas cruzadas -> {args.cruzadas}", file=sys.stderr)
+    finally:
+        if motor:
+            motor.close()
+        if cache:
+            cache.close()
+        if salida:
+            salida.close()
+        indice.guardar()
+
+def main(args):
+    consulta = Consulta(args.fecha, args.comparador, args.tasa, args.cambio)
+    cache = _abrir_cache(args)
+    motor = _abrir_motor(args)
+    rows = cache.leer(consulta, _objetivos(args)) if cache else None
+    driver = None
+
+    origen = "web"
+    if rows is not None:
+        origen = "cache"
+        print("[Cache] Consulta respondida desde", args.cache)
+    elif motor:
+        try:
+            rows = motor.consultar(consulta)
+            origen = "directo"
+            print("[Directo] Consulta respondida por el backend sin navegador")
+            if cache:
+                cache.guardar(consulta, rows)
+        except ErrorMotorDirecto as e:
+            print(f"[Directo] {e} -> se usa el navegador")
+
+    if rows is None:
+        driver = build_driver(headless=args.headless, rapido=args.rapido,
+                              capturar_red=bool(args.descubrir), dir_perfil=args.perfil,
+                              dir_descargas=args.descargas, conectar=args.conectar, url=args.url)
+        # Conectado a un Edge abierto: se sigue desde la pestaña del dashboard si la tasa es la misma
+        previa = adoptar_pestana(driver)
+        if previa is None or previa.tasa != consulta.tasa or args.descubrir:
+            previa = None
+            preparar_pagina(driver, args.url)
+
+        # Huella del grid antes de tocar filtros, para saber cuándo se re-consultó
+        with fase("capturar_huella"):
+            huella_previa = capturar_huella(driver) if previa != consulta else None
+
+        if args.descubrir:
+            driver.get_log("performance")  # descartar lo de la carga inicial
+        aplicar_filtros(driver, consulta, previa, modo=args.filtros)
+
+        # Espera fija extra opcional (ya no es necesaria: se detecta el cambio del grid)
+        if args.espera and args.espera > 0:
+            print(f"[Espera] {args.espera:.1f}s para que el grid termine de renderizar…")
+            with fase("espera"):
+                time.sleep(args.espera)
+
+        # 4) Esperar a que el grid cambie de contenido y leer TODO el ancho
+        rows, _ = leer_grid(driver, huella_previa, args.barrido, args.quieto_ms, args.timeout_grid,
+                            _objetivos(args))
+        if cache:
+            cache.guardar(consulta, rows, _leidas(args))
+        if args.descubrir:
+            pl = descubrir_consulta_directa(driver, consulta, rows, args.descubrir, args.grabar_capturas)
+            print(f"[Directo] Plantilla guardada en {args.descubrir}: {pl['metodo']} {pl['url']}")
+        elif motor:
+            motor.actualizar_cookies(driver)
+    if cache:
+        cache.close()
+
+    indice = IndiceAlias(args.alias)
+    resultados = _extraer(args, rows, indice)
+    indice.guardar()
+
+    if args.salida:
+        # No interactivo: registros tipados al archivo y cerrar
+        salida = abrir_salida(args.salida, args.formato)
+        salida.escribir(registros(consulta, resultados, origen))
+        salida.close()
+        print(f"[Salida] {len(resultados)} registros -> {args.salida}")
+        if driver is not None:
+            driver.quit()
+        return
 
     print("\n[DEBUG] Columnas capturadas:", len(rows))
     for r in rows[:12]:
         print(" -", r["name"], "|", r["code"], "|", r["value"])
 
-    resultados = extraer_objetivo(rows, TARGETS)
-
     print("\n=== Venta por moneda (tabla visible o virtualizada) ===")
     for r in resultados:
         cod = f" ({r['codigo']})" if r['codigo'] else ""
-        print(f"{r['moneda']:<22}{cod:<14}  {r['venta']}")
+        print(f"{r['moneda']:<22}{cod:<14}  {r['venta'] or 'sin dato'}")
     print("=======================================================\n")
 
-    input("Listo. Revisa los valores en consola. Presiona ENTER para terminar (Edge queda abierto por 'detach').\n")
+    if driver is None:
+        return
+    if args.conectar:
+        return  # Edge es del usuario (o queda para la próxima conexión): no se cierra
+    if args.headless or args.rapido:
+        driver.quit()
+    else:
+        input("Listo. Revisa los valores en consola. Presiona ENTER para terminar (Edge queda abierto por 'detach').\n")
+
+# =========================
+# Servicio: sesiones calientes detrás de una API JSON local
+# =========================
+class LRUConsultas:
+    """
+    Filas por consulta en memoria, con desalojo LRU. Las fechas de los últimos
+    `dias_recientes` días vencen a las `ttl_horas`, y lo leído solo para algunas
+    `monedas` no sirve para pedir otras (igual que CacheResultados).
+    """
+
+    def __init__(self, capacidad=512, dias_recientes=3, ttl_horas=6):
+        self.capacidad = capacidad
+        self.dias_recientes = dias_recientes
+        self.ttl_horas = ttl_horas
+        self.datos = OrderedDict()  # consulta -> (rows, guardado, monedas)
+
+    def leer(self, c, monedas=None):
+        item = self.datos.get(c)
+        if item is None or not _cubre(item[2], monedas):
+            return None
+        rows, guardado, _ = item
+        if self._vencida(c, guardado):
+            del self.datos[c]
+            return None
+        self.datos.move_to_end(c)
+        return rows
+
+    def _vencida(self, c, guardado):
+        limite = datetime.now().date() - timedelta(days=self.dias_recientes)
+        return _parse_fecha(c.fecha) > limite and time.time() - guardado >= self.ttl_horas * 3600
+
+    def guardar(self, c, rows, monedas=None):
+        item = self.datos.get(c)
+        if monedas and item and not item[2] and not self._vencida(c, item[1]):
+            # Ya está el grid completo y vigente: unas pocas monedas no lo reemplazan
+            self.datos.move_to_end(c)
+            return
+        self.datos[c] = (rows, time.time(), monedas)
+        self.datos.move_to_end(c)
+        while len(self.datos) > self.capacidad:
+            self.datos.popitem(last=False)
+
+class ServicioTasas:
+    """
+    Mantiene `sesiones` navegadores con el dashboard ya cargado, cada uno en su
+    hilo, tomando consultas de una cola. Orden para responder: LRU en memoria,
+    caché SQLite, motor directo y, al final, una sesión. Las consultas idénticas
+    que llegan mientras otra está en curso esperan el mismo resultado.
+    """
+
+    def __init__(self, args, sesiones=1, capacidad=512, refrescar_min=30):
+        self.args = args
+        self.opciones = dict(barrido=args.barrido, quieto_ms=args.quieto_ms, timeout_grid=args.timeout_grid,
+                             filtros=args.filtros, buscadas=_objetivos(args), reciclar=_reciclar(args))
+        self.lru = LRUConsultas(capacidad, args.cache_dias_recientes, args.cache_ttl_horas)
+        self.cache = (CacheResultados(args.cache, args.cache_dias_recientes, args.cache_ttl_horas, entre_hilos=True)
+                      if args.cache else None)
+        self.motor = _abrir_motor(args)
+        self.indice = IndiceAlias(args.alias)
+        self.cola = queue.Queue()
+        self.en_curso = {}   # (consulta, monedas) -> Future compartido
+        self.ultima = {}     # (tasa, cambio) -> última fecha con valores publicados
+        self.combos = {(args.tasa, args.cambio)}  # tasa/cambio a refrescar
+        self.refrescar_min = refrescar_min
+        self.lock = threading.Lock()         # lru, cache, en_curso, índice
+        self.lock_motor = threading.Lock()   # la conexión keep-alive no es de varios hilos
+        self._parar = threading.Event()
+        self.hilos = [threading.Thread(target=self._sesion, args=(n,), daemon=True) for n in range(sesiones)]
+        if refrescar_min:
+            self.hilos.append(threading.Thread(target=self._refrescar, daemon=True))
+        for h in self.hilos:
+            h.start()
+
+    def _sesion(self, n):
+        # Un navegador por hilo (WebDriver no es de varios hilos); se recicla según
+        # el vigía (ver SesionLote) y se recrea si aun así falla
+        perfil = self.args.perfil and os.path.join(self.args.perfil, f"sesion{n}")
+        descargas = self.args.descargas and os.path.join(self.args.descargas, f"sesion{n}")
+
+        def crear():
+            return build_driver(headless=True, rapido=self.args.rapido, dir_perfil=perfil,
+                                dir_descargas=descargas)
+
+        driver = sesion = None
+        try:
+            while not self._parar.is_set():
+                if sesion is None:
+                    try:
+                        driver = crear()
+                        sesion = SesionLote(driver, self.args.url, crear_driver=crear, **self.opciones)
+                        sesion.preparar()  # página cargada antes de la primera consulta
+                    except Exception as e:
+                        print(f"[Servicio] sesión {n}: no arrancó el navegador: {e!r}", file=sys.stderr)
+                        if driver is not None:
+                            try: driver.quit()
+                            except Exception: pass
+                        driver = sesion = None
+                        self._parar.wait(10)
+                        continue
+                try:
+                    c, monedas, fut = self.cola.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    sesion.buscadas = monedas  # seek: las de esta consulta (None = barrido completo)
+                    fut.set_result((sesion.consultar(c), "web"))
+                except Exception as e:
+                    fut.set_exception(e)
+                    print(f"[Servicio] sesión {n}: {c.fecha} {c.tasa}: {e!r}; se recrea el navegador",
+                          file=sys.stderr)
+                    sesion.cerrar()
+                    driver = sesion = None
+        finally:
+            if sesion is not None:
+                sesion.cerrar()
+
+    def _pedidas(self, monedas=None, todas=False):
+        # Columnas que necesita extraer(rows, monedas, todas); None = el grid completo
+        if todas or (monedas is None and self.opciones["buscadas"] is None):
+            return None
+        return tuple(sorted(monedas or self.opciones["buscadas"]))
+
+    def _terminar(self, c, monedas, fut):
+        with self.lock:
+            self.en_curso.pop((c, monedas), None)
+            if fut.cancelled() or fut.exception() is not None:
+                return
+            rows, origen = fut.result()
+            # Solo se refresca una tasa/cambio que el dashboard aceptó
+            self.combos.add((c.tasa, c.cambio))
+            # Con seek el navegador leyó solo esas monedas; el motor directo trae todo
+            leidas = monedas if origen == "web" and self.opciones["barrido"] == "seek" else None
+            self.lru.guardar(c, rows, leidas)
+            if self.cache and origen != "cache":
+                self.cache.guardar(c, rows, leidas)
+
+    def consultar(self, c, timeout=None, forzar=False, monedas=None, todas=False):
+        """
+        (rows, origen) de la consulta, con al menos las columnas que pide
+        extraer(rows, monedas, todas). forzar=True ignora LRU y caché (refresco).
+        """
+        monedas = self._pedidas(monedas, todas)
+        with self.lock:
+            if not forzar:
+                rows = self.lru.leer(c, monedas)
+                if rows is not None:
+                    return rows, "memoria"
+            fut = self.en_curso.get((c, monedas))
+            nueva = fut is None
+            if nueva:
+                rows = self.cache.leer(c, monedas) if self.cache and not forzar else None
+                if rows is not None:
+                    self.lru.guardar(c, rows, monedas)
+                    return rows, "cache"
+                fut = self.en_curso[(c, monedas)] = Future()
+                fut.add_done_callback(lambda f: self._terminar(c, monedas, f))
+        if nueva:
+            rows = None
+            if self.motor:
+                with self.lock_motor:
+                    try:
+                        rows = self.motor.consultar(c)
+                    except ErrorMotorDirecto as e:
+                        print(f"[Directo] {c.fecha} {c.tasa}: {e} -> navegador", file=sys.stderr)
+            if rows is not None:
+                fut.set_result((rows, "directo"))
+            else:
+                self.cola.put((c, monedas, fut))
+        return fut.result(timeout)
+
+    def extraer(self, rows, monedas=None, todas=False):
+        with self.lock:
+            if todas or (monedas is None and self.opciones["buscadas"] is None):
+                return extraer_catalogo(rows, self.indice)
+            return extraer_objetivo(rows, monedas or self.opciones["buscadas"], self.indice)
+
+    def _refrescar(self):
+        # Al arrancar y cada refrescar_min: vuelve a pedir hoy (o el último día con
+        # valores, hasta una semana atrás) para cada tasa/cambio que se haya consultado
+        espera = 0
+        while not self._parar.wait(espera):
+            espera = self.refrescar_min * 60
+            with self.lock:
+                combos = sorted(self.combos)
+            for tasa, cambio in combos:
+                for atras in range(7):
+                    fecha = (datetime.now() - timedelta(days=atras)).strftime("%d/%m/%Y")
+                    try:
+                        rows, _ = self.consultar(Consulta(fecha, COMPARADOR_IGUAL, tasa, cambio), forzar=True)
+                    except Exception as e:
+                        print(f"[Servicio] refresco {fecha} {tasa}: {e!r}", file=sys.stderr)
+                        break
+                    if any(r.get("value") for r in rows):
+                        self.ultima[(tasa, cambio)] = fecha
+                        break
+                if self._parar.is_set():
+                    return
+
+    def estado(self):
+        with self.lock:
+            return {"sesiones": sum(1 for h in self.hilos if h.is_alive()), "cola": self.cola.qsize(),
+                    "en_curso": len(self.en_curso), "lru": len(self.lru.datos),
+                    "ultima": {f"{t}|{c}": f for (t, c), f in self.ultima.items()}}
+
+    def cerrar(self):
+        self._parar.set()
+        for h in self.hilos:
+            h.join(timeout=30)
+        if self.motor:
+            self.motor.close()
+        if self.cache:
+            self.cache.close()
+        self.indice.guardar()
+
+def servir_api(servicio, puerto=8765, host="127.0.0.1", timeout=180):
+    """
+    API JSON local del servicio:
+      GET /rates?fecha=dd/mm/yyyy&tasa=...&cambio=...[&monedas=EUR,JPY][&todas=1]
+      GET /salud
+    Sin fecha se usa la última publicada que encontró el refresco (o hoy).
+    """
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _json(self, status, obj):
+            datos = json.dumps(obj, ensure_ascii=False, default=_json_valor).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            u = urllib.parse.urlsplit(self.path)
+            q = dict(urllib.parse.parse_qsl(u.query))
+            if u.path == "/salud":
+                self._json(200, servicio.estado())
+                return
+            if u.path != "/rates":
+                self._json(404, {"error": "ruta desconocida"})
+                return
+            tasa = q.get("tasa") or servicio.args.tasa
+            cambio = q.get("cambio") or servicio.args.cambio
+            fecha = q.get("fecha") or servicio.ultima.get((tasa, cambio)) or datetime.now().strftime("%d/%m/%Y")
+            try:
+                _parse_fecha(fecha)
+            except ValueError:
+                self._json(400, {"error": f"fecha inválida: {fecha} (dd/mm/yyyy)"})
+                return
+            c = Consulta(fecha, COMPARADOR_IGUAL, tasa, cambio)
+            monedas = [m for m in q.get("monedas", "").split(",") if m.strip()] or None
+            todas = q.get("todas") == "1"
+            t0 = time.perf_counter()
+            try:
+                rows, origen = servicio.consultar(c, timeout, monedas=monedas, todas=todas)
+            except FuturoTimeout:
+                self._json(504, {"error": f"sin respuesta en {timeout}s", "consulta": c._asdict()})
+                return
+            except Exception as e:
+                self._json(502, {"error": repr(e), "consulta": c._asdict()})
+                return
+            resultados = servicio.extraer(rows, monedas, todas)
+            self._json(200, dict(c._asdict(), origen=origen, ms=round((time.perf_counter() - t0) * 1000, 1),
+                                 resultados=resultados))
+
+        def log_message(self, *a):
+            pass
+
+    return ThreadingHTTPServer((host, puerto), Manejador)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--url", default=URL_DEFAULT)
     parser.add_argument("--fecha", default="20/09/2025", help="dd/mm/yyyy")
-    parser.add_argument("--comparador", default="Igual que", choices=["Igual que", "Iniciar en"])
+    parser.add_argument("--comparador", default=COMPARADOR_IGUAL, choices=[COMPARADOR_IGUAL, COMPARADOR_DESDE])
     parser.add_argument("--tasa", default="VENTA", help="Opción exacta del filtro 'Tipo de Tasa'")
     parser.add_argument("--cambio", default="Dólares estadounidenses por cada moneda",
                         help="Opción exacta del filtro 'Tipo de Cambio'")
-    parser.add_argument("--espera", type=float, default=2.0,
-                        help="Segundos de espera tras aplicar filtros, antes de leer la tabla")
+    parser.add_argument("--espera", type=float, default=0.0,
+                        help="Segundos de espera fija extra tras aplicar filtros (normalmente 0: "
+                             "se espera a que cambie el contenido del grid)")
+    parser.add_argument("--quieto-ms", type=int, default=500,
+                        help="Ms que el grid debe quedar estable tras cambiar para darlo por cargado")
+    parser.add_argument("--timeout-grid", type=float, default=60,
+                        help="Segundos máximos de espera a que el grid cambie tras los filtros")
+    parser.add_argument("--barrido", default="async", choices=["async", "pasos", "seek", *MODOS_EXPORTAR],
+                        help="async: barrido completo en el navegador; pasos: scroll dirigido desde Python; "
+                             "seek: solo las columnas pedidas, según el layout del último barrido completo "
+                             "(en la caché no sirven para --todas ni para otras monedas); exportar / exportar-xlsx: exportación "
+                             "nativa del dashboard (CSV / Excel), sin scroll")
+    parser.add_argument("--descargas", metavar="DIR",
+                        help="Directorio para los archivos exportados (se conservan); por defecto uno temporal "
+                             "que se vacía al leerlos")
+    parser.add_argument("--filtros", default="js", choices=["js", "pasos"],
+                        help="js: los tres filtros en una sola llamada al navegador; pasos: tile por tile")
+    parser.add_argument("--perfil", metavar="DIR",
+                        help="Perfil de Edge persistente (caché y cookies entre corridas); con --workers o "
+                             "--sesiones se usa un subdirectorio por navegador")
+    parser.add_argument("--conectar", metavar="HOST:PUERTO",
+                        help="Usa el Edge abierto con --remote-debugging-port en esa dirección (y su pestaña del "
+                             "dashboard); si no hay ninguno, lo abre con ese puerto para la próxima vez")
+    parser.add_argument("--msedgedriver", metavar="RUTA",
+                        help="msedgedriver fijo (sin la búsqueda de Selenium Manager); sin esto se reusa la "
+                             "última ruta resuelta, guardada en " + RUTA_CACHE_MSEDGEDRIVER)
+    parser.add_argument("--headless", action="store_true",
+                        help="Edge sin ventana (tamaño fijo) y cerrado al terminar")
+    parser.add_argument("--rapido", "--fast", action="store_true",
+                        help="Headless + bloqueo de imágenes, fuentes, media y analítica")
+    # Modo lote: varias consultas en una sola sesión; salida JSONL por stdout
+    parser.add_argument("--desde", help="Lote: fecha inicial dd/mm/yyyy (requiere --hasta)")
+    parser.add_argument("--hasta", help="Lote: fecha final dd/mm/yyyy (incluida)")
+    parser.add_argument("--consultas", help="Lote: archivo JSON o CSV con fecha,comparador,tasa,cambio")
+    parser.add_argument("--historico", action="store_true",
+                        help="Lote: con --desde/--hasta, una sola consulta 'Iniciar en' barrida en 2D "
+                             "en vez de una consulta por día")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Lote: procesos con navegador headless propio (1 = una sola sesión)")
+    parser.add_argument("--pestanas", type=int, default=1,
+                        help="Lote con un solo navegador: pestañas consultando a la vez (ignorado con --workers)")
+    parser.add_argument("--max-concurrentes", type=int, default=None,
+                        help="Lote: tope de consultas simultáneas al servidor (por defecto = --workers)")
+    parser.add_argument("--reciclar-cada", type=int, default=0, metavar="N",
+                        help="Lote/servicio: navegador nuevo cada N consultas (0 = sin límite)")
+    parser.add_argument("--reciclar-rss-mb", type=float, default=3072,
+                        help="Lote/servicio: navegador nuevo si Edge pasa de estos MB de RSS (0 = no medir)")
+    parser.add_argument("--reciclar-latencia", type=float, default=2.5, metavar="FACTOR",
+                        help="Lote/servicio: navegador nuevo si la latencia mediana llega a FACTOR veces "
+                             "la de sus primeras consultas (0 = no medir)")
+    parser.add_argument("--bloque", type=int, default=8,
+                        help="Lote: consultas por bloque que toma cada worker")
+    parser.add_argument("--cache", help="Archivo SQLite de caché de resultados (se crea si no existe)")
+    parser.add_argument("--cache-dias-recientes", type=int, default=3,
+                        help="Fechas de los últimos N días se consideran provisionales")
+    parser.add_argument("--cache-ttl-horas", type=float, default=6,
+                        help="Vigencia en caché de las fechas provisionales")
+    # Motor directo: replicar la consulta XHR del dashboard sin manejar la UI
+    parser.add_argument("--descubrir", metavar="PLANTILLA",
+                        help="Captura la consulta del backend durante esta ejecución y la guarda como plantilla JSON")
+    parser.add_argument("--directo", metavar="PLANTILLA",
+                        help="Responde con la plantilla por HTTP directo; si falla, usa el navegador")
+    parser.add_argument("--directo-base", help="Otro origen para el motor directo (p.ej. http://127.0.0.1:8765)")
+    parser.add_argument("--grabar-capturas", metavar="DIR", help="Guarda las respuestas del backend en DIR")
+    parser.add_argument("--servir-capturas", metavar="DIR",
+                        help="Solo levanta el servidor local que responde con las capturas de DIR")
+    parser.add_argument("--puerto", type=int, default=8765, help="Puerto de --servir-capturas y --simulado")
+    parser.add_argument("--objetivos", help="Archivo con las monedas a extraer (JSON o una por línea)")
+    parser.add_argument("--todas", action="store_true", help="Devuelve todas las monedas del grid")
+    parser.add_argument("--alias", help="Índice JSON persistente de alias -> código ISO (crece solo)")
+    parser.add_argument("--salida", help="Archivo (o directorio, para parquet) donde anexar registros tipados; "
+                                          "sin consola interactiva")
+    parser.add_argument("--formato", choices=sorted(SALIDAS),
+                        help="Formato de --salida (por defecto, según la extensión)")
+    parser.add_argument("--cruzadas", metavar="CSV",
+                        help="Lote: escribe las tasas cruzadas entre todas las monedas extraídas (fecha,tasa,de,a,valor)")
+    parser.add_argument("--simulado", action="store_true",
+                        help="Solo levanta el dashboard simulado en --puerto (usar con --url desde otra consola)")
+    parser.add_argument("--bench", metavar="JSON",
+                        help="Benchmark del flujo contra el dashboard simulado; guarda el informe en JSON")
+    parser.add_argument("--bench-columnas", default="40,150,400", help="Columnas del grid simulado a medir")
+    parser.add_argument("--bench-latencias", default="0,50,200", help="Ms de render del grid simulado a medir")
+    parser.add_argument("--bench-reps", type=int, default=3, help="Repeticiones por caso")
+    parser.add_argument("--servicio", action="store_true",
+                        help="Servicio con navegador(es) caliente(s) y API JSON en --puerto: "
+                             "GET /rates?fecha=&tasa=&cambio= y GET /salud")
+    parser.add_argument("--sesiones", type=int, default=1, help="Servicio: navegadores en paralelo")
+    parser.add_argument("--lru", type=int, default=512, help="Servicio: consultas guardadas en memoria")
+    parser.add_argument("--refrescar-min", type=float, default=30,
+                        help="Servicio: cada cuántos minutos refrescar la última fecha publicada (0 = nunca)")
+    parser.add_argument("--traza", metavar="JSON",
+                        help="Guarda la traza de la ejecución (tiempo y round trips por fase, "
+                             "percentiles del lote) y muestra el resumen por stderr")
     args = parser.parse_args()
-    main(args.url, args.fecha, args.comparador, args.tasa, args.cambio, args.espera)
+    if args.msedgedriver:
+        os.environ["BANCO_MSEDGEDRIVER"] = os.path.abspath(args.msedgedriver)  # también para workers/sesiones
+
+    if args.servir_capturas:
+        srv = servir_capturas(args.servir_capturas, args.puerto)
+        print(f"[Capturas] Sirviendo {args.servir_capturas} en http://127.0.0.1:{args.puerto}")
+        srv.serve_forever()
+        sys.exit(0)
+    if args.simulado:
+        srv = servir_simulado(args.puerto)
+        print(f"[Simulado] Dashboard en http://127.0.0.1:{args.puerto}/?columnas=150&latencia=50")
+        srv.serve_forever()
+        sys.exit(0)
+    if args.servicio:
+        servicio = ServicioTasas(args, args.sesiones, args.lru, args.refrescar_min)
+        srv = servir_api(servicio, args.puerto)
+        print(f"[Servicio] http://127.0.0.1:{args.puerto}/rates?fecha=dd/mm/yyyy&tasa=...&cambio=...")
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            srv.server_close()
+            servicio.cerrar()
+        sys.exit(0)
+    if args.bench:
+        informe = benchmark([int(x) for x in args.bench_columnas.split(",")],
+                            [int(x) for x in args.bench_latencias.split(",")],
+                            args.bench_reps, rapido=args.rapido,
+                            quieto_ms=args.quieto_ms, timeout_grid=args.timeout_grid, filtros=args.filtros)
+        with open(args.bench, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=1)
+        imprimir_benchmark(informe)
+        sys.exit(0)
+
+    consultas = []
+    hasta = None
+    if args.desde or args.hasta:
+        if not (args.desde and args.hasta):
+            parser.error("--desde y --hasta van juntos")
+        if args.historico:
+            consultas.append(Consulta(args.desde, COMPARADOR_DESDE, args.tasa, args.cambio))
+            hasta = args.hasta
+        else:
+            consultas += [Consulta(f, args.comparador, args.tasa, args.cambio)
+                          for f in rango_fechas(args.desde, args.hasta)]
+    if args.consultas:
+        consultas += cargar_consultas(args.consultas, args.comparador, args.tasa, args.cambio)
+
+    if args.comparador == COMPARADOR_DESDE and not consultas:
+        # Varias filas (una por fecha): se emiten como lote, a medida que se leen
+        consultas.append(Consulta(args.fecha, args.comparador, args.tasa, args.cambio))
+
+    traza = iniciar_traza("lote" if consultas else "consulta") if args.traza else None
+    try:
+        if consultas:
+            main_lote(args, consultas, hasta)
+        else:
+            main(args)
+    finally:
+        if traza:
+            traza.guardar(args.traza)
+            imprimir_resumen(traza.a_dict()["resumen"])
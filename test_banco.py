@@ -0,0 +1,567 @@
+"""
+Pruebas sin navegador ni red: motor directo contra servir_capturas y las
+funciones puras.
+"""
+import csv
+import json
+import threading
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import banco
+
+# =========================
+# Motor directo (offline, contra servir_capturas)
+# =========================
+CAMBIO = "Dólares estadounidenses por cada moneda"
+URL_BACKEND = "https://dashboard.example/api/tasas?fecha=2025-01-02&tipo=VENTA&vista=grid"
+
+
+def _consulta(fecha):
+    return banco.Consulta(fecha, banco.COMPARADOR_IGUAL, "VENTA", CAMBIO)
+
+
+def _respuesta(valores):
+    """Cuerpo JSON como el del backend: la tabla va anidada, con claves propias."""
+    return json.dumps({"estado": "ok", "datos": {"filas": [
+        {"moneda": nombre, "iso": code, "venta": v, "orden": i}
+        for i, (nombre, code, v) in enumerate(valores)]}})
+
+
+VALORES = [("Euro", "EUR", 1.0845), ("Yen japonés", "JPY", 0.0064), ("Franco suizo", "CHF", 1.1032)]
+
+
+@pytest.fixture
+def capturas(tmp_path):
+    """Servidor de capturas en un puerto libre; devuelve (directorio, base)."""
+    srv = banco.servir_capturas(str(tmp_path), 0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield str(tmp_path), f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_marcar_y_rellenar_reproducen_la_url():
+    c = _consulta("02/01/2025")
+    marcada = banco._marcar(URL_BACKEND, c)
+    assert "2025-01-02" not in marcada and "VENTA" not in marcada
+    assert "{{fecha|%Y-%m-%d}}" in marcada and "{{tasa}}" in marcada
+    assert banco._rellenar(marcada, c) == URL_BACKEND
+    otra = banco._rellenar(marcada, c._replace(fecha="15/03/2024", tasa="COMPRA"))
+    assert otra == URL_BACKEND.replace("2025-01-02", "2024-03-15").replace("VENTA", "COMPRA")
+
+
+def test_emparejar_encuentra_tabla_y_claves():
+    rows = [{"name": n, "code": k, "value": str(v).replace(".", ",")} for n, k, v in VALORES]
+    extractor, n = banco._emparejar(json.loads(_respuesta(VALORES)), rows)
+    assert n == len(VALORES)
+    assert extractor == {"ruta": ["datos", "filas"], "name": "moneda", "code": "iso", "value": "venta"}
+
+
+def test_emparejar_sin_coincidencias():
+    rows = [{"name": "Euro", "code": "EUR", "value": "9,99"}]
+    assert banco._emparejar(json.loads(_respuesta(VALORES)), rows) == (None, 0)
+
+
+def test_motor_directo_contra_capturas(tmp_path, capturas):
+    directorio, base = capturas
+    c = _consulta("02/01/2025")
+    rows = [{"name": n, "code": k, "value": str(v).replace(".", ",")} for n, k, v in VALORES]
+    extractor, _ = banco._emparejar(json.loads(_respuesta(VALORES)), rows)
+    plantilla = tmp_path / "plantilla.json"
+    plantilla.write_text(json.dumps({
+        "url": banco._marcar(URL_BACKEND, c), "metodo": "GET", "cabeceras": {}, "cuerpo": "",
+        "cookies": {"sesion": "x"}, "extractor": extractor, "descubierta": c._asdict()}), encoding="utf-8")
+
+    # Otra fecha: el motor tiene que pedir la URL rellenada, que es la que está capturada
+    otra = _consulta("03/01/2025")
+    nuevos = [("Euro", "EUR", 1.0901), ("Yen japonés", "JPY", 0.0065), ("Franco suizo", "CHF", 1.1)]
+    banco.guardar_captura(directorio, "GET", banco._rellenar(banco._marcar(URL_BACKEND, c), otra), None,
+                          200, "application/json", _respuesta(nuevos))
+    motor = banco.MotorDirecto(str(plantilla), base=base)
+    try:
+        assert motor.consultar(otra) == [
+            {"name": "Euro", "code": "EUR", "value": "1,0901"},
+            {"name": "Yen japonés", "code": "JPY", "value": "0,0065"},
+            {"name": "Franco suizo", "code": "CHF", "value": "1,1"},
+        ]
+        # Segunda consulta por la misma conexión keep-alive
+        assert len(motor.consultar(otra)) == 3
+        with pytest.raises(banco.ErrorMotorDirecto, match="HTTP 404"):
+            motor.consultar(_consulta("04/01/2025"))
+    finally:
+        motor.close()
+
+
+def test_motor_directo_post_con_cuerpo(tmp_path, capturas):
+    directorio, base = capturas
+    c = _consulta("02/01/2025")
+    cuerpo = json.dumps({"filtros": {"fecha": "02/01/2025", "tasa": "VENTA"}})
+    plantilla = tmp_path / "plantilla.json"
+    plantilla.write_text(json.dumps({
+        "url": "https://dashboard.example/api/consulta", "metodo": "POST",
+        "cabeceras": {"Content-Type": "application/json"}, "cuerpo": banco._marcar(cuerpo, c),
+        "extractor": {"ruta": ["datos", "filas"], "name": "moneda", "code": "iso", "value": "venta"},
+        "descubierta": c._asdict()}), encoding="utf-8")
+    otra = _consulta("03/01/2025")
+    banco.guardar_captura(directorio, "POST", "https://dashboard.example/api/consulta",
+                          cuerpo.replace("02/01/2025", "03/01/2025"), 200, "application/json",
+                          _respuesta(VALORES[:1]))
+    motor = banco.MotorDirecto(str(plantilla), base=base)
+    try:
+        assert motor.consultar(otra) == [{"name": "Euro", "code": "EUR", "value": "1,0845"}]
+    finally:
+        motor.close()
+
+
+def test_filas_desde_respuesta_xml():
+    texto = ("<resp><fila><moneda>Euro</moneda><iso>EUR</iso><venta>1.0845</venta></fila>"
+             "<fila><moneda>Yen japonés</moneda><iso>JPY</iso><venta>0.0064</venta></fila></resp>")
+    extractor = {"ruta": ["xml", "fila"], "name": "moneda", "code": "iso", "value": "venta"}
+    assert banco.filas_desde_respuesta(texto, extractor) == [
+        {"name": "Euro", "code": "EUR", "value": "1,0845"},
+        {"name": "Yen japonés", "code": "JPY", "value": "0,0064"},
+    ]
+
+
+def test_respuesta_que_no_es_json_ni_xml():
+    with pytest.raises(banco.ErrorMotorDirecto):
+        banco.filas_desde_respuesta("<html", {"ruta": [], "name": "a", "code": None, "value": "b"})
+
+# =========================
+# Lote en una sesión
+# =========================
+def test_planificar_consultas_agrupa_y_quita_duplicados():
+    a = banco.Consulta("03/01/2025", banco.COMPARADOR_IGUAL, "VENTA", CAMBIO)
+    b = banco.Consulta("01/02/2024", banco.COMPARADOR_IGUAL, "VENTA", CAMBIO)
+    c = banco.Consulta("02/01/2025", banco.COMPARADOR_IGUAL, "COMPRA", CAMBIO)
+    d = banco.Consulta("01/01/2025", banco.COMPARADOR_DESDE, "VENTA", CAMBIO)
+    assert banco.planificar_consultas([a, d, b, c, a]) == [c, b, a, d]
+
+
+def test_ejecutar_lote_sigue_tras_una_consulta_fallida(monkeypatch):
+    fallida = _consulta("02/01/2025")
+    recargas = []
+
+    def preparar(self):
+        recargas.append(self.previa)
+        self.previa, self.limpia = None, True
+
+    def consultar(self, c):
+        self._filtrar(c)
+        if c == fallida:
+            raise TimeoutError("el grid no cargó")
+        return [{"name": "Euro", "code": "EUR", "value": c.fecha}]
+
+    monkeypatch.setattr(banco.SesionLote, "preparar", preparar)
+    monkeypatch.setattr(banco.SesionLote, "_consultar", consultar)
+    monkeypatch.setattr(banco, "aplicar_filtros", lambda *a, **k: {})
+    consultas = [_consulta("01/01/2025"), fallida, _consulta("03/01/2025")]
+    out = list(banco.ejecutar_lote(object(), "u", consultas))
+    assert out == [(consultas[0], [{"name": "Euro", "code": "EUR", "value": "01/01/2025"}]),
+                   (fallida, None),
+                   (consultas[2], [{"name": "Euro", "code": "EUR", "value": "03/01/2025"}])]
+    assert len(recargas) == 2  # la primera consulta y la siguiente a la que falló
+
+
+def _filas_grid(desde, hasta):
+    return [{"fecha": f, "columnas": [{"name": "Euro", "code": "EUR", "value": f}]}
+            for f in banco.rango_fechas(desde, hasta)]
+
+
+@pytest.mark.parametrize("orden", [1, -1])
+def test_iniciar_en_se_recicla_y_no_repite_fechas(monkeypatch, orden):
+    pedidas, recicladas = [], []
+
+    def leer_grid_filas(driver, *a, **k):
+        desde = pedidas[-1]
+        filas = _filas_grid(desde, "05/01/2025")[::orden]
+        if len(pedidas) == 1:  # el primer navegador se cuelga a la mitad
+            yield from filas[:2]
+            raise TimeoutError("navegador colgado")
+        yield from filas
+
+    monkeypatch.setattr(banco.SesionLote, "preparar", lambda self: setattr(self, "limpia", True))
+    monkeypatch.setattr(banco, "aplicar_filtros", lambda d, c, *a, **k: pedidas.append(c.fecha))
+    monkeypatch.setattr(banco, "leer_grid_filas", leer_grid_filas)
+    monkeypatch.setattr(banco, "llamar_js", lambda *a: None)
+    monkeypatch.setattr(banco, "reciclar_driver", lambda d, crear, motivo: recicladas.append(motivo) or crear())
+    sesion = banco.SesionLote(object(), "u", crear_driver=object)
+    c = banco.Consulta("01/01/2025", banco.COMPARADOR_DESDE, "VENTA", CAMBIO)
+    fechas = [d.fecha for d, _ in sesion.filas(c)]
+    assert sorted(fechas, key=banco._parse_fecha) == banco.rango_fechas("01/01/2025", "05/01/2025")
+    assert len(recicladas) == 1
+    # En orden se sigue desde el día siguiente; desordenado se vuelve a pedir todo
+    assert pedidas == (["01/01/2025", "03/01/2025"] if orden == 1 else ["01/01/2025", "01/01/2025"])
+
+
+def test_vigia():
+    v = banco.Vigia(max_consultas=12, factor_latencia=2, ventana=3)
+    for ms in (100, 110, 90, 100, 120, 105):
+        v.anotar(ms)
+    assert v.motivo(None) is None
+    for ms in (250, 260, 240):
+        v.anotar(ms)
+    assert v.motivo(None).startswith("latencia")
+    v.reiniciar()
+    assert v.motivo(None) is None
+    for _ in range(12):
+        v.anotar(100)
+    assert v.motivo(None) == "12 consultas"
+
+# =========================
+# Trazas
+# =========================
+@pytest.mark.parametrize("valores, p, esperado", [
+    (list(range(1, 11)), 50, 5),
+    (list(range(1, 11)), 90, 9),
+    (list(range(1, 11)), 99, 10),
+    (list(range(1, 11)), 100, 10),
+    (list(range(1, 11)), 0, 1),
+    ([1, 2], 50, 1),
+    ([7], 90, 7),
+    ([], 50, None),
+])
+def test_percentil_rango_mas_cercano(valores, p, esperado):
+    assert banco._percentil(valores, p) == esperado
+
+
+def test_resumen_trazas():
+    spans = [{"fase": "filtros", "ms": ms, "round_trips": 1, "js_bytes": 10, "reintentos": 0}
+             for ms in (40, 10, 30, 20)] + [{"fase": "grid", "ms": None}]
+    r = banco.resumen_trazas(spans)
+    assert list(r) == ["filtros"]
+    assert r["filtros"]["ms"] == {"p50": 20, "p90": 40, "p99": 40, "max": 40}
+    assert r["filtros"]["js_bytes"] == 40
+
+# =========================
+# valor_decimal
+# =========================
+@pytest.mark.parametrize("texto, esperado", [
+    ("4.123,45", "4123.45"),
+    ("4,123.45", "4123.45"),
+    ("0,000245", "0.000245"),
+    ("1 234,5", "1234.5"),
+    ("1\u00a0234,5", "1234.5"),
+    ("1.234.567,8", "1234567.8"),
+    ("-0,5", "-0.5"),
+    ("−0,5", "-0.5"),
+    ("$ 4.123,45", "4123.45"),
+    ("€1,5", "1.5"),
+    ("12,5 %", "12.5"),
+    ("1.5e-3", "0.0015"),
+    (2.5, "2.5"),
+])
+def test_valor_decimal(texto, esperado):
+    assert banco.valor_decimal(texto) == Decimal(esperado)
+
+
+@pytest.mark.parametrize("texto", [None, "", "N/D", "ERROR", True, float("nan"),
+                                   "12abc34", "N/D 4,1", "4,1 USD", "(1,5)"])
+def test_valor_decimal_sin_numero(texto):
+    assert banco.valor_decimal(texto) is None
+
+
+def test_valor_decimal_con_separador_conocido():
+    assert banco.valor_decimal("1.234", decimal=",") == Decimal("1234")
+    assert banco.valor_decimal("1,234", decimal=".") == Decimal("1234")
+
+
+def test_celdas_del_grid_usan_coma_decimal():
+    rows = [{"name": "Peso chileno", "code": "CLP", "value": "1.234"},
+            {"name": "Euro", "code": "EUR", "value": "1,0845"}]
+    assert [r["valor"] for r in banco.extraer_catalogo(rows)] == [Decimal("1234"), Decimal("1.0845")]
+    assert banco.extraer_objetivo(rows, ["Peso chileno"])[0]["valor"] == Decimal("1234")
+
+# =========================
+# Tasas cruzadas
+# =========================
+def _tabla(cambio=CAMBIO):
+    regs = [{"fecha": "2025-01-02", "codigo": "EUR", "valor": Decimal("1.1")},
+            {"fecha": "2025-01-02", "codigo": "GBP", "valor": Decimal("1.32")},
+            {"fecha": "2025-01-01", "codigo": "EUR", "valor": Decimal("1.0")},
+            {"fecha": "2025-01-01", "codigo": "GBP", "valor": None},
+            {"fecha": "ayer", "codigo": "EUR", "valor": Decimal("9")},
+            {"fecha": "2025-01-01", "codigo": "", "valor": Decimal("9")}]
+    return banco.TablaTasas(cambio).agregar(regs)
+
+
+def test_tabla_tasas_cruzadas():
+    t = _tabla()
+    codigos, m = t.cruzadas()
+    assert codigos == ["EUR", "GBP", "USD"]
+    assert m[0][1] == pytest.approx(1.1 / 1.32)
+    assert m[1][2] == pytest.approx(1.32)
+    assert m[2][0] == pytest.approx(1 / 1.1)
+    assert t.valor("2025-01-01", "GBP") is None
+
+
+def test_tabla_tasas_cruce_en_orden_cronologico():
+    t = _tabla()
+    assert t.cruce("GBP", "EUR") == [(date(2025, 1, 1), None),
+                                     (date(2025, 1, 2), pytest.approx(1.2))]
+    assert [v for _, v in t.cruce("EUR", "USD")] == [pytest.approx(1.0), pytest.approx(1.1)]
+
+
+def test_tabla_tasas_monedas_por_dolar():
+    t = _tabla("Monedas por cada dólar estadounidense")
+    assert [v for _, v in t.cruce("EUR", "USD")] == [pytest.approx(1.0), pytest.approx(1 / 1.1)]
+
+# =========================
+# Caché de resultados
+# =========================
+ROWS = [{"name": "Euro", "code": "EUR", "value": "1,0845"}, {"name": "Yen japonés", "code": "JPY", "value": ""}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = banco.CacheResultados(str(tmp_path / "cache.sqlite"), dias_recientes=3, ttl_horas=6)
+    yield c
+    c.close()
+
+
+def test_cache_guarda_y_lee_en_orden(cache):
+    c = _consulta("02/01/2020")
+    assert cache.leer(c) is None
+    cache.guardar(c, ROWS)
+    assert cache.leer(c) == ROWS
+    cache.guardar(c, ROWS[:1])  # reemplaza, no acumula
+    assert cache.leer(c) == ROWS[:1]
+    assert cache.faltantes([c, _consulta("03/01/2020")]) == [_consulta("03/01/2020")]
+
+
+def test_cache_guarda_columnas_sin_codigo_ni_nombre(cache):
+    c = _consulta("02/01/2020")
+    rows = ROWS + [{"name": "", "code": "", "value": "1"}, {"name": "", "code": "", "value": "2"}]
+    cache.guardar(c, rows)
+    assert cache.leer(c) == rows
+
+
+def test_cache_fechas_recientes_vencen(tmp_path):
+    cache = banco.CacheResultados(str(tmp_path / "cache.sqlite"), dias_recientes=3, ttl_horas=0)
+    try:
+        hoy = _consulta(datetime.now().strftime("%d/%m/%Y"))
+        vieja = _consulta((datetime.now() - timedelta(days=30)).strftime("%d/%m/%Y"))
+        cache.guardar(hoy, ROWS)
+        cache.guardar(vieja, ROWS)
+        assert cache.leer(hoy) is None
+        assert cache.leer(vieja) == ROWS
+    finally:
+        cache.close()
+
+
+def test_cache_vacia_es_dia_sin_publicar(cache):
+    c = _consulta("04/01/2020")
+    cache.guardar(c, [])
+    assert cache.leer(c) == []
+    assert cache.faltantes([c]) == []
+
+
+@pytest.mark.parametrize("guardadas, pedidas, sirve", [
+    (None, None, True),
+    (None, ("EUR",), True),
+    (["EUR", "JPY"], None, False),
+    (["EUR", "JPY"], ("EUR",), True),
+    (["EUR", "JPY"], ("EUR", "CHF"), False),
+])
+def test_cubre(guardadas, pedidas, sirve):
+    assert banco._cubre(guardadas, pedidas) is sirve
+
+
+def test_cache_parcial_no_sirve_para_el_grid_completo(cache):
+    c = _consulta("02/01/2020")
+    cache.guardar(c, ROWS[:1], ["Euro", "Yen japonés"])  # barrido seek
+    assert cache.leer(c) is None
+    assert cache.leer(c, ["Euro"]) == ROWS[:1]
+    assert cache.leer(c, ["Franco suizo"]) is None
+    cache.guardar(c, ROWS)
+    assert cache.leer(c, ["Franco suizo"]) == ROWS
+    cache.guardar(c, ROWS[:1], ["Euro"])  # no reemplaza al grid completo
+    assert cache.leer(c) == ROWS
+
+
+def test_lru_parcial_no_reemplaza_al_grid_completo():
+    lru = banco.LRUConsultas(capacidad=2)
+    c = _consulta("02/01/2020")
+    lru.guardar(c, ROWS[:1], ("EUR",))
+    assert lru.leer(c) is None and lru.leer(c, ("EUR",)) == ROWS[:1]
+    lru.guardar(c, ROWS)
+    lru.guardar(c, ROWS[:1], ("EUR",))
+    assert lru.leer(c) == ROWS
+    lru.guardar(_consulta("03/01/2020"), [])
+    lru.guardar(_consulta("04/01/2020"), [])
+    assert lru.leer(c) is None  # desalojada
+
+
+def test_pedidas_en_orden_canonico():
+    servicio = object.__new__(banco.ServicioTasas)
+    servicio.opciones = {"buscadas": ["Yen japonés", "Euro"]}
+    assert servicio._pedidas() == servicio._pedidas(["Euro", "Yen japonés"]) == ("Euro", "Yen japonés")
+    assert servicio._pedidas(todas=True) is None
+
+
+def test_lru_fechas_recientes_vencen():
+    lru = banco.LRUConsultas(dias_recientes=3, ttl_horas=0)
+    hoy = _consulta(datetime.now().strftime("%d/%m/%Y"))
+    vieja = _consulta("02/01/2020")
+    lru.guardar(hoy, ROWS)
+    lru.guardar(vieja, ROWS)
+    assert lru.leer(hoy) is None and hoy not in lru.datos
+    assert lru.leer(vieja) == ROWS
+
+
+def _servicio():
+    servicio = object.__new__(banco.ServicioTasas)
+    servicio.opciones = {"barrido": "async", "buscadas": None}
+    servicio.lock, servicio.en_curso, servicio.cache = threading.Lock(), {}, None
+    servicio.lru, servicio.combos = banco.LRUConsultas(), set()
+    return servicio
+
+
+def test_solo_se_refrescan_combinaciones_que_respondieron():
+    servicio = _servicio()
+    mala = _consulta("02/01/2020")._replace(tasa="VENTAA")
+    fut = Future()
+    fut.set_exception(ValueError("opción inexistente: VENTAA"))
+    servicio._terminar(mala, None, fut)
+    assert servicio.combos == set()
+    fut = Future()
+    fut.set_result((ROWS, "web"))
+    servicio._terminar(_consulta("02/01/2020"), None, fut)
+    assert servicio.combos == {("VENTA", CAMBIO)}
+
+# =========================
+# Driver
+# =========================
+class _DriverCDP:
+    def __init__(self, session_id):
+        self.session_id, self.cdp = session_id, []
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp.append(cmd)
+
+    def quit(self):
+        pass
+
+
+def test_bloquear_recursos_solo_en_sesiones_rapidas():
+    lento, rapido = _DriverCDP("lento"), _DriverCDP("rapido")
+    banco._RAPIDOS.add("rapido")
+    banco.bloquear_recursos(lento)
+    banco.bloquear_recursos(rapido)
+    assert lento.cdp == [] and rapido.cdp == ["Network.enable", "Network.setBlockedURLs"]
+    banco.reciclar_driver(rapido, lambda: None, "prueba")
+    assert "rapido" not in banco._RAPIDOS
+
+# =========================
+# Exportación nativa
+# =========================
+def test_filas_exportadas_tabla_cruzada(tmp_path):
+    ruta = tmp_path / "grid.csv"
+    with open(ruta, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(["", "Euro", "Yen japonés"])
+        w.writerow(["", "EUR", "JPY"])
+        w.writerow(["02/01/2025", "1,0845", "0,0064"])
+        w.writerow(["2025-01-03", "1,09", ""])
+    filas = list(banco.filas_exportadas(str(ruta)))
+    assert [f["fecha"] for f in filas] == ["02/01/2025", "03/01/2025"]
+    assert filas[0]["columnas"] == [{"name": "Euro", "code": "EUR", "value": "1,0845"},
+                                    {"name": "Yen japonés", "code": "JPY", "value": "0,0064"}]
+    assert filas[1]["columnas"][1] == {"name": "Yen japonés", "code": "JPY", "value": ""}
+
+
+def test_filas_exportadas_formato_largo_utf16(tmp_path):
+    ruta = tmp_path / "largo.csv"
+    ruta.write_text("Fecha;Moneda;Código ISO;Valor\n2025-01-02;Euro;EUR;1,08\n2025-01-02;Yen;JPY;0,0065\n"
+                    "2025-01-03;Euro;EUR;1,1\n", encoding="utf-16")
+    assert list(banco.filas_exportadas(str(ruta))) == [
+        {"fecha": "02/01/2025", "columnas": [{"name": "Euro", "code": "EUR", "value": "1,08"},
+                                             {"name": "Yen", "code": "JPY", "value": "0,0065"}]},
+        {"fecha": "03/01/2025", "columnas": [{"name": "Euro", "code": "EUR", "value": "1,1"}]},
+    ]
+
+
+@pytest.mark.parametrize("formato", ["csv", "xlsx"])
+def test_filas_exportadas_del_simulado(tmp_path, formato):
+    d = banco.datos_simulados("02/01/2025", banco.COMPARADOR_DESDE, "VENTA", CAMBIO, columnas=12, filas=3)
+    ruta = tmp_path / f"grid.{formato}"
+    ruta.write_bytes(banco.exportacion_simulada(d, formato))
+    filas = list(banco.filas_exportadas(str(ruta)))
+    assert [f["fecha"] for f in filas] == [f["fecha"] for f in d["filas"]]
+    for leida, fila in zip(filas, d["filas"]):
+        assert [c["value"] for c in leida["columnas"]] == list(fila["valores"])
+        assert [(c["name"], c["code"]) for c in leida["columnas"]] == \
+            [(c["name"], c["code"]) for c in d["columnas"]]
+
+# =========================
+# Índice de alias
+# =========================
+def test_indice_alias_resuelve_nombres_y_codigos():
+    indice = banco.IndiceAlias()
+    assert indice.resolver("Euro") == "EUR"
+    assert indice.resolver("eur") == "EUR"
+    assert indice.resolver("YEN JAPONES") == "JPY"
+    assert indice.resolver("japonés yen") == "JPY"  # difuso: mismos tokens
+    assert indice.resolver("Moneda inexistente") is None
+    assert indice.resolver("") is None
+
+
+def test_indice_alias_aprende_y_persiste(tmp_path):
+    ruta = str(tmp_path / "alias.json")
+    indice = banco.IndiceAlias(ruta)
+    indice.aprender([{"name": "Won surcoreano", "code": "krw"}, {"name": "Sin código", "code": ""}])
+    assert indice.resolver("won surcoreano") == "KRW"
+    assert indice.resolver("Sin código") is None
+    indice.guardar()
+    otro = banco.IndiceAlias(ruta)
+    assert otro.resolver("Won Surcoreano") == "KRW"
+    assert otro.nombres["KRW"] == "Won surcoreano"
+
+# =========================
+# Salidas estructuradas
+# =========================
+RESULTADOS = [{"moneda": "Euro", "codigo": "EUR", "venta": "1,0845", "valor": Decimal("1.0845")},
+              {"moneda": "Yen japonés", "codigo": "JPY", "venta": None, "valor": None}]
+
+
+def test_registros_tipados():
+    regs = list(banco.registros(_consulta("02/01/2025"), RESULTADOS, "web"))
+    assert regs[0] == {"fecha": "2025-01-02", "codigo": "EUR", "moneda": "Euro", "tasa": "VENTA",
+                       "cambio": CAMBIO, "valor": 1.0845, "texto": "1,0845", "origen": "web"}
+    assert regs[1]["valor"] is None and regs[1]["texto"] == ""
+
+
+def test_salida_jsonl_anexa(tmp_path):
+    ruta = str(tmp_path / "tasas.ndjson")
+    for fecha in ("02/01/2025", "03/01/2025"):
+        salida = banco.abrir_salida(ruta)
+        salida.escribir(banco.registros(_consulta(fecha), RESULTADOS))
+        salida.close()
+    with open(ruta, encoding="utf-8") as f:
+        regs = [json.loads(linea) for linea in f]
+    assert [(r["fecha"], r["codigo"], r["valor"]) for r in regs] == [
+        ("2025-01-02", "EUR", 1.0845), ("2025-01-02", "JPY", None),
+        ("2025-01-03", "EUR", 1.0845), ("2025-01-03", "JPY", None)]
+
+
+def test_salida_csv_un_solo_encabezado(tmp_path):
+    ruta = str(tmp_path / "tasas.csv")
+    for fecha in ("02/01/2025", "03/01/2025"):
+        salida = banco.abrir_salida(ruta)
+        salida.escribir(banco.registros(_consulta(fecha), RESULTADOS))
+        salida.close()
+    with open(ruta, encoding="utf-8", newline="") as f:
+        filas = list(csv.DictReader(f))
+    assert list(filas[0]) == banco.CAMPOS_SALIDA
+    assert [(r["fecha"], r["codigo"], r["valor"]) for r in filas] == [
+        ("2025-01-02", "EUR", "1.0845"), ("2025-01-02", "JPY", ""),
+        ("2025-01-03", "EUR", "1.0845"), ("2025-01-03", "JPY", "")]
+
+
+def test_salida_formato_desconocido(tmp_path):
+    with pytest.raises(ValueError, match="desconocido"):
+        banco.abrir_salida(str(tmp_path / "tasas.txt"))